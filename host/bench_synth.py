@@ -0,0 +1,336 @@
+#####################################################
+# Host benchmark for unipico_synth.py
+#   Measures each SEQSC###.json and MIDISET###.json in SYNTH/
+#   with the host stand-ins of machine, utime, _thread and micropython.
+#
+# Usage: python3 host/bench_synth.py [--output REPORT.json]
+#                                    [--baseline BASE.json] [--tolerance 0.25]
+#                                    [--cpu-scale 20] [--repeat 5]
+#   The report is JSON, --baseline compares the report with a previous one
+#   and exits with 1 when a deterministic measurement regresses (heap bytes beyond
+#   the tolerance, a change of the events, the UART bytes or the virtual-clock lateness,
+#   or a measurement failing which did not fail in the baseline).
+#   The host timings are reported with their changes, they do not fail the comparison.
+#   The SD card driver check ('sd_card') exits with 1 when a sector read differs from the data written.
+#####################################################
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(1, REPO_DIR)
+
+import pico_host
+pico_host.install()
+
+import unipico_synth
+
+SEQ_FILE_PATH = os.path.join(REPO_DIR, 'SYNTH', 'SEQFILE') + os.sep
+MIDI_SET_PATH = os.path.join(REPO_DIR, 'SYNTH', 'MIDIUNIT') + os.sep
+
+# Measurements to compare with a baseline within the tolerance (a larger value is worse)
+COMPARE_KEYS = ['load_heap_bytes', 'load_bin_heap_bytes', 'peak_heap_bytes', 'stream_play_heap_bytes', 'load_play_heap_bytes']
+
+# Measurements which must be the same as the baseline (virtual clock and output bytes)
+EXACT_KEYS = ['events', 'uart_bytes', 'virtual_late_events', 'virtual_max_late_us']
+
+# Host timings, depend on the host machine and the load, reported only
+TIMING_KEYS = ['load_us', 'load_bin_us', 'compile_us', 'send_us', 'cpu_us_per_event', 'cpu_us_per_tick', 'max_late_us']
+
+
+# Make the synthesizer objects
+def make_objects():
+    sdcard_obj = unipico_synth.sdcard_class()
+    unit_midi_obj = unipico_synth.MIDIUnit(0)
+    midi_obj = unipico_synth.midi_class(unit_midi_obj, sdcard_obj)
+    midi_in_player_obj = unipico_synth.midi_in_player_class(midi_obj, sdcard_obj)
+    midi_in_player_obj.set_midi_in_file_path(MIDI_SET_PATH)
+    sequencer_obj = unipico_synth.sequencer_class(midi_obj, sdcard_obj)
+    sequencer_obj.set_sequencer_file_path(SEQ_FILE_PATH)
+    sequencer_obj.setup_sequencer()
+    return (midi_obj, midi_in_player_obj, sequencer_obj)
+
+
+# Median of the elapsed micro seconds to call func repeat times
+def median_us(func, repeat):
+    elapsed = []
+    for rp in range(repeat):
+        time0 = time.perf_counter_ns()
+        func()
+        elapsed.append((time.perf_counter_ns() - time0) // 1000)
+
+    elapsed.sort()
+    return elapsed[len(elapsed) // 2]
+
+
+# Peak traced heap bytes to call func
+def peak_heap(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# File numbers in a directory, 'SEQSC' + '###' + '.json'
+def file_numbers(path, prefix):
+    numbers = []
+    for fname in sorted(os.listdir(path)):
+        if fname.startswith(prefix) and fname.endswith('.json'):
+            numbers.append(int(fname[len(prefix):-5]))
+
+    return numbers
+
+
+# Benchmark a sequence file
+def bench_sequence(num, repeat, cpu_scale):
+    midi_obj, midi_in_player_obj, sequencer_obj = make_objects()
+    sequencer_obj.seq_file_format = sequencer_obj.SEQ_FORMAT_JSON
+    load = lambda: sequencer_obj.sequencer_load_file(SEQ_FILE_PATH, num)
+    report = {'file': 'SEQSC{:0=3d}.json'.format(num)}
+    try:
+        report['load_us'] = median_us(load, repeat)
+        report['load_heap_bytes'] = peak_heap(load)
+
+        # The same file in the binary format, a failure is recorded and the other measurements continue
+        try:
+            with tempfile.TemporaryDirectory() as bin_dir:
+                bin_path = os.path.join(bin_dir, '')
+                if not sequencer_obj.sequencer_write_file(bin_path, num, sequencer_obj.sequencer_read_file(SEQ_FILE_PATH, num), sequencer_obj.SEQ_FORMAT_BINARY):
+                    raise ValueError('can not write the binary format')
+
+                load_bin = lambda: sequencer_obj.sequencer_load_file(bin_path, num)
+                sequencer_obj.seq_file_format = sequencer_obj.SEQ_FORMAT_BINARY
+                report['bin_bytes'] = os.path.getsize(bin_path + sequencer_obj.sequencer_file_name(num, sequencer_obj.SEQ_FORMAT_BINARY))
+                report['load_bin_us'] = median_us(load_bin, repeat)
+                report['load_bin_heap_bytes'] = peak_heap(load_bin)
+
+        except Exception as e:
+            report['bin_error'] = repr(e)
+
+        finally:
+            sequencer_obj.seq_file_format = sequencer_obj.SEQ_FORMAT_JSON
+
+        report['compile_us'] = median_us(sequencer_obj.sequencer_compile, repeat)
+        report['peak_heap_bytes'] = peak_heap(lambda: (load(), sequencer_obj.sequencer_compile()))
+        timeline = sequencer_obj.sequencer_compile()
+        report['events'] = len(timeline)
+
+        # Play streaming the file (the score is not loaded in memory)
+        def stream_play():
+            sequencer_obj.sequencer_stream_file(SEQ_FILE_PATH, num)
+            sequencer_obj.play_sequencer_dry_run()
+            sequencer_obj.sequencer_stream_close()
+
+        report['stream_play_heap_bytes'] = peak_heap(stream_play)
+        report['load_play_heap_bytes'] = peak_heap(lambda: (load(), sequencer_obj.play_sequencer_dry_run()))
+
+        # Virtual time play, the CPU time is measured apart from the virtual time
+        time0 = time.process_time_ns()
+        sent = sequencer_obj.play_sequencer_dry_run()
+        cpu_us = (time.process_time_ns() - time0) // 1000
+        play_us = timeline[-1][0] if len(timeline) > 0 else 0
+        ticks = play_us // sequencer_obj.sequencer_tick_us() + 1
+        sent_bytes = sum([len(data) for us, data in sent])
+        report['play_us'] = play_us
+        report['cpu_us'] = cpu_us
+        report['cpu_us_per_event'] = cpu_us / max(len(timeline), 1)
+        report['cpu_us_per_tick'] = cpu_us / ticks
+        report['uart_bytes'] = sent_bytes
+        report['uart_bytes_per_sec'] = sent_bytes * 1000000 / play_us if play_us > 0 else 0
+
+        # Lateness on the virtual clock only (same on any host)
+        stats = sequencer_obj.get_play_stats()
+        report['virtual_late_events'] = stats['late_events']
+        report['virtual_max_late_us'] = stats['max_late_us']
+
+        # Lateness with the host processing time scaled to the target
+        sequencer_obj.play_sequencer_dry_run(cpu_scale)
+        stats = sequencer_obj.get_play_stats()
+        report['late_events'] = stats['late_events']
+        report['max_late_us'] = stats['max_late_us']
+        report['total_late_us'] = stats['total_late_us']
+
+    except Exception as e:
+        report['error'] = repr(e)
+
+    return report
+
+
+# Benchmark a MIDI-IN settings file
+def bench_midi_set(num, repeat):
+    midi_obj, midi_in_player_obj, sequencer_obj = make_objects()
+    load = lambda: midi_in_player_obj.read_midi_in_settings(num)
+    report = {'file': 'MIDISET{:0=3d}.json'.format(num)}
+    try:
+        report['load_us'] = median_us(load, repeat)
+        report['peak_heap_bytes'] = peak_heap(load)
+
+        # Bytes to send all the channel settings
+        midi_in_player_obj.set_midi_in_setting(load())
+        uart = midi_obj.synth._uart
+        sent0 = len(uart.sent)
+        report['send_us'] = median_us(midi_in_player_obj.send_all_midi_in_settings, repeat)
+        report['uart_bytes'] = (len(uart.sent) - sent0) // repeat
+
+    except Exception as e:
+        report['error'] = repr(e)
+
+    return report
+
+
+# Check the SD card driver with the sector cache, the write-back buffer and the read-ahead on
+#   Writes mixed with sequential reads are compared with a copy of the card image,
+#   the sectors are read before and after the flush, and a pinned range read in a row is cached.
+#   Returns the check report, 'mismatches' must be 0
+def check_sd_card(seed=1, rounds=200):
+    import random
+    import sdcard
+    from pico_host import devices, machine
+
+    blocks = 1024
+    image = bytearray(blocks * 512)
+    for num in range(blocks):
+        image[num * 512 : num * 512 + 4] = num.to_bytes(4, 'little')
+
+    shadow = bytearray(image)
+    machine.attach_spi_device(1, devices.sd_card_model(image))
+    sd = sdcard.SDCard(machine.SPI(1), machine.Pin(9, machine.Pin.OUT), cache_blocks=16, write_blocks=8, readahead_blocks=8)
+    # The pinned sectors read in a row are all cached
+    sd.pin(32, 8)
+    buf = bytearray(512)
+    for num in range(32, 40):
+        sd.readblocks(num, buf)
+    pinned_cached = len([num for num in range(32, 40) if num in sd.cache])
+
+    rnd = random.Random(seed)
+    mismatches = []
+    for rnd_num in range(rounds):
+        # Write the sectors ahead of a sequential read
+        first = rnd.randrange(1, blocks - 16) if rnd_num % 4 else 32
+        for i in range(rnd.randrange(1, 4)):
+            num = first + rnd.randrange(0, 12)
+            data = bytes([rnd.randrange(256)]) * 512
+            sd.writeblocks(num, data)
+            shadow[num * 512 : (num + 1) * 512] = data
+
+        for flush in range(2):
+            for num in range(first, first + 12):
+                sd.readblocks(num, buf)
+                if buf != shadow[num * 512 : (num + 1) * 512]:
+                    mismatches.append((rnd_num, num))
+            if flush == 0 and rnd.randrange(2):
+                sd.ioctl(3, 0)
+
+    sd.ioctl(3, 0)
+    written = [num for num in range(blocks) if image[num * 512 : (num + 1) * 512] != shadow[num * 512 : (num + 1) * 512]]
+    return {'mismatches': len(mismatches), 'first_mismatches': mismatches[:5], 'unwritten_blocks': len(written),
+            'pinned_cached': pinned_cached,
+            'readahead': sd.readahead_stats, 'cache': sd.cache_stats}
+
+
+# Compare a report with a baseline report
+#   keys : Measurements to compare
+#   exact: True to compare the values to be the same, False to compare within the tolerance
+#   Returns [(file, key, baseline value, value), ..] regressed
+def compare(report, baseline, tolerance, keys=COMPARE_KEYS, exact=False):
+    base_files = {}
+    for section in ['sequences', 'midi_sets']:
+        for item in baseline.get(section, []):
+            base_files[item['file']] = item
+
+    regressions = []
+    for section in ['sequences', 'midi_sets']:
+        for item in report[section]:
+            base = base_files.get(item['file'])
+            if base is None:
+                continue
+
+            for ky in keys:
+                if ky in item and ky in base:
+                    if exact:
+                        if item[ky] != base[ky]:
+                            regressions.append((item['file'], ky, base[ky], item[ky]))
+
+                    elif base[ky] > 0 and item[ky] > base[ky] * (1 + tolerance):
+                        regressions.append((item['file'], ky, base[ky], item[ky]))
+
+    return regressions
+
+
+# Errors of a report not in a baseline report
+#   Returns [(file, key, None, error), ..] of the measurements failed newly
+def compare_errors(report, baseline):
+    base_files = {}
+    for section in ['sequences', 'midi_sets']:
+        for item in baseline.get(section, []):
+            base_files[item['file']] = item
+
+    regressions = []
+    for section in ['sequences', 'midi_sets']:
+        for item in report[section]:
+            base = base_files.get(item['file'], {})
+            for ky in ['error', 'bin_error']:
+                if ky in item and not ky in base:
+                    regressions.append((item['file'], ky, None, item[ky]))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host benchmark for unipico_synth.py')
+    parser.add_argument('--output', help='report file (default: stdout)')
+    parser.add_argument('--baseline', help='baseline report to compare')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='regression tolerance ratio')
+    parser.add_argument('--cpu-scale', type=float, default=20, help='host to target CPU time ratio for lateness')
+    parser.add_argument('--repeat', type=int, default=5, help='repeat count for the timings')
+    args = parser.parse_args()
+
+    report = {'python': sys.version.split()[0], 'cpu_scale': args.cpu_scale, 'sequences': [], 'midi_sets': []}
+
+    # The synthesizer prints its progress, keep the report clean
+    with contextlib.redirect_stdout(io.StringIO()):
+        for num in file_numbers(SEQ_FILE_PATH, 'SEQSC'):
+            report['sequences'].append(bench_sequence(num, args.repeat, args.cpu_scale))
+
+        for num in file_numbers(MIDI_SET_PATH, 'MIDISET'):
+            report['midi_sets'].append(bench_midi_set(num, args.repeat))
+
+        report['sd_card'] = check_sd_card()
+
+    exit_code = 0
+    if report['sd_card']['mismatches'] > 0 or report['sd_card']['unwritten_blocks'] > 0 or report['sd_card']['pinned_cached'] < 8:
+        exit_code = 1
+
+    if not args.baseline is None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(report, baseline, args.tolerance) + compare(report, baseline, args.tolerance, EXACT_KEYS, True) + compare_errors(report, baseline)
+        timings = compare(report, baseline, args.tolerance, TIMING_KEYS)
+        report['regressions'] = [{'file': fname, 'key': ky, 'baseline': base, 'value': value} for fname, ky, base, value in regressions]
+        report['timing_changes'] = [{'file': fname, 'key': ky, 'baseline': base, 'value': value} for fname, ky, base, value in timings]
+        if len(regressions) > 0:
+            exit_code = 1
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
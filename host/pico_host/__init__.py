@@ -0,0 +1,51 @@
+#####################################################
+# Host hardware abstraction for the PICO synthesizer
+#   install() puts the stand-ins of machine, utime, _thread and micropython
+#   in place of the MicroPython modules, attaches the device models:
+#     I2C1 0x3E: AQM0802A LCD,  I2C0 82: Joy stick,  SPI0: SD card
+#   and mounts '/SD' on a host directory.
+#
+#   import pico_host
+#   pico_host.install(sd_root='.')
+#   import unipico_synth
+#####################################################
+import os
+import sys
+
+from . import micropython
+from . import utime
+from . import thread
+from . import machine
+from . import devices
+from . import fs
+
+# Device models attached by install()
+lcd = None
+joystick = None
+sd_card = None
+
+
+# Install the host stand-ins
+#   sd_root        : Host directory mounted as '/SD' (the directory having SYNTH/)
+#   joystick_script: [(seconds, x, y, b), ..] joy stick operations
+#   sd_image       : SD card image (bytearray or file name, None: blank card)
+#   sd_max_baudrate: SPI clock the SD card works at (None: no limit)
+def install(sd_root=None, joystick_script=None, sd_image=None, sd_max_baudrate=None):
+    global lcd, joystick, sd_card
+
+    sys.modules['micropython'] = micropython
+    sys.modules['utime'] = utime
+    sys.modules['_thread'] = thread
+    sys.modules['machine'] = machine
+
+    machine.detach_all_devices()
+    lcd = devices.aqm0802a_lcd_model()
+    joystick = devices.joystick_model(joystick_script)
+    sd_card = devices.sd_card_model(sd_image, max_baudrate=sd_max_baudrate)
+    machine.attach_i2c_device(1, 0x3E, lcd)
+    machine.attach_i2c_device(0, 82, joystick)
+    machine.attach_spi_device(0, sd_card)
+
+    if not sd_root is None:
+        fs.set_mount_root('/SD', os.path.abspath(sd_root))
+    fs.install()
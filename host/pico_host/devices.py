@@ -0,0 +1,292 @@
+#####################################################
+# Host device models for the PICO synthesizer
+#   aqm0802a_lcd_model: AQM0802A (ST7032) 8x2 character LCD on I2C
+#   joystick_model    : M5Stack joystick unit on I2C (address 82)
+#   sd_card_model     : SD card in SPI mode with a backing image
+#####################################################
+from . import utime
+
+
+########################
+# AQM0802A LCD model
+#   writeto_mem(address, 0x00, command) / writeto(address, [0x00, command]): instruction
+#   writeto_mem(address, 0x40, data): character at the cursor
+########################
+class aqm0802a_lcd_model:
+    def __init__(self):
+        self.ddram = bytearray(b' ' * 0x80)     # Display data RAM, line 1: 0x00.., line 2: 0x40..
+        self.cursor = 0
+        self.instruction_set = 0
+        self.contrast = 0
+        self.stats = {'commands': 0, 'chars': 0}
+
+    # Displayed lines
+    def lines(self):
+        return [self.ddram[0x00:0x08].decode(), self.ddram[0x40:0x48].decode()]
+
+    def _command(self, cmd):
+        self.stats['commands'] += 1
+        if cmd == 0x01:                     # Clear display
+            self.ddram[:] = b' ' * 0x80
+            self.cursor = 0
+        elif cmd & 0xFE == 0x02:            # Return home
+            self.cursor = 0
+        elif cmd & 0x80:                    # Set DDRAM address
+            self.cursor = cmd & 0x7F
+        elif cmd & 0xE0 == 0x20:            # Function set (IS: instruction table)
+            self.instruction_set = cmd & 0x01
+        elif cmd & 0xF0 == 0x70 and self.instruction_set:
+            self.contrast = (self.contrast & 0x30) | (cmd & 0x0F)
+        elif cmd & 0xF0 == 0x50 and self.instruction_set:
+            self.contrast = (self.contrast & 0x0F) | ((cmd & 0x03) << 4)
+
+    def _data(self, data):
+        for ch in data:
+            self.stats['chars'] += 1
+            self.ddram[self.cursor] = ch
+            self.cursor = (self.cursor + 1) & 0x7F
+
+    def read(self, nbytes):
+        return bytes(nbytes)
+
+    def write(self, buf):
+        if len(buf) >= 2:
+            self.write_mem(buf[0], buf[1:])
+
+    def write_mem(self, memaddr, buf):
+        if memaddr == 0x40:
+            self._data(buf)
+        else:
+            for cmd in buf:
+                self._command(cmd)
+
+
+########################
+# Joy stick model
+#   readfrom(82, 3) returns x, y (0..255, neutral 127) and the button (0/1).
+#   A script [(seconds, x, y, b), ..] changes the values at the time since the start.
+########################
+class joystick_model:
+    def __init__(self, script=None):
+        self.x = 127
+        self.y = 127
+        self.b = 0
+        self.script = sorted(script or [])
+        self.start_ms = utime.ticks_ms()
+        self.stats = {'reads': 0}
+
+    # Set the values now
+    def set(self, x=None, y=None, b=None):
+        if not x is None:
+            self.x = x
+        if not y is None:
+            self.y = y
+        if not b is None:
+            self.b = b
+
+    # Script finished
+    def finished(self):
+        return len(self.script) == 0
+
+    def read(self, nbytes):
+        self.stats['reads'] += 1
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self.start_ms) / 1000
+        while len(self.script) > 0 and self.script[0][0] <= elapsed:
+            tm, x, y, b = self.script.pop(0)
+            self.set(x, y, b)
+
+        return bytes([self.x, self.y, self.b])[:nbytes]
+
+    def write(self, buf):
+        pass
+
+    def write_mem(self, memaddr, buf):
+        pass
+
+
+########################
+# SD card model (SPI mode, SDHC)
+#   image : Backing image, a bytearray or a file name opened with 'r+b'
+#   blocks: Number of 512 bytes blocks when the image is None
+#   read_wait_bytes : 0xFF bytes before a data token (Nac)
+#   write_busy_bytes: Busy (0x00) bytes after a data block is written
+#   max_baudrate    : SPI clock the card works at, a bit of every CORRUPT_INTERVAL bytes
+#                     sent is flipped at a faster clock (None: no limit)
+########################
+class sd_card_model:
+    def __init__(self, image=None, blocks=65536, read_wait_bytes=1, write_busy_bytes=4, max_baudrate=None):
+        self.BLOCK_SIZE = 512
+        if image is None:
+            image = bytearray(blocks * self.BLOCK_SIZE)
+
+        if isinstance(image, str):
+            self.image = open(image, 'r+b')
+            self.image.seek(0, 2)
+            self.blocks = self.image.tell() // self.BLOCK_SIZE
+        else:
+            self.image = image
+            self.blocks = len(image) // self.BLOCK_SIZE
+
+        self.read_wait_bytes = read_wait_bytes
+        self.write_busy_bytes = write_busy_bytes
+        self.max_baudrate = max_baudrate
+        self.CORRUPT_INTERVAL = 257
+        self.clock = 0              # SPI clock (see machine.SPI)
+        self.sent = 0               # Bytes sent at the clock over max_baudrate
+
+        self.idle = True            # In the idle state until ACMD41
+        self.app_cmd = False        # CMD55 received
+        self.command = bytearray()  # Command bytes receiving
+        self.output = bytearray()   # Bytes to send
+        self.read_block = None      # Next block of CMD18 (None: no multiple block read)
+        self.write_block = None     # Block to write by CMD24/CMD25 (None: no write)
+        self.write_multi = False    # CMD25
+        self.write_data = None      # Data block receiving (None: waiting for a token)
+        self.stats = {'commands': 0, 'blocks_read': 0, 'blocks_written': 0, 'multi_reads': 0, 'multi_writes': 0, 'corrupted': 0}
+
+    def set_clock(self, baudrate):
+        self.clock = baudrate
+
+    def close(self):
+        if not isinstance(self.image, (bytes, bytearray)):
+            self.image.close()
+
+    def _read(self, block):
+        self.stats['blocks_read'] += 1
+        if isinstance(self.image, bytearray):
+            return bytes(self.image[block * self.BLOCK_SIZE:(block + 1) * self.BLOCK_SIZE])
+
+        self.image.seek(block * self.BLOCK_SIZE)
+        return self.image.read(self.BLOCK_SIZE)
+
+    def _write(self, block, data):
+        self.stats['blocks_written'] += 1
+        if isinstance(self.image, bytearray):
+            self.image[block * self.BLOCK_SIZE:(block + 1) * self.BLOCK_SIZE] = data
+        else:
+            self.image.seek(block * self.BLOCK_SIZE)
+            self.image.write(data)
+
+    # Queue a data block with the start token
+    def _send_block(self, data):
+        self.output.extend(b'\xff' * self.read_wait_bytes)
+        self.output.append(0xFE)
+        self.output.extend(data)
+        self.output.extend(b'\xff\xff')
+
+    # Execute a command, then queue the response
+    def _execute(self, cmd, arg):
+        self.stats['commands'] += 1
+        r1 = 0x01 if self.idle else 0x00
+        response = [r1]
+        app_cmd = self.app_cmd
+        self.app_cmd = False
+
+        if cmd == 0:                        # GO_IDLE_STATE
+            self.idle = True
+            response = [0x01]
+        elif cmd == 8:                      # SEND_IF_COND
+            response = [r1, 0x00, 0x00, 0x01, arg & 0xFF]
+        elif cmd == 55:                     # APP_CMD
+            self.app_cmd = True
+        elif cmd == 41 and app_cmd:         # SD_SEND_OP_COND
+            self.idle = False
+            response = [0x00]
+        elif cmd == 58:                     # READ_OCR (powered up, CCS: SDHC)
+            response = [r1, 0xC0, 0xFF, 0x80, 0x00]
+        elif cmd == 9:                      # SEND_CSD (version 2.0)
+            csd = bytearray(16)
+            csd[0] = 0x40
+            c_size = self.blocks // 1024 - 1
+            csd[7] = (c_size >> 16) & 0x3F
+            csd[8] = (c_size >> 8) & 0xFF
+            csd[9] = c_size & 0xFF
+            self.output.extend(b'\xff' + bytes(response))
+            self._send_block(csd)
+            return
+        elif cmd == 16:                     # SET_BLOCKLEN
+            response = [0x00 if arg == self.BLOCK_SIZE else 0x40]
+        elif cmd == 17 or cmd == 18:        # READ_SINGLE_BLOCK, READ_MULTIPLE_BLOCK
+            if arg >= self.blocks:
+                response = [0x20]           # Address error
+            else:
+                self.output.extend(b'\xff\x00')
+                self._send_block(self._read(arg))
+                if cmd == 18:
+                    self.stats['multi_reads'] += 1
+                    self.read_block = arg + 1
+                return
+        elif cmd == 12:                     # STOP_TRANSMISSION (a stuff byte before R1)
+            self.read_block = None
+            self.output = bytearray(b'\xff\xff\x00')
+            return
+        elif cmd == 24 or cmd == 25:        # WRITE_BLOCK, WRITE_MULTIPLE_BLOCK
+            if arg >= self.blocks:
+                response = [0x20]
+            else:
+                self.write_block = arg
+                self.write_multi = cmd == 25
+                if self.write_multi:
+                    self.stats['multi_writes'] += 1
+                response = [0x00]
+        else:
+            response = [r1 | 0x04]          # Illegal command
+
+        self.output.extend(b'\xff' + bytes(response))
+
+    # Exchange a byte on the SPI bus
+    def exchange(self, byte):
+        # Receiving a data block to write
+        if not self.write_data is None:
+            self.write_data.append(byte)
+            if len(self.write_data) == self.BLOCK_SIZE + 2:
+                if self.write_block < self.blocks:
+                    self._write(self.write_block, bytes(self.write_data[:self.BLOCK_SIZE]))
+                self.write_block = self.write_block + 1
+                self.write_data = None
+                self.output = bytearray(b'\x05' + b'\x00' * self.write_busy_bytes + b'\xff')
+                if not self.write_multi:
+                    self.write_block = None
+            return 0xFF
+
+        # Receiving a command
+        elif len(self.command) > 0 or (byte & 0xC0 == 0x40 and (len(self.output) == 0 or not self.read_block is None)):
+            self.command.append(byte)
+            if len(self.command) == 6:
+                cmd = self.command[0] & 0x3F
+                arg = int.from_bytes(self.command[1:5], 'big')
+                self.command = bytearray()
+                self.output = bytearray()
+                self._execute(cmd, arg)
+            return 0xFF
+
+        # Data tokens of CMD24/CMD25
+        elif not self.write_block is None and len(self.output) == 0:
+            if byte == 0xFE or byte == 0xFC:
+                self.write_data = bytearray()
+            elif byte == 0xFD:
+                self.write_block = None
+                self.write_multi = False
+                self.output = bytearray(b'\xff' + b'\x00' * self.write_busy_bytes + b'\xff')
+            return 0xFF
+
+        # Next block of CMD18
+        if len(self.output) == 0 and not self.read_block is None:
+            if self.read_block < self.blocks:
+                self._send_block(self._read(self.read_block))
+                self.read_block = self.read_block + 1
+
+        if len(self.output) == 0:
+            return 0xFF
+
+        out = self.output[0]
+        del self.output[0]
+
+        # Too fast clock
+        if not self.max_baudrate is None and self.clock > self.max_baudrate:
+            self.sent += 1
+            if self.sent % self.CORRUPT_INTERVAL == 0:
+                self.stats['corrupted'] += 1
+                out ^= 0x01
+
+        return out
@@ -0,0 +1,91 @@
+#####################################################
+# Host file system for the mount points
+#   os.mount(block_device, '/SD') checks the block device (reads the block 0),
+#   then the files under '/SD' are the files under a host directory.
+#   The block device does not hold a FAT file system on the host.
+#####################################################
+import builtins
+import os
+
+# Mount points: {'/SD': host directory}
+_mounts = {}
+
+# Host directory of the mount point to mount next (see set_mount_root())
+_mount_root = {}
+
+# Original functions
+_open = builtins.open
+_os_funcs = {}
+
+
+# Host directory for a mount point
+def set_mount_root(point, host_dir):
+    _mount_root[point] = host_dir
+
+# Host path of a path on the device
+def host_path(path):
+    if isinstance(path, str):
+        for point, host_dir in _mounts.items():
+            if path == point or path.startswith(point + '/'):
+                return os.path.join(host_dir, path[len(point):].lstrip('/'))
+
+    return path
+
+def mount(device, point, readonly=False):
+    if not point in _mount_root:
+        raise OSError(19)
+
+    # Check the block device as the FAT driver does
+    if hasattr(device, 'readblocks'):
+        device.readblocks(0, bytearray(512))
+
+    _mounts[point] = _mount_root[point]
+
+def umount(point):
+    if not point in _mounts:
+        raise OSError(22)
+
+    del _mounts[point]
+
+def _wrap_path_func(func):
+    def wrapped(path, *args, **kwargs):
+        return func(host_path(path), *args, **kwargs)
+
+    return wrapped
+
+def _rename(src, dst):
+    return _os_funcs['rename'](host_path(src), host_path(dst))
+
+def _open_mapped(file, *args, **kwargs):
+    return _open(host_path(file), *args, **kwargs)
+
+def _sync():
+    pass
+
+
+# Put the mount functions in the host 'os' and 'builtins.open'
+def install():
+    if len(_os_funcs) > 0:
+        return
+
+    for name in ['listdir', 'stat', 'remove', 'mkdir', 'rmdir', 'rename']:
+        _os_funcs[name] = getattr(os, name)
+
+    for name in ['listdir', 'stat', 'remove', 'mkdir', 'rmdir']:
+        setattr(os, name, _wrap_path_func(_os_funcs[name]))
+
+    os.rename = _rename
+    os.mount = mount
+    os.umount = umount
+    if not hasattr(os, 'sync'):
+        os.sync = _sync
+    builtins.open = _open_mapped
+
+# Restore the host 'os' and 'builtins.open'
+def uninstall():
+    for name, func in _os_funcs.items():
+        setattr(os, name, func)
+
+    _os_funcs.clear()
+    _mounts.clear()
+    builtins.open = _open
@@ -0,0 +1,192 @@
+#####################################################
+# Host stand-in of the MicroPython 'machine' module
+#   I2C and SPI buses talk to the device models attached to them,
+#   see devices.py and attach_i2c_device() / attach_spi_device().
+#####################################################
+from . import utime
+from . import thread as _thread
+
+
+# Device models attached to the buses
+#   _i2c_devices: {unit: {address: device}}, device has read(nbytes), write(buf) and write_mem(memaddr, buf)
+#   _spi_devices: {unit: device}, device has exchange(byte) -> byte
+#                 and optionally set_clock(baudrate) called when the SPI clock is set
+_i2c_devices = {}
+_spi_devices = {}
+
+
+# Attach an I2C device model at an address of an I2C unit
+def attach_i2c_device(unit, address, device):
+    _i2c_devices.setdefault(unit, {})[address] = device
+
+# Attach an SPI device model to an SPI unit
+def attach_spi_device(unit, device):
+    _spi_devices[unit] = device
+
+# Detach all device models
+def detach_all_devices():
+    _i2c_devices.clear()
+    _spi_devices.clear()
+
+
+########################
+# Pin
+########################
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.pin_id = pin_id
+        self.mode = mode
+        self._value = 0 if value is None else value
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if not value is None:
+            self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+
+        self._value = value
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+########################
+# UART
+#   Data written is captured in 'sent' (and 'log' with the tick time),
+#   inject() puts data to be read.
+########################
+class UART:
+    # The latest UART object of each unit
+    units = {}
+
+    def __init__(self, unit, baudrate=9600, **kwargs):
+        self.unit = unit
+        self.baudrate = baudrate
+        self.sent = bytearray()         # Data written
+        self.log = []                   # [(ticks_us, bytes), ..] data written
+        self.received = bytearray()     # Data to be read
+        self._lock = _thread.allocate_lock()
+        UART.units[unit] = self
+
+    # Put data to be read
+    def inject(self, data):
+        with self._lock:
+            self.received.extend(data)
+
+    # Clear the captured data
+    def clear(self):
+        self.sent = bytearray()
+        self.log = []
+
+    def write(self, data):
+        data = bytes(data)
+        self.sent.extend(data)
+        self.log.append((utime.ticks_us(), data))
+        return len(data)
+
+    def any(self):
+        return len(self.received)
+
+    def read(self, nbytes=None):
+        with self._lock:
+            if len(self.received) == 0:
+                return None
+
+            if nbytes is None:
+                nbytes = len(self.received)
+
+            data = bytes(self.received[:nbytes])
+            del self.received[:nbytes]
+
+        return data
+
+
+########################
+# I2C
+########################
+class I2C:
+    def __init__(self, unit, scl=None, sda=None, freq=400000):
+        self.unit = unit
+        self.freq = freq
+
+    def _device(self, address):
+        device = _i2c_devices.get(self.unit, {}).get(address)
+        if device is None:
+            raise OSError(19)   # ENODEV
+
+        return device
+
+    def scan(self):
+        return sorted(_i2c_devices.get(self.unit, {}).keys())
+
+    def readfrom(self, address, nbytes):
+        return self._device(address).read(nbytes)
+
+    def writeto(self, address, buf):
+        self._device(address).write(bytes(buf))
+        return 1
+
+    def writeto_mem(self, address, memaddr, buf):
+        self._device(address).write_mem(memaddr, bytes(buf))
+
+
+########################
+# SPI
+#   Full duplex, each byte written is exchanged with a byte read.
+#   'stats' counts the bytes and the bus time at the baudrate.
+########################
+class SPI:
+    def __init__(self, unit, baudrate=1000000, sck=None, mosi=None, miso=None, **kwargs):
+        self.unit = unit
+        self.baudrate = baudrate
+        self.stats = {'bytes': 0, 'bus_us': 0}
+        self._set_clock()
+
+    def init(self, baudrate=1000000, **kwargs):
+        self.baudrate = baudrate
+        self._set_clock()
+
+    def _set_clock(self):
+        device = _spi_devices.get(self.unit)
+        if hasattr(device, 'set_clock'):
+            device.set_clock(self.baudrate)
+
+    def _exchange(self, byte):
+        self.stats['bytes'] += 1
+        self.stats['bus_us'] += 8000000 / self.baudrate
+        device = _spi_devices.get(self.unit)
+        if device is None:
+            return 0xFF
+
+        return device.exchange(byte)
+
+    def write(self, buf):
+        for byte in bytes(buf):
+            self._exchange(byte)
+
+    def read(self, nbytes, write=0x00):
+        return bytes([self._exchange(write) for i in range(nbytes)])
+
+    def readinto(self, buf, write=0x00):
+        for i in range(len(buf)):
+            buf[i] = self._exchange(write)
+
+    def write_readinto(self, write_buf, read_buf):
+        write_buf = bytes(write_buf)
+        for i in range(len(read_buf)):
+            read_buf[i] = self._exchange(write_buf[i])
@@ -0,0 +1,18 @@
+#####################################################
+# Host stand-in of the MicroPython 'micropython' module
+#####################################################
+
+# Constant declaration (a plain value on the host)
+def const(value):
+    return value
+
+# Functions for the native code emitters (no effect on the host)
+def native(func):
+    return func
+
+def viper(func):
+    return func
+
+# Memory information (not available on the host)
+def mem_info(verbose=None):
+    print('mem_info: not available on the host')
@@ -0,0 +1,31 @@
+#####################################################
+# Host stand-in of the MicroPython '_thread' module
+#   CPython has a built-in '_thread', install() puts this module in its place
+#   for the application. The threads started can be profiled (see set_profiler()).
+#####################################################
+import threading
+from _thread import allocate_lock, get_ident, LockType
+
+# cProfile.Profile object to profile the threads started (None: not profiled)
+_profiler = None
+
+
+# Profile the threads started by start_new_thread()
+def set_profiler(profiler):
+    global _profiler
+    _profiler = profiler
+
+def start_new_thread(func, args, kwargs=None):
+    profiler = _profiler
+    def run():
+        if profiler is None:
+            func(*args, **(kwargs or {}))
+        else:
+            profiler.runcall(func, *args, **(kwargs or {}))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread.ident
+
+def exit():
+    raise SystemExit
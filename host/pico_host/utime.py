@@ -0,0 +1,60 @@
+#####################################################
+# Host stand-in of the MicroPython 'utime' module
+#   Ticks wrap around at TICKS_PERIOD as on the RP2040,
+#   so the wraparound handling of the callers is exercised.
+#   MicroPython 'time' is the same module as 'utime', the tick functions
+#   are added to the host 'time' module when this module is imported.
+#####################################################
+import time as _time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+# Tick offset to start near the wraparound point (see set_ticks_offset())
+_ticks_offset = 0
+
+
+# Start the ticks at an offset, e.g. TICKS_PERIOD - 1000000 wraps in a second
+def set_ticks_offset(us):
+    global _ticks_offset
+    _ticks_offset = us
+
+def ticks_us():
+    return (_time.perf_counter_ns() // 1000 + _ticks_offset) & TICKS_MAX
+
+def ticks_ms():
+    return (_time.perf_counter_ns() // 1000000 + _ticks_offset // 1000) & TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+def sleep(seconds):
+    if seconds > 0:
+        _time.sleep(seconds)
+
+def sleep_ms(ms):
+    if ms > 0:
+        _time.sleep(ms / 1000)
+
+def sleep_us(us):
+    if us > 0:
+        _time.sleep(us / 1000000)
+
+def time():
+    return int(_time.time())
+
+def localtime(secs=None):
+    return _time.localtime(secs)[:8]
+
+
+# MicroPython 'time' has the same tick functions
+for _name in ['ticks_us', 'ticks_ms', 'ticks_cpu', 'ticks_add', 'ticks_diff', 'sleep_ms', 'sleep_us']:
+    if not hasattr(_time, _name):
+        setattr(_time, _name, globals()[_name])
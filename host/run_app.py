@@ -0,0 +1,126 @@
+#####################################################
+# Run unipico_synth.py on the host under cProfile
+#   The application runs as __main__ with the pico_host device models,
+#   including app_loop() and device_control_thread() in its own thread.
+#   The application is stopped after the duration (as Ctrl-C on the device).
+#
+# Usage: python3 host/run_app.py [--duration 10] [--joystick 'SEC:X,Y,B;..']
+#                                [--midi-in 'SEC:HEX;..'] [--sd-root DIR]
+#                                [--profile OUT.prof] [--sort cumulative] [--limit 30]
+#   --joystick: Joy stick values at the seconds since the start,
+#               e.g. '1:127,0,0;1.2:127,127,0' moves the menu up once.
+#   --midi-in : MIDI-IN data at the seconds, e.g. '2:903c64;2.5:803c00'
+#####################################################
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import runpy
+import sys
+import threading
+import _thread as host_thread
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(1, REPO_DIR)
+
+import pico_host
+
+# Select SEQ:PLAY from the initial menu (MIN:LOAD) after the start-up (SD card clock tuning included),
+# then push the button to play the file 000
+DEFAULT_JOYSTICK = ';'.join(['{}:127,0,0;{}:127,127,0'.format(1.0 + i * 0.2, 1.1 + i * 0.2) for i in range(6)]) + ';2.5:127,127,1;3:127,127,0'
+
+
+# 'SEC:V;SEC:V;..' to [(seconds, 'V'), ..]
+def parse_script(text):
+    script = []
+    for item in text.split(';'):
+        item = item.strip()
+        if len(item) > 0:
+            sec, value = item.split(':')
+            script.append((float(sec), value))
+
+    return script
+
+
+# Inject MIDI-IN data to the UART at the times
+def midi_in_feeder(script, stop_event):
+    for sec, data in sorted(script):
+        if stop_event.wait(sec - feeder_elapsed()):
+            return
+
+        uart = pico_host.machine.UART.units.get(0)
+        if not uart is None:
+            uart.inject(bytes.fromhex(data))
+
+
+def feeder_elapsed():
+    return pico_host.utime.ticks_diff(pico_host.utime.ticks_ms(), start_ms) / 1000
+
+
+def main():
+    global start_ms
+
+    parser = argparse.ArgumentParser(description='Run unipico_synth.py on the host under cProfile')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--joystick', default=DEFAULT_JOYSTICK, help="joy stick script 'SEC:X,Y,B;..'")
+    parser.add_argument('--midi-in', default='', help="MIDI-IN script 'SEC:HEX;..'")
+    parser.add_argument('--sd-root', default=REPO_DIR, help='host directory mounted as /SD')
+    parser.add_argument('--profile', help='write the profile data (pstats) to the file')
+    parser.add_argument('--sort', default='cumulative', help='sort key of the profile report')
+    parser.add_argument('--limit', type=int, default=30, help='lines of the profile report')
+    parser.add_argument('--quiet', action='store_true', help='hide the application output')
+    args = parser.parse_args()
+
+    joystick_script = [(sec, *[int(v) for v in value.split(',')]) for sec, value in parse_script(args.joystick)]
+    pico_host.install(sd_root=args.sd_root, joystick_script=joystick_script)
+    start_ms = pico_host.utime.ticks_ms()
+
+    # Profile the main thread and the device control thread
+    main_profiler = cProfile.Profile()
+    thread_profiler = cProfile.Profile()
+    pico_host.thread.set_profiler(thread_profiler)
+
+    stop_event = threading.Event()
+    timer = threading.Timer(args.duration, host_thread.interrupt_main)
+    timer.start()
+    feeder = threading.Thread(target=midi_in_feeder, args=(parse_script(args.midi_in), stop_event), daemon=True)
+    feeder.start()
+
+    app_output = io.StringIO()
+    stdout = sys.stdout
+    if args.quiet:
+        sys.stdout = app_output
+
+    try:
+        main_profiler.runcall(runpy.run_path, os.path.join(REPO_DIR, 'unipico_synth.py'), run_name='__main__')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = stdout
+        timer.cancel()
+        stop_event.set()
+
+    # Report
+    uart = pico_host.machine.UART.units.get(0)
+    print('LCD:', pico_host.lcd.lines())
+    print('LCD stats:', pico_host.lcd.stats)
+    print('Joy stick reads:', pico_host.joystick.stats['reads'])
+    print('SD card stats:', pico_host.sd_card.stats)
+    if not uart is None:
+        print('UART bytes sent:', len(uart.sent), 'writes:', len(uart.log))
+
+    stats = pstats.Stats(main_profiler)
+    if thread_profiler.getstats():
+        stats.add(thread_profiler)
+
+    if not args.profile is None:
+        stats.dump_stats(args.profile)
+
+    stats.sort_stats(args.sort).print_stats(args.limit)
+
+
+if __name__ == '__main__':
+    main()
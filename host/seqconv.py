@@ -0,0 +1,81 @@
+#####################################################
+# Convert sequencer files between SEQSC###.json and SEQSC###.bin,
+# or export them to Standard MIDI Files
+#
+# Usage: python3 host/seqconv.py {bin|json|mid} [NUM ..] [--path SYNTH/SEQFILE] [--no-unroll]
+#   bin : SEQSC###.json to SEQSC###.bin
+#   json: SEQSC###.bin to SEQSC###.json
+#   mid : SEQSC###.json or .bin to SEQSC###.MID (repeats unrolled without --no-unroll)
+#   All the files in the path are converted without NUM.
+#####################################################
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(1, REPO_DIR)
+
+import pico_host
+pico_host.install()
+
+import unipico_synth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert sequencer files between JSON and binary')
+    parser.add_argument('to', choices=['bin', 'json', 'mid'], help='format to convert to')
+    parser.add_argument('nums', type=int, nargs='*', help='file numbers (default: all)')
+    parser.add_argument('--path', default=os.path.join(REPO_DIR, 'SYNTH', 'SEQFILE'), help='sequencer files directory')
+    parser.add_argument('--no-unroll', action='store_true', help='mid: write the score as is with the tempo map')
+    args = parser.parse_args()
+
+    path = os.path.join(args.path, '')
+    sdcard_obj = unipico_synth.sdcard_class()
+    midi_obj = unipico_synth.midi_class(unipico_synth.MIDIUnit(0), sdcard_obj)
+    sequencer_obj = unipico_synth.sequencer_class(midi_obj, sdcard_obj)
+    to_format = sequencer_obj.SEQ_FORMAT_BINARY if args.to == 'bin' else sequencer_obj.SEQ_FORMAT_JSON
+    from_exts = ['.' + ext for ext in sequencer_obj.seq_file_ext] if args.to == 'mid' else ['.' + sequencer_obj.seq_file_ext[1 - to_format]]
+
+    nums = args.nums
+    if len(nums) == 0:
+        nums = sorted(set([int(fname[5:8]) for fname in os.listdir(path) if fname.startswith('SEQSC') and fname[8:] in from_exts]))
+
+    result = 0
+    for num in nums:
+        if args.to == 'mid':
+            dst = 'SEQSC{:03d}.MID'.format(num)
+            with contextlib.redirect_stdout(io.StringIO()) as log:
+                seq_data = sequencer_obj.sequencer_read_file(path, num)
+                exported = False
+                if not seq_data is None:
+                    sequencer_obj.sequencer_set_data(seq_data)
+                    exported = sequencer_obj.sequencer_export_smf(path, dst, not args.no_unroll)
+
+            if exported:
+                print('SEQSC{:03d} -> {} ({} bytes)'.format(num, dst, os.path.getsize(path + dst)))
+            else:
+                print('SEQSC{:03d}: can not export. {}'.format(num, log.getvalue().strip()))
+                result = 1
+
+            continue
+
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            converted = sequencer_obj.sequencer_convert_file(path, num, to_format)
+
+        src = sequencer_obj.sequencer_file_name(num, 1 - to_format)
+        dst = sequencer_obj.sequencer_file_name(num, to_format)
+        if converted:
+            print('{} ({} bytes) -> {} ({} bytes)'.format(src, os.path.getsize(path + src), dst, os.path.getsize(path + dst)))
+        else:
+            print('{}: can not convert. {}'.format(src, log.getvalue().strip()))
+            result = 1
+
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main())
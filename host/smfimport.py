@@ -0,0 +1,66 @@
+#####################################################
+# Import a Standard MIDI File as a sequencer file SEQSC###
+#   The note times are quantized to the mini note grid of the sequencer.
+#
+# Usage: python3 host/smfimport.py FILE.MID NUM [--mini-note 4] [--format bin|json]
+#                                  [--path SYNTH/SEQFILE] [--stream]
+#   --mini-note: Minimum note length (2,3,4,5: 4th,8th,16th,32nd notes, see sequencer_class.set_seq_mini_note())
+#   --stream   : Import in the memory-bounded streaming mode of the device (binary format only)
+#####################################################
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+sys.path.insert(0, HOST_DIR)
+sys.path.insert(1, REPO_DIR)
+
+import pico_host
+pico_host.install()
+
+import unipico_synth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a Standard MIDI File as a sequencer file')
+    parser.add_argument('midi_file', help='MIDI file to import')
+    parser.add_argument('num', type=int, help='sequencer file number')
+    parser.add_argument('--mini-note', type=int, default=4, choices=[2, 3, 4, 5], help='minimum note length (2,3,4,5: 4th,8th,16th,32nd notes)')
+    parser.add_argument('--format', default='bin', choices=['bin', 'json'], help='sequencer file format')
+    parser.add_argument('--path', default=os.path.join(REPO_DIR, 'SYNTH', 'SEQFILE'), help='sequencer files directory')
+    parser.add_argument('--stream', action='store_true', help='import in the streaming mode (binary format)')
+    args = parser.parse_args()
+
+    path = os.path.join(args.path, '')
+    sdcard_obj = unipico_synth.sdcard_class()
+    midi_obj = unipico_synth.midi_class(unipico_synth.MIDIUnit(0), sdcard_obj)
+    sequencer_obj = unipico_synth.sequencer_class(midi_obj, sdcard_obj)
+    smf_player_obj = unipico_synth.smf_player_class(midi_obj, sdcard_obj, sequencer_obj)
+    smf_player_obj.set_midi_file_path(os.path.join(os.path.dirname(os.path.abspath(args.midi_file)), ''))
+    fname = os.path.basename(args.midi_file)
+
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        if args.stream:
+            file_format = sequencer_obj.SEQ_FORMAT_BINARY
+            imported = smf_player_obj.smf_import_file(fname, path, args.num, args.mini_note)
+            slots = None
+        else:
+            file_format = sequencer_obj.SEQ_FORMAT_BINARY if args.format == 'bin' else sequencer_obj.SEQ_FORMAT_JSON
+            seq_data = smf_player_obj.smf_import(fname, args.mini_note)
+            imported = not seq_data is None and sequencer_obj.sequencer_write_file(path, args.num, seq_data, file_format)
+            slots = None if seq_data is None else len(seq_data['score'])
+
+    dst = sequencer_obj.sequencer_file_name(args.num, file_format)
+    if not imported:
+        print('{}: can not import. {}'.format(fname, log.getvalue().strip()))
+        return 1
+
+    print('{} -> {} ({} bytes{})'.format(fname, dst, os.path.getsize(path + dst), '' if slots is None else ', {} slots'.format(slots)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
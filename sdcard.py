@@ -18,6 +18,55 @@ Example usage on ESP8266:
     os.mount(sd, '/sd')
     os.listdir('/')
 
+Sector cache:
+
+    sd = sdcard.SDCard(machine.SPI(0), machine.Pin(17), cache_blocks=16)
+    sd.pin_fat()        # keep the FAT sectors read in the cache
+    os.mount(sd, '/sd')
+    print(sd.cache_stats)
+
+Single block reads (the FAT driver reads the FAT, the directories and the
+partial file sectors one block at a time) are cached in an LRU cache of
+cache_blocks buffers.  Pinned sectors are not evicted, up to half of the
+cache.  Writes update the cached copies.
+
+Write-back buffer:
+
+    sd = sdcard.SDCard(machine.SPI(0), machine.Pin(17), write_blocks=8)
+
+Written sectors are kept in write_blocks buffers and written to the card
+when the buffer is full or the file system syncs (ioctl 3, on closing a
+file) or deinitialises the device (ioctl 2).  Adjacent sectors are written
+with a single CMD25.  flush_stats has the flush counters and latency.
+
+SPI clock tuning:
+
+    sd = sdcard.SDCard(machine.SPI(0), machine.Pin(17), max_baudrate=25000000)
+    print(sd.baudrate, sd.throughput)
+
+After the initialisation the clock is doubled from baudrate up to
+max_baudrate while the first sectors read at the new clock are the same
+as read at baudrate.  The card is left at the fastest clock verified,
+baudrate is the clock and throughput is the bytes per second measured in
+the verification at the clock.
+
+Busy waits:
+
+The data token of a read and the end of the busy state of a write are
+polled into a preallocated buffer.  After _POLL_SPIN polls the driver
+sleeps _POLL_SLEEP_US between the polls to yield to the other thread,
+up to _READ_TIMEOUT_MS / _WRITE_TIMEOUT_MS.  busy_stats counts the waits
+and the time spent in them.
+
+Read-ahead:
+
+    sd = sdcard.SDCard(machine.SPI(0), machine.Pin(17), readahead_blocks=8)
+
+A read of the sector following the previous read starts a CMD18 reading
+readahead_blocks sectors into a preallocated window, the following
+sequential reads are served from the window.  The sectors read ahead are
+not put in the sector cache.  readahead_stats has the counters.
+
 """
 
 from micropython import const
@@ -37,12 +86,47 @@ _TOKEN_CMD25 = const(0xFC)
 _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
 
+_POLL_SPIN = const(16)
+_POLL_SLEEP_US = const(100)
+_READ_TIMEOUT_MS = const(100)
+_WRITE_TIMEOUT_MS = const(500)
+
+_TUNE_BLOCKS = const(4)
+_TUNE_REPEAT = const(2)
+
 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1320000):
+    def __init__(self, spi, cs, baudrate=1320000, cache_blocks=0, write_blocks=0, max_baudrate=None, readahead_blocks=0):
         self.spi = spi
         self.cs = cs
 
+        # sector cache: {block number: [buffer, pinned]}, block numbers in LRU order
+        self.cache_blocks = cache_blocks
+        self.cache = {}
+        self.cache_lru = []
+        self.cache_free = [bytearray(512) for _ in range(cache_blocks)]
+        self.pins = []
+        self.pin_max = cache_blocks // 2
+        self.pinned = 0
+        self.cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+        # write-back buffer: {block number: buffer} of the sectors not written yet
+        self.write_blocks = write_blocks
+        self.dirty = {}
+        self.dirty_free = [bytearray(512) for _ in range(write_blocks)]
+        self.flush_stats = {"flushes": 0, "blocks": 0, "writes": 0, "last_us": 0, "max_us": 0, "total_us": 0}
+
+        # read-ahead window: ra_count sectors from ra_first, ra_last is the last sector read
+        self.readahead_blocks = readahead_blocks
+        self.ra_buf = memoryview(bytearray(readahead_blocks * 512))
+        self.ra_first = 0
+        self.ra_count = 0
+        self.ra_last = -2
+        self.readahead_stats = {"prefetches": 0, "blocks": 0, "hits": 0}
+
+        # busy waits: read token and write busy waits, the time in the waits
+        self.busy_stats = {"read_waits": 0, "write_waits": 0, "sleeps": 0, "wait_us": 0, "max_wait_us": 0, "timeouts": 0}
+
         self.cmdbuf = bytearray(6)
         self.dummybuf = bytearray(512)
         self.tokenbuf = bytearray(1)
@@ -51,7 +135,11 @@ class SDCard:
         self.dummybuf_memoryview = memoryview(self.dummybuf)
 
         # initialise the card
+        self.baudrate = baudrate
+        self.throughput = None
         self.init_card(baudrate)
+        if max_baudrate is not None and max_baudrate > baudrate:
+            self.tune_spi(baudrate, max_baudrate)
 
     def init_spi(self, baudrate):
         try:
@@ -116,6 +204,39 @@ class SDCard:
         # set to high data rate now that it's initialised
         self.init_spi(baudrate)
 
+    # step the clock up while the reads are verified, fall back to the last good clock
+    def tune_spi(self, baudrate, max_baudrate):
+        ref = bytearray(_TUNE_BLOCKS * 512)
+        buf = bytearray(_TUNE_BLOCKS * 512)
+        self.readblocks_card(0, ref)
+        self.throughput = self.tune_read(ref, buf)
+        rate = baudrate
+        while rate < max_baudrate:
+            rate = min(rate * 2, max_baudrate)
+            self.init_spi(rate)
+            try:
+                throughput = self.tune_read(ref, buf)
+            except OSError:
+                throughput = None
+            if throughput is None:
+                # stop a read left by the error
+                self.init_spi(self.baudrate)
+                self.cmd(12, 0, 0xFF, skip1=True)
+                break
+            self.baudrate = rate
+            self.throughput = throughput
+        self.init_spi(self.baudrate)
+
+    # bytes per second reading the reference sectors, None if the data is different
+    def tune_read(self, ref, buf):
+        t = time.ticks_us()
+        for _ in range(_TUNE_REPEAT):
+            self.readblocks_card(0, buf)
+            if buf != ref:
+                return None
+        t = max(time.ticks_diff(time.ticks_us(), t), 1)
+        return _TUNE_REPEAT * len(buf) * 1000000 // t
+
     def init_card_v1(self):
         for i in range(_CMD_TIMEOUT):
             time.sleep_ms(50)
@@ -151,10 +272,10 @@ class SDCard:
         # create and send the command
         buf = self.cmdbuf
         buf[0] = 0x40 | cmd
-        buf[1] = arg >> 24
-        buf[2] = arg >> 16
-        buf[3] = arg >> 8
-        buf[4] = arg
+        buf[1] = (arg >> 24) & 0xFF
+        buf[2] = (arg >> 16) & 0xFF
+        buf[3] = (arg >> 8) & 0xFF
+        buf[4] = arg & 0xFF
         buf[5] = crc
         self.spi.write(buf)
 
@@ -183,16 +304,37 @@ class SDCard:
         self.spi.write(b"\xff")
         return -1
 
+    # poll the card while it sends the byte idle, returns the next byte or -1 at the timeout
+    def wait_while(self, idle, timeout_ms):
+        buf = self.tokenbuf
+        t = time.ticks_us()
+        i = 0
+        while True:
+            self.spi.readinto(buf, 0xFF)
+            if buf[0] != idle:
+                response = buf[0]
+                break
+            i += 1
+            if i >= _POLL_SPIN:
+                if time.ticks_diff(time.ticks_us(), t) >= timeout_ms * 1000:
+                    self.busy_stats["timeouts"] += 1
+                    response = -1
+                    break
+                time.sleep_us(_POLL_SLEEP_US)
+                self.busy_stats["sleeps"] += 1
+        t = time.ticks_diff(time.ticks_us(), t)
+        stats = self.busy_stats
+        stats["wait_us"] += t
+        if t > stats["max_wait_us"]:
+            stats["max_wait_us"] = t
+        return response
+
     def readinto(self, buf):
         self.cs(0)
 
-        # read until start byte (0xff)
-        for i in range(_CMD_TIMEOUT):
-            self.spi.readinto(self.tokenbuf, 0xFF)
-            if self.tokenbuf[0] == _TOKEN_DATA:
-                break
-            time.sleep_ms(1)
-        else:
+        # read until start byte (0xfe)
+        self.busy_stats["read_waits"] += 1
+        if self.wait_while(0xFF, _READ_TIMEOUT_MS) != _TOKEN_DATA:
             self.cs(1)
             raise OSError("timeout waiting for response")
 
@@ -213,36 +355,190 @@ class SDCard:
         self.cs(0)
 
         # send: start of block, data, checksum
-        self.spi.read(1, token)
+        self.tokenbuf[0] = token
+        self.spi.write(self.tokenbuf)
         self.spi.write(buf)
         self.spi.write(b"\xff")
         self.spi.write(b"\xff")
 
         # check the response
-        if (self.spi.read(1, 0xFF)[0] & 0x1F) != 0x05:
+        self.spi.readinto(self.tokenbuf, 0xFF)
+        if (self.tokenbuf[0] & 0x1F) != 0x05:
             self.cs(1)
             self.spi.write(b"\xff")
             return
 
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0:
-            pass
+        self.busy_stats["write_waits"] += 1
+        ready = self.wait_while(0x00, _WRITE_TIMEOUT_MS)
 
         self.cs(1)
         self.spi.write(b"\xff")
+        if ready < 0:
+            raise OSError("timeout waiting for write")
 
     def write_token(self, token):
         self.cs(0)
-        self.spi.read(1, token)
+        self.tokenbuf[0] = token
+        self.spi.write(self.tokenbuf)
         self.spi.write(b"\xff")
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0x00:
-            pass
+        self.busy_stats["write_waits"] += 1
+        ready = self.wait_while(0x00, _WRITE_TIMEOUT_MS)
 
         self.cs(1)
         self.spi.write(b"\xff")
+        if ready < 0:
+            raise OSError("timeout waiting for write")
+
+    def pin(self, block_num, count):
+        self.pins.append((block_num, block_num + count))
+
+    def is_pinned(self, block_num):
+        for first, end in self.pins:
+            if first <= block_num < end:
+                return True
+        return False
+
+    # pin the sectors of the first FAT, returns the number of the FAT sectors
+    def pin_fat(self):
+        buf = bytearray(512)
+        self.readblocks(0, buf)
+        start = 0
+        if buf[0] not in (0xEB, 0xE9):
+            # MBR: the first partition
+            start = buf[454] | buf[455] << 8 | buf[456] << 16 | buf[457] << 24
+            self.readblocks(start, buf)
+        if buf[510] != 0x55 or buf[511] != 0xAA or (buf[11] | buf[12] << 8) != 512:
+            return 0
+        reserved = buf[14] | buf[15] << 8
+        fat_size = buf[22] | buf[23] << 8
+        if fat_size == 0:
+            fat_size = buf[36] | buf[37] << 8 | buf[38] << 16 | buf[39] << 24
+        self.pin(start + reserved, fat_size)
+        return fat_size
+
+    def cache_read(self, block_num, buf):
+        entry = self.cache.get(block_num)
+        if entry is None:
+            return False
+        buf[:] = entry[0]
+        self.cache_lru.remove(block_num)
+        self.cache_lru.append(block_num)
+        return True
+
+    def cache_insert(self, block_num, buf):
+        if self.cache_free:
+            cbuf = self.cache_free.pop()
+        else:
+            # evict the least recently used sector not pinned
+            for i in range(len(self.cache_lru)):
+                if not self.cache[self.cache_lru[i]][1]:
+                    break
+            cbuf = self.cache.pop(self.cache_lru.pop(i))[0]
+            self.cache_stats["evictions"] += 1
+        pinned = self.pinned < self.pin_max and self.is_pinned(block_num)
+        if pinned:
+            self.pinned += 1
+        cbuf[:] = buf
+        self.cache[block_num] = [cbuf, pinned]
+        self.cache_lru.append(block_num)
+
+    def cache_update(self, block_num, buf):
+        nblocks = len(buf) // 512
+        if nblocks == 1:
+            entry = self.cache.get(block_num)
+            if entry is not None:
+                entry[0][:] = buf
+            return
+        mv = memoryview(buf)
+        for i in range(nblocks):
+            entry = self.cache.get(block_num + i)
+            if entry is not None:
+                entry[0][:] = mv[i * 512 : (i + 1) * 512]
 
     def readblocks(self, block_num, buf):
+        nblocks = len(buf) // 512
+        if self.dirty:
+            if nblocks == 1 and block_num in self.dirty:
+                buf[:] = self.dirty[block_num]
+                return
+            self.readblocks_cache(block_num, buf)
+
+            # the sectors not written yet
+            mv = memoryview(buf)
+            for i in range(nblocks):
+                if block_num + i in self.dirty:
+                    mv[i * 512 : (i + 1) * 512] = self.dirty[block_num + i]
+            return
+
+        self.readblocks_cache(block_num, buf)
+
+    def readblocks_cache(self, block_num, buf):
+        if self.cache_blocks:
+            nblocks = len(buf) // 512
+            if nblocks == 1:
+                if self.cache_read(block_num, buf):
+                    self.cache_stats["hits"] += 1
+                    return
+                self.cache_stats["misses"] += 1
+                # the pinned sectors are kept in the cache, not read ahead
+                if self.readahead_blocks and not self.is_pinned(block_num) and self.readahead(block_num, buf):
+                    return
+                self.readblocks_card(block_num, buf)
+                self.cache_insert(block_num, buf)
+                return
+
+            # multiple blocks are not cached, read from the cache if all the blocks are there
+            for i in range(nblocks):
+                if block_num + i not in self.cache:
+                    break
+            else:
+                mv = memoryview(buf)
+                for i in range(nblocks):
+                    self.cache_read(block_num + i, mv[i * 512 : (i + 1) * 512])
+                self.cache_stats["hits"] += nblocks
+                return
+            self.cache_stats["misses"] += nblocks
+
+        if self.readahead_blocks and self.readahead(block_num, buf):
+            return
+        self.readblocks_card(block_num, buf)
+
+    # read from the read-ahead window, a sequential read refills the window
+    #   returns False if the sectors are not read
+    def readahead(self, block_num, buf):
+        nblocks = len(buf) // 512
+        sequential = block_num == self.ra_last + 1
+        self.ra_last = block_num + nblocks - 1
+        if not (self.ra_first <= block_num and block_num + nblocks <= self.ra_first + self.ra_count):
+            if not sequential or nblocks >= self.readahead_blocks:
+                return False
+            self.ra_count = 0
+            self.ra_first = block_num
+            count = min(self.readahead_blocks, self.sectors - block_num)
+            self.readblocks_card(block_num, self.ra_buf[: count * 512])
+            self.ra_count = count
+            # the sectors not written yet, the window is read after the flush
+            for num, dbuf in self.dirty.items():
+                if block_num <= num < block_num + count:
+                    self.ra_buf[(num - block_num) * 512 : (num - block_num + 1) * 512] = dbuf
+            self.readahead_stats["prefetches"] += 1
+            self.readahead_stats["blocks"] += count
+        else:
+            self.readahead_stats["hits"] += nblocks
+        offset = (block_num - self.ra_first) * 512
+        buf[:] = self.ra_buf[offset : offset + nblocks * 512]
+        return True
+
+    def readahead_update(self, block_num, buf):
+        first = max(block_num, self.ra_first)
+        end = min(block_num + len(buf) // 512, self.ra_first + self.ra_count)
+        if first < end:
+            mv = memoryview(buf)
+            self.ra_buf[(first - self.ra_first) * 512 : (end - self.ra_first) * 512] = mv[(first - block_num) * 512 : (end - block_num) * 512]
+
+    def readblocks_card(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
         self.spi.write(b"\xff")
@@ -274,6 +570,73 @@ class SDCard:
                 raise OSError(5)  # EIO
 
     def writeblocks(self, block_num, buf):
+        if self.cache_blocks:
+            self.cache_update(block_num, buf)
+        if self.ra_count:
+            self.readahead_update(block_num, buf)
+
+        if self.write_blocks:
+            nblocks = len(buf) // 512
+            mv = memoryview(buf)
+            if nblocks >= self.write_blocks:
+                # too large to buffer, the buffered copies are overwritten
+                for i in range(nblocks):
+                    if block_num + i in self.dirty:
+                        self.dirty_free.append(self.dirty.pop(block_num + i))
+                self.writeblocks_card(block_num, buf)
+                return
+
+            for i in range(nblocks):
+                dbuf = self.dirty.get(block_num + i)
+                if dbuf is None:
+                    if not self.dirty_free:
+                        self.flush()
+                    dbuf = self.dirty_free.pop()
+                    self.dirty[block_num + i] = dbuf
+                dbuf[:] = mv[i * 512 : (i + 1) * 512]
+            return
+
+        self.writeblocks_card(block_num, buf)
+
+    # write the buffered sectors, adjacent sectors with a CMD25
+    def flush(self):
+        if not self.dirty:
+            return
+        t = time.ticks_us()
+        nums = sorted(self.dirty)
+        i = 0
+        while i < len(nums):
+            j = i + 1
+            while j < len(nums) and nums[j] == nums[j - 1] + 1:
+                j += 1
+            self.write_run(nums[i], j - i)
+            for k in range(i, j):
+                self.dirty_free.append(self.dirty.pop(nums[k]))
+            self.flush_stats["writes"] += 1
+            i = j
+        t = time.ticks_diff(time.ticks_us(), t)
+        stats = self.flush_stats
+        stats["flushes"] += 1
+        stats["blocks"] += len(nums)
+        stats["last_us"] = t
+        stats["total_us"] += t
+        if t > stats["max_us"]:
+            stats["max_us"] = t
+
+    def write_run(self, block_num, nblocks):
+        self.spi.write(b"\xff")
+        if nblocks == 1:
+            if self.cmd(24, block_num * self.cdv, 0) != 0:
+                raise OSError(5)  # EIO
+            self.write(_TOKEN_DATA, self.dirty[block_num])
+        else:
+            if self.cmd(25, block_num * self.cdv, 0) != 0:
+                raise OSError(5)  # EIO
+            for i in range(nblocks):
+                self.write(_TOKEN_CMD25, self.dirty[block_num + i])
+            self.write_token(_TOKEN_STOP_TRAN)
+
+    def writeblocks_card(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
         self.spi.write(b"\xff")
@@ -301,6 +664,14 @@ class SDCard:
             self.write_token(_TOKEN_STOP_TRAN)
 
     def ioctl(self, op, arg):
+        if op == 1:  # initialise
+            return 0
+        if op == 2:  # deinitialise
+            self.flush()
+            return 0
+        if op == 3:  # sync
+            self.flush()
+            return 0
         if op == 4:  # get number of blocks
             return self.sectors
         if op == 5:  # get block size in bytes
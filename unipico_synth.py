@@ -4,6 +4,8 @@
 #   MIDI-IN Player
 #   Realtime Recording and Player
 #   Sequencer File Player (Editor is NOT AVAILABLE)
+#   Standard MIDI File Player (SYNTH/MIDIFILE/LIST.TXT)
+#   Playlist Player (sequencer files or LIST.TXT in a row without gaps)
 # UI:
 #   Joystick for M5Stack CORE2
 #   LCD: AE-AQM0802
@@ -16,6 +18,8 @@ from machine import Pin, UART, I2C
 import time, utime, os, json
 import random
 import _thread
+import heapq
+from array import array
 from micropython import const
 
 from machine import SPI
@@ -28,6 +32,8 @@ thread_manager_obj = None   # Thread manager
 joystick_obj       = None   # Joy Stick
 midi_obj           = None   # MIDI
 sequencer_obj      = None   # Sequencer
+smf_player_obj     = None   # SMF Player
+storage_worker_obj = None   # Storage worker
 application        = None   # Application
 
 
@@ -113,13 +119,23 @@ class sdcard_class:
   # Constructor
   def __init__(self):
     self.file_opened = None
+    self.sd = None
 
   # Initialize SD Card device
-  def setup(self, spi_unit=0, sck_pin=18, mosi_pin=19, miso_pin=16, cs_pin=17):
+  #   cache_blocks: Sectors in the sector cache of the driver (0: no cache)
+  #   write_blocks: Sectors in the write-back buffer of the driver, written at a file sync (0: write through)
+  #   max_baudrate: Fastest SPI clock to try, the fastest clock reading the card correctly is used (None: 1.32MHz)
+  #   readahead_blocks: Sectors read ahead with a multi block read on sequential reads (0: no read-ahead)
+  def setup(self, spi_unit=0, sck_pin=18, mosi_pin=19, miso_pin=16, cs_pin=17, cache_blocks=16, write_blocks=8, max_baudrate=25000000, readahead_blocks=8):
     print('SD CARD INIT.')
     mf = None
     spi = SPI(spi_unit, sck=Pin(sck_pin), mosi=Pin(mosi_pin), miso=Pin(miso_pin))	# SPI0: SCK, TX, RX
-    sd = sdcard.SDCard(spi, Pin(cs_pin, Pin.OUT))	# CS
+    sd = sdcard.SDCard(spi, Pin(cs_pin, Pin.OUT), cache_blocks=cache_blocks, write_blocks=write_blocks, max_baudrate=max_baudrate, readahead_blocks=readahead_blocks)	# CS
+    print('SD CARD SPI CLOCK:', sd.baudrate, 'THROUGHPUT:', sd.throughput)
+    if cache_blocks > 0:
+      print('SD CARD FAT SECTORS TO PIN:', sd.pin_fat())
+
+    self.sd = sd
     os.mount(sd, '/SD')
 #    fp = open('/SD/SYNTH/MIDIFILE/LIST.TXT', 'r')
     fp = open('/SD/SYNTH/MIDIUNIT/MIDISET000.json', 'r')
@@ -127,6 +143,22 @@ class sdcard_class:
     fp.close()
     print('SD CARD INIT done.')
 
+  # Sector cache counters of the SD card driver
+  def cache_stats(self):
+    return None if self.sd is None else self.sd.cache_stats
+
+  # Write-back flush counters of the SD card driver (flushes, latency in micro seconds)
+  def flush_stats(self):
+    return None if self.sd is None else self.sd.flush_stats
+
+  # Busy wait counters of the SD card driver (waits, time in micro seconds)
+  def busy_stats(self):
+    return None if self.sd is None else self.sd.busy_stats
+
+  # Read-ahead counters of the SD card driver (prefetches, sectors read ahead, sectors read from the window)
+  def readahead_stats(self):
+    return None if self.sd is None else self.sd.readahead_stats
+
   # Opened file
   def file_opened(self):
     return self.file_opened
@@ -158,6 +190,54 @@ class sdcard_class:
 
     self.file_opened = None
 
+  # Replace a file with its temporary file written (<fname>.tmp)
+  #   The old file is kept as <fname>.bak until the new file is in place,
+  #   file_recover() restores it if the replacement is interrupted.
+  def file_replace(self, path, fname):
+    target = path + fname
+    try:
+      os.remove(target + '.bak')
+    except:
+      pass
+
+    exists = self.file_size(path, fname) is not None
+    if exists:
+      os.rename(target, target + '.bak')
+
+    os.rename(target + '.tmp', target)
+    if exists:
+      os.remove(target + '.bak')
+
+  # Restore a file from <fname>.bak if the file was lost in file_replace()
+  #   Called when the file can not be opened.
+  #   Returns True if the file is restored
+  def file_recover(self, path, fname):
+    try:
+      os.stat(path + fname)
+      return False
+
+    except:
+      pass
+
+    try:
+      os.rename(path + fname + '.bak', path + fname)
+      self.file_remove(path, fname + '.tmp')
+      print('sccard_class.file_recover:', path, fname)
+      return True
+
+    except:
+      pass
+
+    return False
+
+  # Remove a file if exists
+  def file_remove(self, path, fname):
+    try:
+      os.remove(path + fname)
+
+    except:
+      pass
+
   # Read JSON format file, then retun JSON data
   def json_read(self, path, fname):
     json_data = None
@@ -165,21 +245,95 @@ class sdcard_class:
       with open(path + fname, 'r') as f:
         json_data = json.load(f)
 
+    except OSError as e:
+      if self.file_recover(path, fname):
+        return self.json_read(path, fname)
+
+      print('sccard_class.json_read Exception:', e, path, fname)
+
     except Exception as e:
       print('sccard_class.json_read Exception:', e, path, fname)
 
     return json_data
 
   # Write JSON format file
+  #   The file is written to <fname>.tmp, then replaced (see file_replace())
   def json_write(self, path, fname, json_data):
     try:
-      with open(path + fname, 'w') as f:
+      with open(path + fname + '.tmp', 'w') as f:
         json.dump(json_data, f)
 
+      self.file_replace(path, fname)
       return True
 
     except Exception as e:
       print('sccard_class.json_write Exception:', e, path, fname)
+      self.file_remove(path, fname + '.tmp')
+
+    return False
+
+  # File size in bytes, None if the file does not exist
+  def file_size(self, path, fname):
+    try:
+      return os.stat(path + fname)[6]
+
+    except:
+      if self.file_recover(path, fname):
+        return self.file_size(path, fname)
+
+    return None
+
+  # Read a binary file into a buffer at once, then return the bytes read
+  #   buf: Buffer allocated by the caller, the file must fit in it
+  def binary_read(self, path, fname, buf):
+    try:
+      with open(path + fname, 'rb') as f:
+        return f.readinto(buf)
+
+    except Exception as e:
+      if self.file_recover(path, fname):
+        return self.binary_read(path, fname, buf)
+
+      print('sccard_class.binary_read Exception:', e, path, fname)
+
+    return None
+
+  # Open a binary file to read, needs to close the file
+  def binary_open(self, path, fname):
+    try:
+      return open(path + fname, 'rb')
+
+    except Exception as e:
+      if self.file_recover(path, fname):
+        return self.binary_open(path, fname)
+
+      print('sccard_class.binary_open Exception:', e, path, fname)
+
+    return None
+
+  # Create a binary file to write, needs to close the file
+  def binary_create(self, path, fname):
+    try:
+      return open(path + fname, 'wb')
+
+    except Exception as e:
+      print('sccard_class.binary_create Exception:', e, path, fname)
+
+    return None
+
+  # Write a binary file
+  #   The file is written to <fname>.tmp, then replaced (see file_replace())
+  def binary_write(self, path, fname, data):
+    try:
+      with open(path + fname + '.tmp', 'wb') as f:
+        f.write(data)
+
+      self.file_replace(path, fname)
+      return True
+
+    except Exception as e:
+      print('sccard_class.binary_write Exception:', e, path, fname)
+      self.file_remove(path, fname + '.tmp')
 
     return False
 
@@ -294,68 +448,264 @@ class MIDIUnit:
     #              This argument is NOT USED, to keep compatibility with M5Stack CORE2.
     def __init__(self, uart_unit=0, port=None):
         self._uart = UART(uart_unit, 31250)
+
+        # Output queue priorities (smaller is higher)
+        #   Only the realtime messages jump the queue, the other messages are sent in the order queued.
+        self.PRIORITY_REALTIME = 0
+        self.PRIORITY_MESSAGE  = 1
+        self.MIDI_BYTE_US = 320         # Micro seconds to send a byte at 31250 baud
+
+        # Output queue: a ring buffer [[entries], head, count] for each priority (None: send immediately)
+        self._queue = None
+        self._queue_size = 0
+        self._queue_late_us = 0
+        self._queue_lock = _thread.allocate_lock()
+
+        # Output queue counters
+        #   'depth': Messages in the queue, 'max_depth': Maximum depth,
+        #   'sent': Messages sent, 'dropped': Messages dropped by a full queue,
+        #   'evicted': Messages removed from a full queue for a note-off,
+        #   'blocked': Messages sent by a note-off waiting for a full queue of note-offs,
+        #   'late': Messages waited longer than the late limit in the queue
+        self.queue_stats = {'depth': 0, 'max_depth': 0, 'sent': 0, 'dropped': 0, 'evicted': 0, 'blocked': 0, 'late': 0}
         
-    def midi_out(self, midi_msg):
-        self._uart.write(midi_msg)
+    # Send a MIDI message to the UART, or to the output queue while it is enabled
+    #   batch: A batch from begin_batch() to collect the message in (None: send immediately)
+    def midi_out(self, midi_msg, batch=None):
+        if not batch is None:
+            batch.extend(midi_msg)
+        elif self._queue is None:
+            self._uart.write(midi_msg)
+        else:
+            self.enqueue(midi_msg)
+
+    # Start queueing the output messages, the queue is drained by drain_queue()
+    #   size   : Ring buffer size for each priority
+    #   late_us: Micro seconds in the queue to count the message as late
+    def enable_queue(self, size=32, late_us=10000):
+        with self._queue_lock:
+            self._queue = []
+            for prio in range(self.PRIORITY_MESSAGE + 1):
+                self._queue.append([[None] * size, 0, 0])
+
+            self._queue_size = size
+            self._queue_late_us = late_us
+            self.queue_stats = {'depth': 0, 'max_depth': 0, 'sent': 0, 'dropped': 0, 'evicted': 0, 'blocked': 0, 'late': 0}
+
+    # Send all the queued messages and stop queueing
+    def disable_queue(self):
+        self.drain_queue()
+        with self._queue_lock:
+            self._queue = None
+
+    # Get a message priority in the output queue
+    def message_priority(self, midi_msg):
+        if midi_msg[0] >= 0xF8:
+            return self.PRIORITY_REALTIME
+
+        return self.PRIORITY_MESSAGE
+
+    # Message never dropped from the output queue (note-off, all sound off, all notes off)
+    #   A batch is judged by its first message.
+    def message_must_send(self, midi_msg):
+        kind = midi_msg[0] & 0xF0
+        if kind == 0x80 or (kind == 0x90 and len(midi_msg) >= 3 and midi_msg[2] == 0):
+            return True
+
+        return kind == 0xB0 and len(midi_msg) >= 2 and (midi_msg[1] == 0x78 or midi_msg[1] == 0x7B)
+
+    # Put a message in the output queue
+    #   A new message is dropped if the queue is full, except a note-off.
+    #   A note-off takes the place of the oldest message which can be dropped,
+    #   or sends the oldest message now if all the messages are note-offs.
+    def enqueue(self, midi_msg, priority=None):
+        if priority is None:
+            priority = self.message_priority(midi_msg)
+
+        # The UART is written out of the lock not to stall the other thread
+        send_msg = None
+        with self._queue_lock:
+            if self._queue is None:
+                send_msg = midi_msg
+            else:
+                stats = self.queue_stats
+                ring = self._queue[priority]
+                if ring[2] == self._queue_size:
+                    if not self.message_must_send(midi_msg):
+                        stats['dropped'] = stats['dropped'] + 1
+                        return False
+
+                    send_msg = self.queue_make_room(ring)
+
+                ring[0][(ring[1] + ring[2]) % self._queue_size] = (utime.ticks_us(), midi_msg)
+                ring[2] = ring[2] + 1
+
+                stats['depth'] = stats['depth'] + 1
+                if stats['depth'] > stats['max_depth']:
+                    stats['max_depth'] = stats['depth']
+
+        if not send_msg is None:
+            self._uart.write(send_msg)
+
+        return True
+
+    # Remove a message from a full ring for a note-off (with the queue lock)
+    #   The oldest message which can be dropped is removed keeping the order of the others,
+    #   the oldest message is taken out if all the messages must be sent.
+    #   Returns the message taken out to send after releasing the lock (None: removed)
+    def queue_make_room(self, ring):
+        size = self._queue_size
+        entries = ring[0]
+        stats = self.queue_stats
+        for i in range(ring[2]):
+            if not self.message_must_send(entries[(ring[1] + i) % size][1]):
+                for k in range(i, ring[2] - 1):
+                    entries[(ring[1] + k) % size] = entries[(ring[1] + k + 1) % size]
+                entries[(ring[1] + ring[2] - 1) % size] = None
+                stats['evicted'] = stats['evicted'] + 1
+                ring[2] = ring[2] - 1
+                stats['depth'] = stats['depth'] - 1
+                return None
+
+        midi_msg = entries[ring[1]][1]
+        entries[ring[1]] = None
+        ring[1] = (ring[1] + 1) % size
+        ring[2] = ring[2] - 1
+        stats['depth'] = stats['depth'] - 1
+        stats['blocked'] = stats['blocked'] + 1
+        stats['sent'] = stats['sent'] + 1
+        return midi_msg
+
+    # Send the queued messages, the realtime messages first and the others in the order queued
+    #   max_bytes: Maximum bytes to send (None: all messages)
+    #   Returns bytes sent
+    def drain_queue(self, max_bytes=None):
+        sent = 0
+        while True:
+            with self._queue_lock:
+                if self._queue is None:
+                    return sent
+
+                # Take the first message in the highest priority
+                entry = None
+                for ring in self._queue:
+                    if ring[2] > 0:
+                        entry = ring[0][ring[1]]
+                        if not max_bytes is None and sent + len(entry[1]) > max_bytes:
+                            return sent
+
+                        ring[0][ring[1]] = None
+                        ring[1] = (ring[1] + 1) % self._queue_size
+                        ring[2] = ring[2] - 1
+                        break
+
+                if entry is None:
+                    return sent
+
+                stats = self.queue_stats
+                stats['depth'] = stats['depth'] - 1
+                stats['sent'] = stats['sent'] + 1
+                if utime.ticks_diff(utime.ticks_us(), entry[0]) > self._queue_late_us:
+                    stats['late'] = stats['late'] + 1
+
+            self._uart.write(entry[1])
+            sent = sent + len(entry[1])
+
+    # Pack MIDI messages with running status
+    #   A channel message status byte same as the previous one is omitted.
+    #   System exclusive and system common messages cancel the running status,
+    #   realtime messages do not affect it.
+    def pack_messages(self, midi_msg):
+        packed = bytearray()
+        status = 0
+        for data in midi_msg:
+            if data >= 0xF8:
+                pass
+            elif data >= 0xF0:
+                status = 0
+            elif data >= 0x80:
+                if data == status:
+                    continue
+                status = data
+
+            packed.append(data)
+
+        return packed
+
+    # Start collecting messages for a time slot
+    #   Returns a batch to pass to the message functions, the batch belongs to the caller only.
+    def begin_batch(self):
+        return bytearray()
+
+    # Send the collected messages in a single write with running status
+    #   send: False to return the messages packed instead of sending them
+    def end_batch(self, batch, send=True):
+        if len(batch) > 0:
+            if not send:
+                return self.pack_messages(batch)
+
+            self.midi_out(self.pack_messages(batch))
+
+        return None
     
-    def set_master_volume(self, vol):
+    def set_master_volume(self, vol, batch=None):
         midi_msg = bytearray([0xF0, 0x7F, 0x7F, 0x04, 0x01, 0, vol & 0x7f, 0xF7])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_instrument(self, gmbank, channel, prog):
+    def set_instrument(self, gmbank, channel, prog, batch=None):
         midi_msg = bytearray([0xC0 + channel, prog])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_note_on(self, channel, note_key, velosity):
+    def set_note_on(self, channel, note_key, velosity, batch=None):
         midi_msg = bytearray([0x90 + channel, note_key, velosity])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_note_off(self, channel, note_key):
+    def set_note_off(self, channel, note_key, batch=None):
         midi_msg = bytearray([0x90 + channel, note_key, 0])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_all_notes_off(self, channel = None):
+    def set_all_notes_off(self, channel = None, batch=None):
         midi_msg = bytearray([0xB0 + channel, 0x78, 0])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_reverb(self, channel, prog, level, feedback):
+    def set_reverb(self, channel, prog, level, feedback, batch=None):
         status_byte = 0xB0 + channel
         midi_msg = bytearray([status_byte, 0x50, prog, status_byte, 0x5B, level])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
         if feedback > 0:
             midi_msg = bytearray([0xF0, 0x41, 0x00, 0x42, 0x12, 0x40, 0x01, 0x35, feedback, 0, 0xF7])
-            self.midi_out(midi_msg)
+            self.midi_out(midi_msg, batch)
             
-    def set_chorus(self, channel, prog, level, feedback, delay):
+    def set_chorus(self, channel, prog, level, feedback, delay, batch=None):
         status_byte = 0xB0 + channel
         midi_msg = bytearray([status_byte, 0x51, prog, status_byte, 0x5D, level])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
         if feedback > 0:
             midi_msg = bytearray([0xF0, 0x41, 0x00, 0x42, 0x12, 0x40, 0x01, 0x3B, feedback, 0, 0xF7])
-            self.midi_out(midi_msg)
+            self.midi_out(midi_msg, batch)
 
         if delay > 0:
             midi_msg = bytearray([0xF0, 0x41, 0x00, 0x42, 0x12, 0x40, 0x01, 0x3C, delay, 0, 0xF7])
-            self.midi_out(midi_msg)
+            self.midi_out(midi_msg, batch)
 
-    def set_vibrate(self, channel, rate, depth, delay):
+    def set_vibrate(self, channel, rate, depth, delay, batch=None):
         status_byte = 0xB0 + channel
         midi_msg = bytearray([status_byte, 0x63, 0x01, 0x62, 0x08, 0x06, rate, status_byte, 0x63, 0x01, 0x62, 0x09, 0x06, depth, status_byte, 0x63, 0x01, 0x62, 0x0A, 0x06, delay])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_pitch_bend(self, channel, value):
+    def set_pitch_bend(self, channel, value, batch=None):
         status_byte = 0xE0 + channel
         lsb = value & 0x7f					# Least
         msb = (value >> 7) & 0x7f			# Most
 #        print('PITCH BEND value=', channel, value, lsb, msb) 
         midi_msg = bytearray([status_byte, lsb, msb])
 #        midi_msg = bytearray([status_byte, value & 0xef, (value >> 7) & 0xff])		# Original
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
-    def set_pitch_bend_range(self, channel, value):
+    def set_pitch_bend_range(self, channel, value, batch=None):
         status_byte = 0xB0 + channel
         midi_msg = bytearray([status_byte, 0x65, 0x00, 0x64, 0x00, 0x06, value & 0x7f])
-        self.midi_out(midi_msg)
+        self.midi_out(midi_msg, batch)
 
 ################# End of Unit-MIDI Class Definition #################
         
@@ -374,6 +724,9 @@ class midi_class:
         self.USE_GMBANK = 0                              # GM bank number (normally 0, option is 127)
         #self.USE_GMBANK = 127
         self.GM_FILE_PATH = '/SD/SYNTH/MIDIFILE/'       # GM program names list file path
+        self.GM_NAME_BANKS = 2                           # GM banks to keep the program names table in RAM
+        self.gm_name_tables = []                         # [(gmbank, table), ..] in the order of use, see gm_name_table()
+        self.gm_name_lock = _thread.allocate_lock()      # Lock of gm_name_tables used in the main and the device threads
 
     # Setup
     def setup(self, uart = None):
@@ -401,23 +754,69 @@ class midi_class:
             return self.GM_FILE_PATH
 
         self.GM_FILE_PATH = path
-
-    # Get GM prgram name
-    #   gmbank: GM bank number
-    #   program: GM program number
-    def get_gm_program_name(self, gmbank, program):
+        with self.gm_name_lock:
+            self.gm_name_tables = []
+
+    # Get GM program names table of a GM bank
+    #   GM<bank>.TXT is read at the first use of the bank, the tables of
+    #   the last GM_NAME_BANKS banks used are kept in RAM.
+    #   Returns (names, offsets) or None if the bank file is not available
+    #     names  : Program names in a bytes
+    #     offsets: Offsets of the names in 'names', the program n is names[offsets[n]:offsets[n + 1]]
+    #   The tables are locked while used, the file is read without the lock.
+    def gm_name_table(self, gmbank):
+        with self.gm_name_lock:
+            for i in range(len(self.gm_name_tables)):
+                if self.gm_name_tables[i][0] == gmbank:
+                    bank_table = self.gm_name_tables.pop(i)
+                    self.gm_name_tables.append(bank_table)
+                    return bank_table[1]
+
+        # Load the bank file (a missing file is also cached)
+        table = None
         f = self.sdcard_obj.file_open(self.GM_FILE_PATH, 'GM' + str(gmbank) + '.TXT')
         if not f is None:
+            names = bytearray()
+            offsets = array('H', [0])
             for mf in f:
                 mf = mf.strip()
                 if len(mf) > 0:
-                    if program == 0:
-                        self.sdcard_obj.file_close()
-                        return mf
-
-                program = program - 1
+                    names.extend(mf.encode())
+                    offsets.append(len(names))
 
             self.sdcard_obj.file_close()
+            table = (bytes(names), offsets)
+
+        with self.gm_name_lock:
+            # Loaded in the other thread meanwhile
+            for bank_table in self.gm_name_tables:
+                if bank_table[0] == gmbank:
+                    return bank_table[1]
+
+            self.gm_name_tables.append((gmbank, table))
+            if len(self.gm_name_tables) > self.GM_NAME_BANKS:
+                self.gm_name_tables.pop(0)
+
+        return table
+
+    # GM program names table of a GM bank is in RAM or not
+    def gm_name_loaded(self, gmbank):
+        with self.gm_name_lock:
+            for bank_table in self.gm_name_tables:
+                if bank_table[0] == gmbank:
+                    return True
+
+        return False
+
+    # Get GM prgram name
+    #   gmbank: GM bank number
+    #   program: GM program number
+    def get_gm_program_name(self, gmbank, program):
+        table = self.gm_name_table(gmbank)
+        if not table is None:
+            names, offsets = table
+            if 0 <= program and program < len(offsets) - 1:
+                return names[offsets[program]:offsets[program + 1]].decode()
 
         return 'UNKNOWN'
 
@@ -431,6 +830,39 @@ class midi_class:
     def midi_out(self, midi_bytes):
         self.midi_uart.write(midi_bytes)
 
+    # Pack MIDI messages with running status
+    def pack_messages(self, midi_bytes):
+        return self.synth.pack_messages(midi_bytes)
+
+    # Start a batch to collect messages in, pass it to the message functions to send them in a single write
+    def begin_batch(self):
+        return self.synth.begin_batch()
+
+    # Send the collected messages
+    #   send: False to return the messages packed instead of sending them
+    def end_batch(self, batch, send=True):
+        return self.synth.end_batch(batch, send)
+
+    # Start queueing the output messages
+    def enable_queue(self, size=32, late_us=10000):
+        self.synth.enable_queue(size, late_us)
+
+    # Send all the queued messages and stop queueing
+    def disable_queue(self):
+        self.synth.disable_queue()
+
+    # Send the queued messages within the bytes
+    def drain_queue(self, max_bytes=None):
+        return self.synth.drain_queue(max_bytes)
+
+    # Get the output queue counters
+    def get_queue_stats(self):
+        return self.synth.queue_stats
+
+    # Micro seconds to send a byte
+    def byte_us(self):
+        return self.synth.MIDI_BYTE_US
+
     # MIDI IN
     def midi_in(self):
         midi_rcv_bytes = self.midi_uart.any()
@@ -457,58 +889,63 @@ class midi_class:
         return self.key_trans
 
     # Master volume
-    def set_master_volume(self, vol):
+    def set_master_volume(self, vol, batch=None):
         self.master_volume = vol
-        self.synth.set_master_volume(vol)
+        self.synth.set_master_volume(vol, batch)
 
     # Get master volume
     def get_master_volume(self):
         return self.master_volume
 
     # Set instrument
-    def set_instrument(self, gmbank, channel, prog):
-        self.synth.set_instrument(gmbank, int(channel), int(prog))
+    def set_instrument(self, gmbank, channel, prog, batch=None):
+        self.synth.set_instrument(gmbank, int(channel), int(prog), batch)
 
     # Note on
-    def set_note_on(self, channel, note_key, velosity, transpose = False):
-        self.synth.set_note_on(channel, note_key + (self.key_trans if transpose else 0), velosity)
+    def set_note_on(self, channel, note_key, velosity, transpose = False, batch=None):
+        self.synth.set_note_on(channel, note_key + (self.key_trans if transpose else 0), velosity, batch)
   
     # Note off
-    def set_note_off(self, channel, note_key, transpose = False):
-        self.synth.set_note_off(channel, note_key + (self.key_trans if transpose else 0))
+    def set_note_off(self, channel, note_key, transpose = False, batch=None):
+        self.synth.set_note_off(channel, note_key + (self.key_trans if transpose else 0), batch)
 
     # Notes off
     def notes_off(self, channel, note_keys, transpose = False):
+        batch = self.begin_batch()
         for nk in note_keys:
-            self.set_note_off(channel, nk, transpose)
+            self.set_note_off(channel, nk, transpose, batch)
+        self.end_batch(batch)
 
     # All notes off
-    def set_all_notes_off(self, channel = None):
+    def set_all_notes_off(self, channel = None, batch=None):
         if channel is None:
+            all_batch = self.begin_batch() if batch is None else batch
             for ch in range(16):
-                self.set_all_notes_off(ch)
+                self.set_all_notes_off(ch, all_batch)
+            if batch is None:
+                self.end_batch(all_batch)
         else:
-            self.synth.set_all_notes_off(channel)
+            self.synth.set_all_notes_off(channel, batch)
 
     # Reverb
-    def set_reverb(self, channel, prog, level, feedback):
-        self.synth.set_reverb(channel, prog, level, feedback)
+    def set_reverb(self, channel, prog, level, feedback, batch=None):
+        self.synth.set_reverb(channel, prog, level, feedback, batch)
 
     # Chorus
-    def set_chorus(self, channel, prog, level, feedback, delay):
-        self.synth.set_chorus(channel, prog, level, feedback, delay)
+    def set_chorus(self, channel, prog, level, feedback, delay, batch=None):
+        self.synth.set_chorus(channel, prog, level, feedback, delay, batch)
 
     # Vibrate
-    def set_vibrate(self, channel, rate, depth, delay):
-        self.synth.set_vibrate(channel, rate, depth, delay)
+    def set_vibrate(self, channel, rate, depth, delay, batch=None):
+        self.synth.set_vibrate(channel, rate, depth, delay, batch)
 
     # Pitch Bend
-    def set_pitch_bend(self, channel, value):
-        self.synth.set_pitch_bend(channel, value)
+    def set_pitch_bend(self, channel, value, batch=None):
+        self.synth.set_pitch_bend(channel, value, batch)
 
     # Pitch Bend Range
-    def set_pitch_bend_range(self, channel, value):
-        self.synth.set_pitch_bend_range(channel, value)
+    def set_pitch_bend_range(self, channel, value, batch=None):
+        self.synth.set_pitch_bend_range(channel, value, batch)
 
 ################# End of MIDI Class Definition #################
 
@@ -524,6 +961,9 @@ class midi_in_player_class():
     self.midi_in_set_num = 0                          # MIDI IN setting file number to load/save
     self.MIDI_IN_FILE_PATH = '/SD/SYNTH/MIDIUNIT/' 	  # MIDI IN setting files path
     self.MIDI_SET_FILES_MAX = 1000                    # Maximum MIDI IN setting files
+    self.midi_set_index = None                        # Index of the MIDI IN setting files, see midi_in_set_index()
+    self.midi_in_dirty = True                         # The settings are changed since loaded or saved
+    self.midi_in_saved_num = None                     # File number having the same settings
 
     # MIDI-IN player
     self.midi_in_settings = []                        # MIDI IN settings for each channel, see setup()
@@ -536,14 +976,21 @@ class midi_in_player_class():
       self.midi_in_settings.append({'program':0, 'gmbank':0, 'reverb':[0,0,0], 'chorus':[0,0,0,0], 'vibrate':[0,0,0]})
 
   # Set midi_in_setting
-  def set_midi_in_setting(self, val):
+  #   file_num: File number the settings are read from (None: new settings)
+  def set_midi_in_setting(self, val, file_num = None):
     self.midi_in_settings = val
+    self.midi_in_dirty = file_num is None
+    self.midi_in_saved_num = file_num
 
   def set_midi_in_setting3(self, channel, key_str, val):
-    self.midi_in_settings[channel][key_str] = val
+    if self.midi_in_settings[channel][key_str] != val:
+      self.midi_in_dirty = True
+      self.midi_in_settings[channel][key_str] = val
 
   def set_midi_in_setting4(self, channel, key_str, idx, val):
-    self.midi_in_settings[channel][key_str][idx] = val
+    if self.midi_in_settings[channel][key_str][idx] != val:
+      self.midi_in_dirty = True
+      self.midi_in_settings[channel][key_str][idx] = val
 
   # Get midi_in_setting
   def get_midi_in_setting(self, channel = None, key_str = None):
@@ -588,14 +1035,39 @@ class midi_in_player_class():
     return self.MIDI_SET_FILES_MAX
 
   # Write MIDI IN settings to SD card
+  #   Writing the settings not changed to the same file is skipped.
   #   num: File number (0..999)
+  #   Returns True if the file has the settings
   def write_midi_in_settings(self, num):
+    if not self.midi_in_dirty and self.midi_in_saved_num == num and self.midi_in_set_index().exists(num):
+      print('MIDI-IN SET NOT CHANGED:', num)
+      return True
+
     # Write MIDI IN settings as JSON file
-    self.sdcard_obj.json_write(self.MIDI_IN_FILE_PATH, 'MIDISET{:0=3d}.json'.format(num), self.midi_in_settings)
+    if self.sdcard_obj.json_write(self.MIDI_IN_FILE_PATH, 'MIDISET{:0=3d}.json'.format(num), self.midi_in_settings):
+      self.midi_in_dirty = False
+      self.midi_in_saved_num = num
+      if not self.midi_set_index is None and self.midi_set_index.path == self.MIDI_IN_FILE_PATH:
+        self.midi_set_index.update(num)
+
+      return True
+
+    return False
+
+  # Get the index of the MIDI IN setting files in MIDI_IN_FILE_PATH
+  def midi_in_set_index(self):
+    if self.midi_set_index is None or self.midi_set_index.path != self.MIDI_IN_FILE_PATH:
+      self.midi_set_index = file_index_class(self.MIDI_IN_FILE_PATH, 'MIDISET', ['json'])
+
+    return self.midi_set_index
 
   # Read MIDI IN settings from SD card
   #   num: File number (0..999)
   def read_midi_in_settings(self, num):
+    # No file in the index
+    if not self.midi_in_set_index().exists(num):
+      return None
+
     # Read MIDI IN settings JSON file
     rdjson = None
     rdjson = self.sdcard_obj.json_read(self.MIDI_IN_FILE_PATH, 'MIDISET{:0=3d}.json'.format(num))
@@ -617,17 +1089,20 @@ class midi_in_player_class():
     return rdjson
 
   # Send a MIDI channel settings to Unit-MIDI
-  #   ch: MIDI channel
-  def send_midi_in_settings(self, ch):
-    self.midi_obj.set_instrument(self.midi_in_settings[ch]['gmbank'], ch, self.midi_in_settings[ch]['program'])
-    self.midi_obj.set_reverb(ch, self.midi_in_settings[ch]['reverb'][0], self.midi_in_settings[ch]['reverb'][1], self.midi_in_settings[ch]['reverb'][2])
-    self.midi_obj.set_chorus(ch, self.midi_in_settings[ch]['chorus'][0], self.midi_in_settings[ch]['chorus'][1], self.midi_in_settings[ch]['chorus'][2], self.midi_in_settings[ch]['chorus'][3])
-    self.midi_obj.set_vibrate(ch, self.midi_in_settings[ch]['vibrate'][0], self.midi_in_settings[ch]['vibrate'][1], self.midi_in_settings[ch]['vibrate'][2])
+  #   ch   : MIDI channel
+  #   batch: A batch to collect the messages in (None: send immediately)
+  def send_midi_in_settings(self, ch, batch=None):
+    self.midi_obj.set_instrument(self.midi_in_settings[ch]['gmbank'], ch, self.midi_in_settings[ch]['program'], batch)
+    self.midi_obj.set_reverb(ch, self.midi_in_settings[ch]['reverb'][0], self.midi_in_settings[ch]['reverb'][1], self.midi_in_settings[ch]['reverb'][2], batch)
+    self.midi_obj.set_chorus(ch, self.midi_in_settings[ch]['chorus'][0], self.midi_in_settings[ch]['chorus'][1], self.midi_in_settings[ch]['chorus'][2], self.midi_in_settings[ch]['chorus'][3], batch)
+    self.midi_obj.set_vibrate(ch, self.midi_in_settings[ch]['vibrate'][0], self.midi_in_settings[ch]['vibrate'][1], self.midi_in_settings[ch]['vibrate'][2], batch)
 
   # Send all MIDI channel settings
   def send_all_midi_in_settings(self):
+    batch = self.midi_obj.begin_batch()
     for ch in range(16):
-      self.send_midi_in_settings(ch)
+      self.send_midi_in_settings(ch, batch)
+    self.midi_obj.end_batch(batch)
 
   # Set and show new MIDI channel for MIDI-IN player
   #   dlt: MIDI channel delta value added to the current MIDI IN channel to edit.
@@ -649,6 +1124,9 @@ class midi_in_player_class():
   # Set and show new program to the current MIDI channel for MIDI-IN player
   #   dlt: GM program delta value added to the current MIDI IN channel to edit.
   def set_midi_in_program(self, dlt):
+    if dlt != 0:
+      self.midi_in_dirty = True
+
     self.midi_in_settings[self.midi_in_ch]['program'] = (self.midi_in_settings[self.midi_in_ch]['program'] + dlt) % 128
     midi_in_program = self.midi_in_settings[self.midi_in_ch]['program']
     self.midi_obj.set_instrument(self.midi_in_settings[self.midi_in_ch]['gmbank'], self.midi_in_ch, midi_in_program)
@@ -686,6 +1164,7 @@ class midi_in_player_class():
 
     midi_in_reverb = self.midi_in_settings[self.midi_in_ch]['reverb']
     if not disp is None:
+      self.midi_in_dirty = True
       self.midi_obj.set_reverb(self.midi_in_ch, midi_in_reverb[0], midi_in_reverb[1], midi_in_reverb[2])
 
 
@@ -714,6 +1193,7 @@ class midi_in_player_class():
 
     midi_in_chorus = self.midi_in_settings[self.midi_in_ch]['chorus']
     if send:
+      self.midi_in_dirty = True
       self.midi_obj.set_chorus(self.midi_in_ch, midi_in_chorus[0], midi_in_chorus[1], midi_in_chorus[2], midi_in_chorus[3])
 
 
@@ -737,11 +1217,986 @@ class midi_in_player_class():
 
     midi_in_vibrate = self.midi_in_settings[self.midi_in_ch]['vibrate']
     if send:
+      self.midi_in_dirty = True
       self.midi_obj.set_vibrate(self.midi_in_ch, midi_in_vibrate[0], midi_in_vibrate[1], midi_in_vibrate[2])
 
 ################# End of MIDI-IN Player Class Definition #################
 
 
+########################
+# Play Clock Classes
+########################
+class play_clock_class():
+    # Real time clock
+    def ticks_us(self):
+        return utime.ticks_us()
+
+    def ticks_add(self, ticks, delta):
+        return utime.ticks_add(ticks, delta)
+
+    def ticks_diff(self, ticks1, ticks2):
+        return utime.ticks_diff(ticks1, ticks2)
+
+    def sleep_us(self, us):
+        utime.sleep_us(us)
+
+
+class virtual_clock_class():
+    # Virtual clock, sleep advances the clock without real time passing
+    #   cpu_scale: Ratio of the real processing time added to the clock (0: not added),
+    #              e.g. a host CPU 20 times faster than the target is 20.
+    def __init__(self, cpu_scale=0):
+        self.now = 0
+        self.cpu_scale = cpu_scale
+        self.real_prev = utime.ticks_us()
+
+    # Add the real processing time since the last call
+    def _advance(self):
+        if self.cpu_scale > 0:
+            real_now = utime.ticks_us()
+            self.now = self.now + int(utime.ticks_diff(real_now, self.real_prev) * self.cpu_scale)
+            self.real_prev = real_now
+
+    def ticks_us(self):
+        self._advance()
+        return self.now
+
+    def ticks_add(self, ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def sleep_us(self, us):
+        self._advance()
+        if us > 0:
+            self.now = self.now + us
+
+################# End of Play Clock Class Definition #################
+
+
+########################
+# Virtual UART Class
+########################
+class virtual_uart_class():
+    # UART capturing the output with the clock time, and injecting the input
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []          # [(us, bytes), ..] Data written
+        self.received = []      # [(us, bytes), ..] Data to be read at the time
+
+    # Inject data to be read at the clock time
+    def inject(self, data, us=0):
+        self.received.append((us, bytes(data)))
+        self.received.sort(key = lambda rcv: rcv[0])
+
+    def write(self, data):
+        self.sent.append((self.clock.ticks_us(), bytes(data)))
+        return len(data)
+
+    def any(self):
+        now = self.clock.ticks_us()
+        count = 0
+        for us, data in self.received:
+            if us > now:
+                break
+
+            count = count + len(data)
+
+        return count
+
+    def read(self, nbytes=None):
+        now = self.clock.ticks_us()
+        data = bytearray()
+        while len(self.received) > 0 and self.received[0][0] <= now:
+            data.extend(self.received.pop(0)[1])
+
+        return bytes(data) if len(data) > 0 else None
+
+################# End of Virtual UART Class Definition #################
+
+
+##############################
+# Note-off Scheduler Class
+##############################
+class note_off_scheduler_class():
+    # Constructor
+    #   Note-off items are put in a bucket for each time,
+    #   the bucket times are kept in a binary heap.
+    def __init__(self):
+        self.times = []     # Heap of the bucket times
+        self.buckets = {}   # {time: [item, ..]}
+
+    # Clear all note-off items
+    def clear(self):
+        self.times = []
+        self.buckets = {}
+
+    # Number of the bucket times
+    def __len__(self):
+        return len(self.times)
+
+    # Insert a note-off item at a time
+    #   item: Any data to note off, e.g. (channel, note)
+    def insert(self, tm, item):
+        bucket = self.buckets.get(tm)
+        if bucket is None:
+            self.buckets[tm] = [item]
+            heapq.heappush(self.times, tm)
+        else:
+            bucket.append(item)
+
+    # Get the earliest note-off time or None
+    def next_time(self):
+        if len(self.times) == 0:
+            return None
+
+        return self.times[0]
+
+    # Pop the earliest note-off time and its items
+    #   Returns (time, [item, ..]) or None
+    def pop(self):
+        if len(self.times) == 0:
+            return None
+
+        tm = heapq.heappop(self.times)
+        return (tm, self.buckets.pop(tm))
+
+################# End of Note-off Scheduler Class Definition #################
+
+
+##############################
+# File Buffer Class
+##############################
+class file_buffer_class():
+    # Constructor
+    #   A file is read in chunks and indexed as a bytes object,
+    #   only a chunk is in RAM.
+    #   f    : File opened in binary mode
+    #   size : File size
+    #   chunk: Chunk size to read at once
+    def __init__(self, f, size, chunk=512):
+        self.f = f
+        self.size = size
+        self.chunk_size = chunk
+        self.chunk = b''        # Bytes read at the chunk position
+        self.chunk_pos = 0      # File position of the chunk
+        self.reads = 0          # Number of chunks read
+
+    # Close the file
+    def close(self):
+        if not self.f is None:
+            self.f.close()
+            self.f = None
+
+    # File size
+    def __len__(self):
+        return self.size
+
+    # Read the chunk from a file position
+    def load(self, pos):
+        if pos < 0 or pos >= self.size:
+            raise IndexError('file_buffer_class index out of range')
+
+        self.f.seek(pos)
+        self.chunk_pos = pos
+        self.chunk = self.f.read(self.chunk_size)
+        self.reads = self.reads + 1
+
+    # Get the chunk having a file position
+    #   Returns (chunk bytes, offset of the position in the chunk)
+    def window(self, pos):
+        if pos < self.chunk_pos or pos >= self.chunk_pos + len(self.chunk):
+            self.load(pos)
+
+        return (self.chunk, pos - self.chunk_pos)
+
+    # Get a byte at a file position
+    def byte(self, pos):
+        chunk, offset = self.window(pos)
+        return chunk[offset]
+
+    # Find bytes from a file position, returns the file position or -1
+    #   The bytes must not be longer than the chunk.
+    def find(self, sub, pos=0):
+        while pos < self.size:
+            chunk, offset = self.window(pos)
+            found = chunk.find(sub, offset)
+            if found >= 0:
+                return self.chunk_pos + found
+
+            # The bytes may continue to the next chunk
+            if self.chunk_pos + len(chunk) >= self.size:
+                break
+
+            pos = max(self.chunk_pos + len(chunk) - len(sub) + 1, pos + 1)
+            self.load(pos)
+
+        return -1
+
+    # Count a byte between file positions
+    def count(self, sub, start, end):
+        counted = 0
+        while start < end:
+            chunk, offset = self.window(start)
+            stop = min(len(chunk), offset + end - start)
+            counted = counted + chunk.count(sub, offset, stop)
+            start = start + stop - offset
+
+        return counted
+
+    # Get a byte or bytes of a slice
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start = index.start
+            stop = min(index.stop, self.size)
+            chunk, offset = self.window(start)
+            if offset + stop - start <= len(chunk):
+                return chunk[offset:offset + stop - start]
+
+            data = bytearray()
+            while start < stop:
+                chunk, offset = self.window(start)
+                part = chunk[offset:offset + stop - start]
+                data.extend(part)
+                start = start + len(part)
+
+            return bytes(data)
+
+        return self.byte(index)
+
+################# End of File Buffer Class Definition #################
+
+
+##############################
+# File Index Class
+##############################
+class file_index_class():
+    # Constructor
+    #   The numbered files (<prefix>###.<ext>) in a directory are listed at the first use,
+    #   then the list is updated by the owner when a file is written.
+    #   The metadata of a file is made at the first request and cached.
+    #   path     : Directory of the files
+    #   prefix   : File name prefix, e.g. 'SEQSC'
+    #   exts     : File name extensions, e.g. ['json', 'bin']
+    #   func_info: Function to make the metadata of a file number (None: no metadata)
+    def __init__(self, path, prefix, exts, func_info=None):
+        self.path = path
+        self.prefix = prefix
+        self.exts = exts
+        self.func_info = func_info
+        self.nums = None        # Sorted file numbers
+        self.infos = {}         # {file number: metadata}
+
+    # List the files in the directory
+    #   A file left only as <fname>.bak by an interrupted file replace is listed under its number,
+    #   it is restored when it is opened (see sdcard_class.file_recover()).
+    def build(self):
+        nums = []
+        try:
+            for fname in os.listdir(self.path[:-1] if self.path.endswith('/') else self.path):
+                if fname.endswith('.bak'):
+                    fname = fname[:-4]
+
+                if fname.startswith(self.prefix) and len(fname) > len(self.prefix) + 4 and fname[len(self.prefix) + 3] == '.' and fname[len(self.prefix) + 4:] in self.exts:
+                    try:
+                        num = int(fname[len(self.prefix):len(self.prefix) + 3])
+                    except ValueError:
+                        continue
+
+                    if not num in nums:
+                        nums.append(num)
+
+        except Exception as e:
+            print('file_index_class.build Exception:', e, self.path)
+
+        nums.sort()
+        self.nums = nums
+        self.infos = {}
+
+    # Index of the first number equal or larger than num
+    def find(self, num):
+        if self.nums is None:
+            self.build()
+
+        lo = 0
+        hi = len(self.nums)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.nums[mid] < num:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    # File numbers existing
+    def numbers(self):
+        if self.nums is None:
+            self.build()
+
+        return self.nums
+
+    # File exists or not
+    def exists(self, num):
+        idx = self.find(num)
+        return idx < len(self.nums) and self.nums[idx] == num
+
+    # Next existing file number in the direction of delta (wraps around)
+    #   Returns num if no file exists
+    def next(self, num, delta):
+        idx = self.find(num)
+        if len(self.nums) == 0:
+            return num
+
+        if delta > 0:
+            if idx < len(self.nums) and self.nums[idx] == num:
+                idx = idx + 1
+
+            return self.nums[idx % len(self.nums)]
+
+        if delta < 0:
+            return self.nums[(idx - 1) % len(self.nums)]
+
+        return num
+
+    # A file is written
+    def update(self, num):
+        if self.nums is None:
+            return
+
+        idx = self.find(num)
+        if idx == len(self.nums) or self.nums[idx] != num:
+            self.nums.insert(idx, num)
+
+        if num in self.infos:
+            del self.infos[num]
+
+    # A file is removed
+    def remove(self, num):
+        if self.nums is None:
+            return
+
+        if self.exists(num):
+            self.nums.pop(self.find(num))
+
+        if num in self.infos:
+            del self.infos[num]
+
+    # Metadata of a file (None: no file or no metadata)
+    def info(self, num):
+        if self.func_info is None or not self.exists(num):
+            return None
+
+        if not num in self.infos:
+            self.infos[num] = self.func_info(num)
+
+        return self.infos[num]
+
+################# End of File Index Class Definition #################
+
+
+##############################
+# Storage Worker Class
+##############################
+class storage_worker_class():
+    # Constructor
+    #   SD card accesses requested in any context (e.g. joy stick callbacks in the device thread)
+    #   are queued and done one by one by service() in the context owning the SD card,
+    #   the application loop and the spare time of the players.
+    #   The results are notified to func_done in controller() called by the device manager,
+    #   so the requester sees the completion in its own context.
+    #   In the spare time of a player, only the requests allowed while playing and taken
+    #   shorter than the spare time before are done, the others wait for the application loop.
+    #   device_manager: Device manager to notify the completions (None: call controller() by yourself)
+    def __init__(self, device_manager=None):
+        self.lock = _thread.allocate_lock()
+        self.requests = []      # [(key, func, args, func_done, playing), ..] in FIFO
+        self.completions = []   # [(func_done, result), ..]
+        self.costs = {}         # {request kind: maximum micro seconds to do}
+
+        # Counters
+        #   'requests': Requests queued, 'merged': Pending requests replaced by the newer one,
+        #   'done': Requests done, 'errors': Requests raised an exception,
+        #   'max_us'/'total_us': Time to do a request
+        self.stats = {'requests': 0, 'merged': 0, 'done': 0, 'errors': 0, 'max_us': 0, 'total_us': 0}
+
+        if not device_manager is None:
+            device_manager.add_device(self)
+
+    # Queue a request
+    #   key      : Request name, a pending request of the same key is replaced (None: never replaced)
+    #   func     : Function accessing the storage
+    #   args     : Arguments tuple of func
+    #   func_done: Called with the result of func in controller() (None: no notification)
+    #   playing  : False to wait until the player stops (e.g. writing files)
+    def request(self, key, func, args=(), func_done=None, playing=True):
+        with self.lock:
+            self.stats['requests'] = self.stats['requests'] + 1
+            if not key is None:
+                for i in range(len(self.requests)):
+                    if self.requests[i][0] == key:
+                        self.requests[i] = (key, func, args, func_done, playing)
+                        self.stats['merged'] = self.stats['merged'] + 1
+                        return
+
+            self.requests.append((key, func, args, func_done, playing))
+
+    # Kind of a request to measure the time, the first item of a tuple key
+    def request_kind(self, key, func):
+        if key is None:
+            return func
+
+        return key[0] if isinstance(key, tuple) else key
+
+    # Number of the pending requests
+    def pending(self):
+        return len(self.requests)
+
+    # Do the first request
+    #   spare_us: Micro seconds to the next event of a player (None: not playing, any request is done)
+    #             The first request allowed while playing and done within spare_us before is done.
+    #   Returns True if a request is done
+    def service(self, spare_us=None):
+        with self.lock:
+            index = -1
+            for i in range(len(self.requests)):
+                key, func, args, func_done, playing = self.requests[i]
+                if spare_us is None:
+                    index = i
+                    break
+
+                cost = self.costs.get(self.request_kind(key, func))
+                if playing and not cost is None and cost <= spare_us:
+                    index = i
+                    break
+
+            if index < 0:
+                return False
+
+            key, func, args, func_done, playing = self.requests.pop(index)
+
+        tm = utime.ticks_us()
+        try:
+            result = func(*args)
+        except Exception as e:
+            print('STORAGE WORKER ERROR:', key, e)
+            self.stats['errors'] = self.stats['errors'] + 1
+            result = None
+
+        tm = utime.ticks_diff(utime.ticks_us(), tm)
+        kind = self.request_kind(key, func)
+        if tm > self.costs.get(kind, 0):
+            self.costs[kind] = tm
+
+        self.stats['done'] = self.stats['done'] + 1
+        self.stats['total_us'] = self.stats['total_us'] + tm
+        if tm > self.stats['max_us']:
+            self.stats['max_us'] = tm
+
+        if not func_done is None:
+            with self.lock:
+                self.completions.append((func_done, result))
+
+        return True
+
+    # Notify the completions (device controller)
+    def controller(self):
+        while len(self.completions) > 0:
+            with self.lock:
+                func_done, result = self.completions.pop(0)
+
+            func_done(result)
+
+################# End of Storage Worker Class Definition #################
+
+
+##############################
+# Score Source Classes
+##############################
+# Score slots in memory
+class score_list_source_class():
+    # Constructor
+    #   seq_score: Score slots sorted by the time
+    def __init__(self, seq_score):
+        self.seq_score = seq_score
+        self.index = 0
+
+    # Move to the first slot having the time equal or larger than tm
+    def seek(self, tm):
+        lo = 0
+        hi = len(self.seq_score)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.seq_score[mid]['time'] < tm:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        self.index = lo
+
+    # Get the next slot, None at the end
+    def next(self):
+        if self.index >= len(self.seq_score):
+            return None
+
+        score = self.seq_score[self.index]
+        self.index = self.index + 1
+        return score
+
+    def close(self):
+        pass
+
+
+# Score slots streamed from a file
+#   The slots are parsed one by one, only the file positions at the checkpoint times
+#   (the repeat sign times) are kept to seek back for the repeats.
+#   A sub class reads the slots in a file format with read_slot(), get_state() and set_state().
+class score_stream_class():
+    # Constructor
+    #   data: file_buffer_class object of the file
+    def __init__(self, data):
+        self.data = data
+        self.start_state = None     # State at the first slot
+        self.checkpoint_times = []  # Times to seek back to
+        self.checkpoints = {}       # {checkpoint time: state at the first slot of the time or later}
+        self.last_time = -1         # Time of the last slot read
+        self.held = None            # Slot read by seek()
+
+    # Set the times to seek back to
+    def set_checkpoints(self, times):
+        self.checkpoint_times = sorted(times)
+        self.checkpoints = {}
+
+    # Move to the first slot having the time equal or larger than tm
+    def seek(self, tm):
+        # Start from the nearest checkpoint before the time
+        start = -1
+        for ckpt_time in self.checkpoints.keys():
+            if ckpt_time <= tm and ckpt_time > start:
+                start = ckpt_time
+
+        self.held = None
+        if start >= 0:
+            self.set_state(self.checkpoints[start])
+            self.last_time = start - 1
+        elif not self.start_state is None:
+            self.set_state(self.start_state)
+            self.last_time = -1
+
+        # Skip the slots before the time
+        score = self.next()
+        while not score is None and score['time'] < tm:
+            score = self.next()
+
+        self.held = score
+
+    # Get the next slot, None at the end
+    def next(self):
+        if not self.held is None:
+            score = self.held
+            self.held = None
+            return score
+
+        state = self.get_state()
+        score = self.read_slot()
+        if score is None:
+            return None
+
+        # Checkpoints between the last slot and this slot
+        for ckpt_time in self.checkpoint_times:
+            if ckpt_time > self.last_time and ckpt_time <= score['time'] and not ckpt_time in self.checkpoints:
+                self.checkpoints[ckpt_time] = state
+
+        self.last_time = score['time']
+        return score
+
+    def close(self):
+        self.data.close()
+
+
+# Score slots streamed from a binary sequencer file (see sequencer_class.sequencer_encode_binary())
+class score_stream_binary_class(score_stream_class):
+    # Constructor
+    #   data     : file_buffer_class object of the file
+    #   score_pos: File position of the score section
+    def __init__(self, data, score_pos):
+        super().__init__(data)
+        self.slots, self.pos = self.varint(score_pos)
+        self.prev_time = 0
+        self.start_state = self.get_state()
+
+    # Get an unsigned variable length quantity, returns (value, next position)
+    def varint(self, pos):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.data.byte(pos)
+            pos = pos + 1
+            value = value | ((byte & 0x7f) << shift)
+            if byte < 0x80:
+                return (value, pos)
+
+            shift = shift + 7
+
+    def get_state(self):
+        return (self.pos, self.prev_time, self.slots)
+
+    def set_state(self, state):
+        self.pos, self.prev_time, self.slots = state
+
+    # Read a slot at the current position
+    def read_slot(self):
+        if self.slots <= 0:
+            return None
+
+        delta, pos = self.varint(self.pos)
+        notes, pos = self.varint(pos)
+        score = {'time': self.prev_time + delta, 'max_duration': 0, 'notes': []}
+        data = self.data[pos:pos + notes * 5]
+        for n in range(0, notes * 5, 5):
+            duration = data[n + 3] | (data[n + 4] << 8)
+            score['notes'].append({'channel': data[n], 'note': data[n + 1], 'velocity': data[n + 2], 'duration': duration})
+            if duration > score['max_duration']:
+                score['max_duration'] = duration
+
+        self.pos = pos + notes * 5
+        self.prev_time = score['time']
+        self.slots = self.slots - 1
+        return score
+
+
+# Score slots streamed from a JSON sequencer file
+#   read_header() finds the score array and parses the data except the score slots,
+#   then each slot object in the 'score' array is parsed when it is read.
+#   The file is scanned in chunks with find() and count(), the strings in the file
+#   are the keys of the sequencer data, so no bracket is in a string.
+class score_stream_json_class(score_stream_class):
+    # Constructor
+    #   data: file_buffer_class object of the file
+    def __init__(self, data):
+        super().__init__(data)
+        self.pos = -1               # File position to read the next slot (-1: no score)
+
+    # Get the position after a JSON object or array at a position
+    def skip_value(self, pos):
+        data = self.data
+        size = len(data)
+        open_ch = data[pos:pos + 1]
+        close_ch = b'}' if open_ch == b'{' else b']'
+        depth = 0
+        while pos < size:
+            chunk, offset = data.window(pos)
+            end = chunk.find(close_ch, offset)
+            if end < 0:
+                depth = depth + chunk.count(open_ch, offset)
+                pos = pos + len(chunk) - offset
+                continue
+
+            depth = depth + chunk.count(open_ch, offset, end) - 1
+            pos = pos + end - offset + 1
+            if depth == 0:
+                return pos
+
+        return pos
+
+    # Parse the sequencer data except the score slots
+    #   Returns {'channel': .., 'control': .., 'score': [], 'sign': .., 'tempo': ..}
+    def read_header(self):
+        data = self.data
+        size = len(data)
+        key = data.find(b'"score"')
+        array = -1 if key < 0 else data.find(b'[', key)
+        if array < 0:
+            text = data[0:size]
+        else:
+            self.pos = array + 1
+            text = data[0:array] + b'[]' + data[self.skip_value(array):size]
+
+        self.start_state = self.get_state()
+        return json.loads(text.decode())
+
+    def get_state(self):
+        return self.pos
+
+    def set_state(self, state):
+        self.pos = state
+
+    # Read a slot at the current position
+    def read_slot(self):
+        if self.pos < 0:
+            return None
+
+        data = self.data
+        size = len(data)
+        while self.pos < size:
+            ch = data.byte(self.pos)
+            if ch == 0x7b:          # '{'
+                end = self.skip_value(self.pos)
+                score = json.loads(data[self.pos:end].decode())
+                self.pos = end
+                return score
+
+            if ch == 0x5d:          # ']'
+                break
+
+            self.pos = self.pos + 1
+
+        return None
+
+################# End of Score Source Class Definition #################
+
+
+##############################
+# SMF Track Class
+##############################
+class smf_track_class():
+    # Constructor
+    #   Events of a track chunk in a Standard MIDI File are read one by one,
+    #   only a small buffer of the track is in RAM.
+    #   f    : SMF file opened in binary mode (shared by the tracks)
+    #   start: File position of the track data (next to the chunk header)
+    #   end  : File position of the end of the track data
+    #   chunk: Buffer size of the track
+    def __init__(self, f, start, end, chunk=64):
+        self.EVENT_MIDI  = 0    # Channel message
+        self.EVENT_TEMPO = 1    # Tempo (micro seconds per quarter note)
+        self.EVENT_SYSEX = 2    # System exclusive message
+        self.EVENT_METER = 3    # Time signature (numerator, denominator as a power of 2)
+
+        self.data = file_buffer_class(f, end, chunk)
+        self.pos = start
+        self.tick = 0           # Tick of the current event
+        self.status = 0         # Running status
+        self.event = None       # The current event (kind, data)
+
+    # Read a variable length quantity
+    def varint(self):
+        value = 0
+        while True:
+            b = self.data.byte(self.pos)
+            self.pos = self.pos + 1
+            value = (value << 7) | (b & 0x7f)
+            if b < 0x80:
+                return value
+
+    # Read the next event to self.event, the meta events except tempo and time signature are skipped
+    #   Returns False at the end of the track (or a broken track)
+    def read_event(self):
+        try:
+            while self.pos < len(self.data):
+                self.tick = self.tick + self.varint()
+                status = self.data.byte(self.pos)
+                if status >= 0x80:
+                    self.pos = self.pos + 1
+                elif self.status != 0:
+                    status = self.status
+                else:
+                    return False
+
+                # Channel message
+                if status < 0xf0:
+                    self.status = status
+                    data_len = 1 if 0xc0 <= status and status < 0xe0 else 2
+                    self.event = (self.EVENT_MIDI, bytes([status]) + self.data[self.pos:self.pos + data_len])
+                    self.pos = self.pos + data_len
+                    return True
+
+                # Meta event (the running status is kept as many files expect)
+                if status == 0xff:
+                    meta_type = self.data.byte(self.pos)
+                    self.pos = self.pos + 1
+                    meta_len = self.varint()
+                    if meta_type == 0x2f:
+                        return False
+
+                    meta_pos = self.pos
+                    self.pos = self.pos + meta_len
+                    if meta_type == 0x51 and meta_len == 3:
+                        self.event = (self.EVENT_TEMPO, (self.data.byte(meta_pos) << 16) | (self.data.byte(meta_pos + 1) << 8) | self.data.byte(meta_pos + 2))
+                        return True
+
+                    if meta_type == 0x58 and meta_len >= 2:
+                        self.event = (self.EVENT_METER, (self.data.byte(meta_pos), self.data.byte(meta_pos + 1)))
+                        return True
+
+                # System exclusive message (F0) or escaped bytes (F7)
+                elif status == 0xf0 or status == 0xf7:
+                    self.status = 0
+                    sysex_len = self.varint()
+                    sysex = self.data[self.pos:self.pos + sysex_len]
+                    self.pos = self.pos + sysex_len
+                    self.event = (self.EVENT_SYSEX, (b'\xf0' + sysex) if status == 0xf0 else sysex)
+                    return True
+
+                else:
+                    return False
+
+        except IndexError:
+            print('smf_track_class: Broken track.')
+
+        return False
+
+################# End of SMF Track Class Definition #################
+
+
+##############################
+# SMF Writer Class
+##############################
+class smf_writer_class():
+    # Constructor
+    #   A Standard MIDI File is written in a stream with a bounded buffer,
+    #   the length of a track chunk is written back when the track ends.
+    #   f   : File opened in binary write mode
+    #   size: Buffer size
+    def __init__(self, f, size=256):
+        self.f = f
+        self.buf = bytearray(size)
+        self.buf_len = 0
+        self.track_pos = 0          # File position of the track chunk length
+        self.track_len = 0          # Bytes written in the track
+        self.tick = 0               # Tick of the last event
+        self.status = 0             # Running status in the track
+        self.in_status = 0          # Running status of the input messages (see messages())
+        self.in_msg = bytearray()   # Input message being parsed
+
+    # Write bytes through the buffer
+    def write(self, data):
+        data_len = len(data)
+        if self.buf_len + data_len > len(self.buf):
+            self.flush()
+
+        if data_len > len(self.buf):
+            self.f.write(data)
+        else:
+            self.buf[self.buf_len:self.buf_len + data_len] = data
+            self.buf_len = self.buf_len + data_len
+
+        self.track_len = self.track_len + data_len
+
+    # Write the buffer to the file
+    def flush(self):
+        if self.buf_len > 0:
+            self.f.write(memoryview(self.buf)[0:self.buf_len])
+            self.buf_len = 0
+
+    # Write a variable length quantity
+    def varint(self, value):
+        data = bytearray((value & 0x7f,))
+        value = value >> 7
+        while value > 0:
+            data.insert(0, (value & 0x7f) | 0x80)
+            value = value >> 7
+
+        self.write(data)
+
+    # Write the delta time to an event
+    def delta(self, tick):
+        if tick < self.tick:
+            tick = self.tick
+
+        self.varint(tick - self.tick)
+        self.tick = tick
+
+    # Write the header chunk
+    #   fmt     : SMF format (0 or 1)
+    #   tracks  : Number of the tracks
+    #   division: Ticks per quarter note
+    def header(self, fmt, tracks, division):
+        self.write(b'MThd\x00\x00\x00\x06')
+        self.write(bytes((fmt >> 8, fmt & 0xff, tracks >> 8, tracks & 0xff, division >> 8, division & 0xff)))
+
+    # Start a track chunk
+    def begin_track(self):
+        self.flush()
+        self.track_pos = self.f.tell() + 4
+        self.write(b'MTrk\x00\x00\x00\x00')
+        self.track_len = 0
+        self.tick = 0
+        self.status = 0
+        self.in_status = 0
+        self.in_msg = bytearray()
+
+    # End the track chunk, then write the chunk length
+    #   tick: Tick of the end of the track (None: the last event)
+    def end_track(self, tick = None):
+        self.meta(self.tick if tick is None else tick, 0x2f, b'')
+        self.flush()
+        end_pos = self.f.tell()
+        self.f.seek(self.track_pos)
+        self.f.write(bytes(((self.track_len >> 24) & 0xff, (self.track_len >> 16) & 0xff, (self.track_len >> 8) & 0xff, self.track_len & 0xff)))
+        self.f.seek(end_pos)
+
+    # Write a meta event
+    def meta(self, tick, meta_type, data):
+        self.delta(tick)
+        self.write(bytes((0xff, meta_type)))
+        self.varint(len(data))
+        self.write(data)
+        self.status = 0
+
+    # Write a tempo meta event
+    #   tempo_us: Micro seconds per quarter note
+    def tempo(self, tick, tempo_us):
+        self.meta(tick, 0x51, bytes(((tempo_us >> 16) & 0xff, (tempo_us >> 8) & 0xff, tempo_us & 0xff)))
+
+    # Write a channel message or a system exclusive message
+    def message(self, tick, msg):
+        self.delta(tick)
+        if msg[0] == 0xf0:
+            self.write(b'\xf0')
+            self.varint(len(msg) - 1)
+            self.write(msg[1:])
+            self.status = 0
+
+        else:
+            self.write(msg[1:] if msg[0] == self.status else msg)
+            self.status = msg[0]
+
+    # Write MIDI messages in a byte stream (with running status, messages can be split between the calls)
+    #   The realtime and the system common messages are dropped.
+    #   channel: MIDI channel of the messages to write (None: all channels)
+    def messages(self, tick, data, channel = None):
+        for b in data:
+            if b >= 0xf8:
+                continue
+
+            # System exclusive message
+            if self.in_status == 0xf0:
+                self.in_msg.append(b if b < 0x80 else 0xf7)
+                if b >= 0x80:
+                    self.message(tick, self.in_msg)
+                    self.in_status = 0
+                    self.in_msg = bytearray()
+                    if b == 0xf7:
+                        continue
+
+                else:
+                    continue
+
+            # Status byte
+            if b >= 0x80:
+                self.in_status = b if b <= 0xf0 else 0
+                self.in_msg = bytearray((b,)) if b == 0xf0 else bytearray()
+                continue
+
+            # Data byte
+            if self.in_status == 0:
+                continue
+
+            if len(self.in_msg) == 0:
+                self.in_msg.append(self.in_status)
+
+            self.in_msg.append(b)
+            if len(self.in_msg) == (2 if 0xc0 <= self.in_status and self.in_status < 0xe0 else 3):
+                if channel is None or (self.in_status & 0x0f) == channel:
+                    self.message(tick, self.in_msg)
+
+                self.in_msg = bytearray()
+
+################# End of SMF Writer Class Definition #################
+
+
 ###################
 # Sequencer Class
 ###################
@@ -773,6 +2228,15 @@ class sequencer_class():
   #    }
   # ]
 
+  # self.seq_score_tempo: Tempo and meter changes on the score (tempo map)
+  # [
+  #    {
+  #       'time': <Change on time>,
+  #       'tempo': <Tempo from here>              (optional)
+  #       'time_per_bar': <Times per bar from here> (optional)
+  #    }
+  # ]
+
   # Sequencer controls
   #   'tempo': Play a quoter note 'tempo' times per a minutes 
   #   'mini_note': Minimum note length (4,8,16,32,64: data are 2,3,4,5,6 respectively) 
@@ -792,6 +2256,8 @@ class sequencer_class():
     self.seq_channel = None
     self.seq_score = None
     self.seq_score_sign = None
+    self.seq_score_tempo = None
+    self.seq_tempo_table = None
     self.seq_parm_repeat = None
     self.seq_control = {'tempo': 120, 'mini_note': 4, 'time_per_bar': 4, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15], 'gmbank':[0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]}
 
@@ -859,10 +2325,51 @@ class sequencer_class():
     # Sequencer file path
     self.SEQUENCER_FILE_PATH = '/SD/SYNTH/SEQFILE/'
 
+    # Sequencer file formats
+    #   JSON  : SEQSC###.json
+    #   BINARY: SEQSC###.bin, see sequencer_encode_binary()
+    self.SEQ_FORMAT_JSON   = 0
+    self.SEQ_FORMAT_BINARY = 1
+    self.seq_file_format = self.SEQ_FORMAT_JSON            # Format to save, the other format is loaded if the file does not exist
+    self.seq_file_ext = ['json', 'bin']                    # File extension for each format
+    self.SEQ_BINARY_MAGIC = b'SEQB'
+    self.SEQ_BINARY_VERSION = 1
+    self.seq_file_buffer = None                            # Buffer to read a binary file (grows to the largest file)
+    self.seq_stream = None                                 # Score source streaming a file (None: the score in memory)
+    self.seq_streamed = None                               # (path, num) of the file streamed, the score is not in memory (None: loaded)
+    self.seq_file_index = None                             # Index of the sequencer files, see sequencer_file_index()
+    self.seq_dirty = True                                  # The data is changed since loaded or saved
+    self.seq_saved_file = None                             # (path, num) of the file having the same data
+    self.SEQ_STREAM_LOOKAHEAD = 32                         # Events compiled ahead while playing
+    self.SEQ_STREAM_SPARE_US = 10000                       # Spare time (micro seconds) to the next event to compile ahead
+    self.SMF_DIVISION = 480                                # Ticks per quarter note of the exported MIDI files
+
+    # Catch-up policy when the player is late for a deadline
+    self.SEQ_CATCHUP_BURST = 0                             # Keep the deadlines, send the late events at once
+    self.SEQ_CATCHUP_SLIP  = 1                             # Shift the following deadlines by the lateness
+    self.seq_catchup = self.SEQ_CATCHUP_SLIP               # Current catch-up policy
+    self.SEQ_CATCHUP_LIMIT = 2000                          # Lateness (micro seconds) to apply the catch-up policy
+    self.SEQ_MIDI_THRU_US = 2000                           # Cadence (micro seconds) to forward MIDI-IN while waiting for an event
+    self.SEQ_IDLE_SPARE_US = 50000                         # Spare time (micro seconds) to the next event to run the idle task
+    self.seq_idle_task = None                              # Function called with the spare time while playing, see set_idle_task()
+
+    # Lateness counters of the last play, see play_sequencer()
+    self.seq_play_stats = None
+
+    # Clock to play, see play_sequencer_dry_run()
+    self.seq_clock = play_clock_class()
+    self.seq_dry_run = False
+
   # Set delegation class for graphics
   def delegate_graphics(self, view_delegate_obj):
     self.view_delegate_obj = view_delegate_obj
 
+  # Set a task to run in the spare time while playing (e.g. storage_worker_class.service)
+  #   func: Function doing a task within the micro seconds given, returns True if it did something (None: no task)
+  #         The time given is the spare time to the next event less SEQ_MIDI_THRU_US.
+  def set_idle_task(self, func):
+    self.seq_idle_task = func
+
   # Set up the sequencer
   def setup_sequencer(self):
     # Initialize the sequencer channels
@@ -873,6 +2380,9 @@ class sequencer_class():
     # Clear score
     self.seq_score = []
     self.seq_score_sign = []
+    self.seq_score_tempo = []
+    self.seq_tempo_table = None
+    self.seq_streamed = None
 
   # Set/Get sequencer file path
   def set_sequencer_file_path(self, path = None):
@@ -927,6 +2437,7 @@ class sequencer_class():
 
   # Clear seq_score
   def clear_seq_score(self):
+    self.sequencer_changed()
     self.seq_score = []
 
   # Get seq_score
@@ -935,6 +2446,7 @@ class sequencer_class():
 
   # Set seq_channel
   def set_seq_channel(self, channel, key_str, val):
+    self.sequencer_changed()
     self.seq_channel[channel][key_str] = val
     return val
 
@@ -1001,6 +2513,7 @@ class sequencer_class():
 
   # Set time per bar
   def set_seq_time_per_bar(self, tpb):
+    self.sequencer_changed()
     self.seq_control['time_per_bar'] = tpb if tpb > 2 else 2
 
   # Get time per bar
@@ -1009,12 +2522,14 @@ class sequencer_class():
 
   # Set tempo
   def set_seq_tempo(self, tempo):
+    self.sequencer_changed()
     if tempo < 6:
       tempo = 6
     elif tempo > 999:
       tempo = 999
 
     self.seq_control['tempo'] = tempo
+    self.seq_tempo_table = None
 
   # Get tempo
   def get_seq_tempo(self):
@@ -1022,12 +2537,14 @@ class sequencer_class():
 
   # Set minimum note length
   def set_seq_mini_note(self, length):
+    self.sequencer_changed()
     if length < 2:
       length = 2
     elif length > 5:
       length = 5
 
     self.seq_control['mini_note'] = length
+    self.seq_tempo_table = None
 
   # Get minimum note length
   def get_seq_mini_note(self):
@@ -1035,6 +2552,7 @@ class sequencer_class():
 
   # Set GM bank for a channel
   def set_seq_gmbank(self, channel, bank):
+    self.sequencer_changed()
     self.seq_control['gmbank'][channel] = bank
 
   # Get GM bank for a channel
@@ -1043,6 +2561,7 @@ class sequencer_class():
 
   # Set program for a channel
   def set_seq_program(self, channel, prog):
+    self.sequencer_changed()
     prog = prog % 128
     self.seq_control['program'][channel] = prog
 
@@ -1050,60 +2569,588 @@ class sequencer_class():
   def get_seq_program(self, channel):
     return self.seq_control['program'][channel]
 
+  # Sequencer file name
+  #   file_format: SEQ_FORMAT_JSON or SEQ_FORMAT_BINARY
+  def sequencer_file_name(self, num, file_format):
+    return 'SEQSC{:0=3d}.'.format(num) + self.seq_file_ext[file_format]
+
+  # Write sequencer data to a file
+  #   seq_data: {'channel': .., 'control': .., 'score': .., 'sign': .., 'tempo': ..}
+  #   The binary format is not written if it can not represent the data (use the JSON format).
+  def sequencer_write_file(self, path, num, seq_data, file_format):
+    if file_format == self.SEQ_FORMAT_BINARY:
+      try:
+        data = self.sequencer_encode_binary(seq_data)
+      except (ValueError, TypeError) as e:
+        print('SEQUENCER: Can not write the binary format.', e)
+        return False
+
+      written = self.sdcard_obj.binary_write(path, self.sequencer_file_name(num, file_format), data)
+    else:
+      written = self.sdcard_obj.json_write(path, self.sequencer_file_name(num, file_format), seq_data)
+
+    if written:
+      self.sequencer_file_updated(path, num)
+
+    return written
+
+  # Read sequencer data from a file
+  #   file_format: Format to read, None is seq_file_format then the other format
+  def sequencer_read_file(self, path, num, file_format = None):
+    if file_format is None:
+      formats = [self.seq_file_format, 1 - self.seq_file_format]
+    else:
+      formats = [file_format]
+
+    for fmt in formats:
+      fname = self.sequencer_file_name(num, fmt)
+      size = self.sdcard_obj.file_size(path, fname)
+      if size is None:
+        continue
+
+      if fmt == self.SEQ_FORMAT_JSON:
+        return self.sdcard_obj.json_read(path, fname)
+
+      # Read the whole binary file into the buffer at once
+      if self.seq_file_buffer is None or len(self.seq_file_buffer) < size:
+        self.seq_file_buffer = None
+        self.seq_file_buffer = bytearray(size)
+
+      if self.sdcard_obj.binary_read(path, fname, self.seq_file_buffer) == size:
+        return self.sequencer_decode_binary(memoryview(self.seq_file_buffer)[:size])
+
+    return None
+
+  # Convert a sequencer file to the other format
+  #   to_format: SEQ_FORMAT_JSON or SEQ_FORMAT_BINARY
+  def sequencer_convert_file(self, path, num, to_format):
+    seq_data = self.sequencer_read_file(path, num, 1 - to_format)
+    if seq_data is None:
+      return False
+
+    return self.sequencer_write_file(path, num, seq_data, to_format)
+
+  # Sequencer data is changed (edited)
+  #   The score of a file streamed is loaded in memory to edit it.
+  def sequencer_changed(self):
+    if not self.seq_streamed is None:
+      self.sequencer_load_streamed()
+
+    self.seq_dirty = True
+
+  # Load the whole file streamed, the score is not in memory after streaming
+  #   The stream being played is kept open.
+  #   Returns True if the score is in memory
+  def sequencer_load_streamed(self):
+    if self.seq_streamed is None:
+      return True
+
+    path, num = self.seq_streamed
+    self.seq_streamed = None
+    seq_data = self.sequencer_read_file(path, num)
+    if seq_data is None:
+      print('SEQUENCER: Can not load the score streamed.', path, num)
+      return False
+
+    self.sequencer_set_data(seq_data, False)
+    self.sequencer_unchanged(path, num)
+    return True
+
+  # Sequencer data is same as a file
+  def sequencer_unchanged(self, path, num):
+    self.seq_dirty = False
+    self.seq_saved_file = (path, num)
+
   # Save sequencer file
+  #   Saving the data not changed to the same file is skipped.
   def sequencer_save_file(self, path, num):
+    if not self.sequencer_load_streamed():
+      return
+
+    if not self.seq_dirty and self.seq_saved_file == (path, num) and not self.sdcard_obj.file_size(path, self.sequencer_file_name(num, self.seq_file_format)) is None:
+      print('SEQUENCER: No change to save.')
+      return
+
     # Write MIDI IN settings as JSON file
-    if self.sdcard_obj.json_write(path, 'SEQSC{:0=3d}.json'.format(num), {'channel': self.seq_channel, 'control': self.seq_control, 'score': self.seq_score, 'sign': self.seq_score_sign}):
+    if self.sequencer_write_file(path, num, {'channel': self.seq_channel, 'control': self.seq_control, 'score': self.seq_score, 'sign': self.seq_score_sign, 'tempo': self.seq_score_tempo}, self.seq_file_format):
+      # The file in the other format is superseded, it would be loaded instead of the saved one
+      self.sdcard_obj.file_remove(path, self.sequencer_file_name(num, 1 - self.seq_file_format))
+      self.sequencer_unchanged(path, num)
       print('SAVED')
 
+  # Export the score to a Standard MIDI File (format 1)
+  #   The track 0 has the tempo and the meter, a track for each MIDI channel on the score follows
+  #   with the bank and the program, the velocities are scaled with the channel volume as played.
+  #   The file is written in a stream, the score is compiled again for each channel.
+  #   path, fname: MIDI file to write
+  #   unroll     : True : Loop/Skip/Repeat signs are unrolled, the tempo changes are rendered in the event times
+  #                False: The score is written as is with the tempo map
+  #   Returns True if the file is written
+  def sequencer_export_smf(self, path, fname, unroll = True):
+    f = self.sdcard_obj.binary_create(path, fname)
+    if f is None:
+      return False
+
+    # Ticks per a time on the score
+    mini_note = self.seq_control['mini_note']
+    if mini_note is None:
+      mini_note = 4
+
+    time_ticks = self.SMF_DIVISION * 4 // 2**mini_note
+    tick_us = self.sequencer_tick_us()
+    tempo_us = lambda tempo: self.sequencer_tick_us(tempo) * 2**mini_note // 4
+
+    # MIDI channels on the score
+    source = self.sequencer_score_source()
+    channels = []
+    source.seek(0)
+    score = source.next()
+    while not score is None:
+      for note_data in score['notes']:
+        if not note_data['channel'] in channels:
+          channels.append(note_data['channel'])
+
+      score = source.next()
+
+    channels.sort()
+
+    # Export the whole score
+    play_time_bk = self.seq_play_time
+    self.seq_play_time = [0,0]
+    writer = smf_writer_class(f)
+    try:
+      writer.header(1, len(channels) + 1, self.SMF_DIVISION)
+
+      # Conductor track
+      writer.begin_track()
+      writer.tempo(0, tempo_us(None))
+      writer.meta(0, 0x58, bytes((min(self.seq_control['time_per_bar'], 255), mini_note, 24, 8)))
+      if not unroll and not self.seq_score_tempo is None:
+        for sc_tempo in sorted(self.seq_score_tempo, key = lambda sc_tempo: sc_tempo['time']):
+          if 'tempo' in sc_tempo.keys() and not sc_tempo['tempo'] is None:
+            writer.tempo(sc_tempo['time'] * time_ticks, tempo_us(sc_tempo['tempo']))
+
+          if 'time_per_bar' in sc_tempo.keys() and not sc_tempo['time_per_bar'] is None:
+            writer.meta(sc_tempo['time'] * time_ticks, 0x58, bytes((min(sc_tempo['time_per_bar'], 255), mini_note, 24, 8)))
+
+      writer.end_track()
+
+      # Channel tracks
+      for ch in channels:
+        writer.begin_track()
+        writer.messages(0, bytes((0xb0 + ch, 0x00, self.seq_control['gmbank'][ch], 0xc0 + ch, self.seq_control['program'][ch])))
+
+        if unroll:
+          for evt_us, evt_cursor, midi_bytes in self.sequencer_compile_iter(source):
+            writer.messages((evt_us * time_ticks + tick_us // 2) // tick_us, midi_bytes, ch)
+
+        else:
+          for evt_tick, evt_cursor, midi_bytes in self.sequencer_compile_iter(source, lambda tm: tm * time_ticks, False):
+            writer.messages(evt_tick, midi_bytes, ch)
+
+        writer.end_track()
+
+      print('SEQUENCER: Exported.', path + fname)
+      return True
+
+    except Exception as e:
+      print('SEQUENCER: Can not export.', e, path, fname)
+
+    finally:
+      self.seq_play_time = play_time_bk
+      f.close()
+
+    return False
+
+  # Check a value to write in the binary format
+  #   A value which is not an integer from 0 to max_value raises ValueError, the binary format can not represent it.
+  def sequencer_binary_value(self, value, max_value = None):
+    if value is None or isinstance(value, bool) or int(value) != value or value < 0 or (not max_value is None and value > max_value):
+      raise ValueError('not representable in the binary format: ' + str(value))
+
+    return int(value)
+
+  # Append an unsigned integer as a variable length quantity (7 bits per byte, low bits first)
+  def sequencer_put_varint(self, buf, value):
+    value = self.sequencer_binary_value(value)
+    while value >= 0x80:
+      buf.append((value & 0x7f) | 0x80)
+      value = value >> 7
+
+    buf.append(value)
+
+  # Get an unsigned variable length quantity
+  #   Returns (value, next position)
+  def sequencer_get_varint(self, data, pos):
+    value = 0
+    shift = 0
+    while True:
+      byte = data[pos]
+      pos = pos + 1
+      value = value | ((byte & 0x7f) << shift)
+      if byte < 0x80:
+        return (value, pos)
+
+      shift = shift + 7
+
+  # Encode sequencer data to the binary format
+  #   seq_data: {'channel': .., 'control': .., 'score': .., 'sign': .., 'tempo': ..}
+  #   Binary format (varint: see sequencer_put_varint(), u8/u16: little endian):
+  #     Header : 'SEQB', version u8
+  #     Control: tempo varint, mini_note u8 (0xff: None), time_per_bar u8, disp_time varint*2,
+  #              disp_key u8*4, time_cursor varint, key_cursor u8*2, program u8*16, gmbank u8*16
+  #     Channel: (gmbank u8, program u8, volume u8) * 16
+  #     Sign   : count varint, (delta time varint, flags u8 (1:loop, 2:skip, 4:repeat)) * count
+  #     Tempo  : count varint, (delta time varint, flags u8 (1:tempo, 2:time_per_bar), [tempo varint], [time_per_bar u8]) * count
+  #     Score  : count varint, (delta time varint, notes varint, (channel u8, note u8, velocity u8, duration u16) * notes) * count
+  def sequencer_encode_binary(self, seq_data):
+    buf = self.sequencer_encode_binary_header(seq_data)
+
+    # Score
+    scores = seq_data.get('score') or []
+    self.sequencer_put_varint(buf, len(scores))
+    tm = 0
+    for score in scores:
+      self.sequencer_put_slot(buf, score['time'] - tm, score['notes'])
+      tm = score['time']
+
+    return buf
+
+  # Encode sequencer data without the score section to the binary format (see sequencer_encode_binary())
+  def sequencer_encode_binary_header(self, seq_data):
+    control = {'tempo': 120, 'mini_note': 4, 'time_per_bar': 4, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15], 'gmbank':[0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]}
+    if not seq_data.get('control') is None:
+      for ky in seq_data['control'].keys():
+        control[ky] = seq_data['control'][ky]
+
+    buf = bytearray(self.SEQ_BINARY_MAGIC)
+    buf.append(self.SEQ_BINARY_VERSION)
+
+    # Control, the tempo is normalized as the loader and the player do (see sequencer_set_data() and sequencer_tick_us())
+    self.sequencer_put_varint(buf, self.sequencer_tempo_played(None if control['tempo'] is None else int(control['tempo'])))
+    buf.append(0xff if control['mini_note'] is None else control['mini_note'])
+    buf.append(self.sequencer_binary_value(control['time_per_bar'], 0xff))
+    self.sequencer_put_varint(buf, control['disp_time'][0])
+    self.sequencer_put_varint(buf, control['disp_time'][1])
+    buf.extend(bytes(control['disp_key'][0] + control['disp_key'][1]))
+    self.sequencer_put_varint(buf, control['time_cursor'])
+    buf.extend(bytes(control['key_cursor']))
+    buf.extend(bytes(control['program']))
+    buf.extend(bytes(control['gmbank']))
+
+    # Channel
+    channels = seq_data.get('channel')
+    for ch in range(16):
+      chn = {'program': ch} if channels is None else channels[ch]
+      buf.append(chn.get('gmbank', 0))
+      buf.append(chn.get('program', 0))
+      buf.append(self.sequencer_binary_value(chn.get('volume', 100), 0xff))
+
+    # Sign
+    signs = seq_data.get('sign') or []
+    self.sequencer_put_varint(buf, len(signs))
+    tm = 0
+    for sign in signs:
+      self.sequencer_put_varint(buf, sign['time'] - tm)
+      tm = sign['time']
+      buf.append((1 if sign['loop'] else 0) | (2 if sign['skip'] else 0) | (4 if sign['repeat'] else 0))
+
+    # Tempo
+    tempos = seq_data.get('tempo') or []
+    self.sequencer_put_varint(buf, len(tempos))
+    tm = 0
+    for tempo in tempos:
+      self.sequencer_put_varint(buf, tempo['time'] - tm)
+      tm = tempo['time']
+      buf.append((1 if 'tempo' in tempo else 0) | (2 if 'time_per_bar' in tempo else 0))
+      if 'tempo' in tempo:
+        self.sequencer_put_varint(buf, self.sequencer_tempo_played(tempo['tempo']))
+      if 'time_per_bar' in tempo:
+        buf.append(self.sequencer_binary_value(tempo['time_per_bar'], 0xff))
+
+    return buf
+
+  # Append a score slot in the binary format (see sequencer_encode_binary())
+  #   delta: Time from the previous slot
+  #   notes: Notes of the slot
+  def sequencer_put_slot(self, buf, delta, notes):
+    self.sequencer_put_varint(buf, delta)
+    self.sequencer_put_varint(buf, len(notes))
+    for note_data in notes:
+      duration = self.sequencer_binary_value(note_data['duration'], 0xffff)
+      buf.append(note_data['channel'])
+      buf.append(note_data['note'])
+      buf.append(note_data['velocity'])
+      buf.append(duration & 0xff)
+      buf.append(duration >> 8)
+
+  # Decode the binary format to sequencer data
+  #   data       : bytes, memoryview or file_buffer_class object of a binary file
+  #   header_only: Decode without the score slots, 'score_pos' is the file position of the score section
+  #   Returns {'channel': .., 'control': .., 'score': .., 'sign': .., 'tempo': ..}, None if not in the format
+  def sequencer_decode_binary(self, data, header_only = False):
+    if len(data) < 5 or bytes(data[0:4]) != self.SEQ_BINARY_MAGIC or data[4] != self.SEQ_BINARY_VERSION:
+      print('sequencer_decode_binary: Unknown format')
+      return None
+
+    try:
+      # Control
+      control = {}
+      control['tempo'], pos = self.sequencer_get_varint(data, 5)
+      control['mini_note'] = None if data[pos] == 0xff else data[pos]
+      control['time_per_bar'] = data[pos + 1]
+      disp_time0, pos = self.sequencer_get_varint(data, pos + 2)
+      disp_time1, pos = self.sequencer_get_varint(data, pos)
+      control['disp_time'] = [disp_time0, disp_time1]
+      control['disp_key'] = [[data[pos], data[pos + 1]], [data[pos + 2], data[pos + 3]]]
+      control['time_cursor'], pos = self.sequencer_get_varint(data, pos + 4)
+      control['key_cursor'] = [data[pos], data[pos + 1]]
+      control['program'] = list(data[pos + 2:pos + 18])
+      control['gmbank'] = list(data[pos + 18:pos + 34])
+      pos = pos + 34
+
+      # Channel
+      channels = []
+      for ch in range(16):
+        channels.append({'gmbank': data[pos], 'program': data[pos + 1], 'volume': data[pos + 2]})
+        pos = pos + 3
+
+      # Sign
+      signs = []
+      count, pos = self.sequencer_get_varint(data, pos)
+      tm = 0
+      for i in range(count):
+        delta, pos = self.sequencer_get_varint(data, pos)
+        tm = tm + delta
+        flags = data[pos]
+        pos = pos + 1
+        signs.append({'time': tm, 'loop': flags & 1 != 0, 'skip': flags & 2 != 0, 'repeat': flags & 4 != 0})
+
+      # Tempo
+      tempos = []
+      count, pos = self.sequencer_get_varint(data, pos)
+      tm = 0
+      for i in range(count):
+        delta, pos = self.sequencer_get_varint(data, pos)
+        tm = tm + delta
+        flags = data[pos]
+        pos = pos + 1
+        tempo = {'time': tm}
+        if flags & 1:
+          tempo['tempo'], pos = self.sequencer_get_varint(data, pos)
+        if flags & 2:
+          tempo['time_per_bar'] = data[pos]
+          pos = pos + 1
+        tempos.append(tempo)
+
+      if header_only:
+        return {'channel': channels, 'control': control, 'score': [], 'sign': signs, 'tempo': tempos, 'score_pos': pos}
+
+      # Score
+      scores = []
+      count, pos = self.sequencer_get_varint(data, pos)
+      tm = 0
+      for i in range(count):
+        delta, pos = self.sequencer_get_varint(data, pos)
+        tm = tm + delta
+        notes, pos = self.sequencer_get_varint(data, pos)
+        score = {'time': tm, 'max_duration': 0, 'notes': []}
+        max_dur = 0
+        for n in range(notes):
+          duration = data[pos + 3] | (data[pos + 4] << 8)
+          score['notes'].append({'channel': data[pos], 'note': data[pos + 1], 'velocity': data[pos + 2], 'duration': duration})
+          if duration > max_dur:
+            max_dur = duration
+          pos = pos + 5
+
+        score['max_duration'] = max_dur
+        scores.append(score)
+
+      return {'channel': channels, 'control': control, 'score': scores, 'sign': signs, 'tempo': tempos}
+
+    except Exception as e:
+      print('sequencer_decode_binary Exception:', e)
+
+    return None
+
   # Load sequencer file
   def sequencer_load_file(self, path, num):
-    # Read MIDI IN settings JSON file
-    seq_data = self.sdcard_obj.json_read(path, 'SEQSC{:0=3d}.json'.format(num))
+    # Read sequencer file in the current format, or the other format
+    self.sequencer_stream_close()
+    seq_data = self.sequencer_read_file(path, num)
     if not seq_data is None:
-      if 'score' in seq_data.keys():
-        if seq_data['score'] is None:
-          self.seq_score = []
-        else:
-          self.seq_score = seq_data['score']
-      else:
-        seq_data = []
-      
-      if 'sign' in seq_data.keys():
-        if seq_data['sign'] is None:
-          self.seq_score_sign = []
-        else:
-          self.seq_score_sign = seq_data['sign']
+      self.sequencer_set_data(seq_data)
+      self.sequencer_unchanged(path, num)
+
+  # Set sequencer data read from a file
+  #   seq_data     : {'channel': .., 'control': .., 'score': .., 'sign': .., 'tempo': ..}
+  #   send_settings: False not to send the channel settings to the synthesizer
+  def sequencer_set_data(self, seq_data, send_settings = True):
+    self.seq_streamed = None
+    self.sequencer_changed()
+    if 'score' in seq_data.keys():
+      if seq_data['score'] is None:
+        self.seq_score = []
       else:
+        self.seq_score = seq_data['score']
+    else:
+      self.seq_score = []
+    
+    if 'sign' in seq_data.keys():
+      if seq_data['sign'] is None:
         self.seq_score_sign = []
+      else:
+        self.seq_score_sign = seq_data['sign']
+    else:
+      self.seq_score_sign = []
 
-      if 'control' in seq_data.keys():
-        if seq_data['control'] is None:
-          self.seq_control = {'tempo': 120, 'mini_note': 4, 'time_per_bar': 4, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15], 'gmbank':[0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]}
-        else:
-          for ky in seq_data['control'].keys():
-            if ky == 'tempo':
-              self.seq_control[ky] = int(seq_data['control'][ky])
-            else:
-              self.seq_control[ky] = seq_data['control'][ky]
+    if 'tempo' in seq_data.keys():
+      if seq_data['tempo'] is None:
+        self.seq_score_tempo = []
       else:
-        self.seq_control = {'tempo': 120, 'mini_note': 4, 'time_per_bar': 4, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15], 'gmbank':[0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]}
+        self.seq_score_tempo = seq_data['tempo']
+    else:
+      self.seq_score_tempo = []
 
-      if 'channel' in seq_data.keys():
-        if not seq_data['channel'] is None:
-          self.seq_channel = seq_data['channel']
-          for ch in range(16):
-            if not 'gmbank' in self.seq_channel[ch]:
-              self.seq_channel[ch]['gmbank'] = 0
-            if not 'program' in self.seq_channel[ch]:
-              self.seq_channel[ch]['program'] = 0
-            if not 'volume' in self.seq_channel[ch]:
-              self.seq_channel[ch]['volume'] = 100
-
-      self.seq_cursor_note = self.sequencer_find_note(self.seq_edit_track, self.seq_control['time_cursor'], self.seq_control['key_cursor'][self.seq_edit_track])
+    self.seq_tempo_table = None
+    if 'control' in seq_data.keys():
+      if seq_data['control'] is None:
+        self.seq_control = {'tempo': 120, 'mini_note': 4, 'time_per_bar': 4, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15], 'gmbank':[0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]}
+      else:
+        for ky in seq_data['control'].keys():
+          if ky == 'tempo':
+            self.seq_control[ky] = int(seq_data['control'][ky])
+          else:
+            self.seq_control[ky] = seq_data['control'][ky]
+    else:
+      self.seq_control = {'tempo': 120, 'mini_note': 4, 'time_per_bar': 4, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15], 'gmbank':[0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]}
+
+    if 'channel' in seq_data.keys():
+      if not seq_data['channel'] is None:
+        self.seq_channel = seq_data['channel']
+        for ch in range(16):
+          if not 'gmbank' in self.seq_channel[ch]:
+            self.seq_channel[ch]['gmbank'] = 0
+          if not 'program' in self.seq_channel[ch]:
+            self.seq_channel[ch]['program'] = 0
+          if not 'volume' in self.seq_channel[ch]:
+            self.seq_channel[ch]['volume'] = 100
+
+    self.seq_cursor_note = self.sequencer_find_note(self.seq_edit_track, self.seq_control['time_cursor'], self.seq_control['key_cursor'][self.seq_edit_track])
+    if send_settings:
       self.send_all_sequencer_settings()
 
 
+  # Open a sequencer file to stream the score while playing
+  #   The data except the score is loaded, the score slots are read by play_sequencer()
+  #   with a bounded lookahead (see SEQ_STREAM_LOOKAHEAD).
+  #   The score is loaded from the file when it is edited, saved or exported (see sequencer_load_streamed()).
+  #   send_settings: False not to send the channel settings to the synthesizer
+  #   Returns True if the file is opened
+  def sequencer_stream_file(self, path, num, send_settings = True):
+    self.sequencer_stream_close()
+    opened = self.sequencer_open_stream(path, num)
+    if opened is None:
+      return False
+
+    seq_data, stream = opened
+    self.sequencer_set_data(seq_data, send_settings)
+    self.seq_streamed = (path, num)
+    stream.set_checkpoints([sc_sign['time'] for sc_sign in self.seq_score_sign])
+    self.seq_stream = stream
+    return True
+
+  # Open a sequencer file as a score stream in the current format, or the other format
+  #   Returns (seq_data without the score, score_stream_class) or None, needs to close the stream
+  def sequencer_open_stream(self, path, num):
+    for fmt in [self.seq_file_format, 1 - self.seq_file_format]:
+      fname = self.sequencer_file_name(num, fmt)
+      size = self.sdcard_obj.file_size(path, fname)
+      if size is None:
+        continue
+
+      f = self.sdcard_obj.binary_open(path, fname)
+      if f is None:
+        continue
+
+      data = file_buffer_class(f, size)
+      try:
+        if fmt == self.SEQ_FORMAT_BINARY:
+          seq_data = self.sequencer_decode_binary(data, True)
+          stream = None if seq_data is None else score_stream_binary_class(data, seq_data['score_pos'])
+        else:
+          stream = score_stream_json_class(data)
+          seq_data = stream.read_header()
+
+      except Exception as e:
+        print('sequencer_stream_file Exception:', e, path, fname)
+        stream = None
+
+      if stream is None:
+        data.close()
+        continue
+
+      return (seq_data, stream)
+
+    return None
+
+  # Get metadata of a sequencer file, the score is read in a stream
+  #   Returns {'length': <End time of the last note>, 'tempo': <Tempo>, 'notes': <Number of notes>, 'channels': [<MIDI channel>, ..]} or None
+  def sequencer_file_info(self, path, num):
+    opened = self.sequencer_open_stream(path, num)
+    if opened is None:
+      return None
+
+    seq_data, stream = opened
+    info = {'length': 0, 'tempo': seq_data['control'].get('tempo', 120) if not seq_data.get('control') is None else 120, 'notes': 0, 'channels': []}
+    try:
+      stream.seek(0)
+      score = stream.next()
+      while not score is None:
+        for note_data in score['notes']:
+          info['notes'] = info['notes'] + 1
+          info['length'] = max(info['length'], score['time'] + note_data['duration'])
+          if not note_data['channel'] in info['channels']:
+            info['channels'].append(note_data['channel'])
+
+        score = stream.next()
+
+    except Exception as e:
+      print('sequencer_file_info Exception:', e, path, num)
+
+    finally:
+      stream.close()
+
+    info['channels'].sort()
+    return info
+
+  # Get the index of the sequencer files in the sequencer file path
+  def sequencer_file_index(self):
+    if self.seq_file_index is None or self.seq_file_index.path != self.SEQUENCER_FILE_PATH:
+      path = self.SEQUENCER_FILE_PATH
+      self.seq_file_index = file_index_class(path, 'SEQSC', self.seq_file_ext, lambda num: self.sequencer_file_info(path, num))
+
+    return self.seq_file_index
+
+  # Update the sequencer file index for a file written
+  def sequencer_file_updated(self, path, num):
+    if not self.seq_file_index is None and self.seq_file_index.path == path:
+      self.seq_file_index.update(num)
+
+  # Close the streaming sequencer file
+  def sequencer_stream_close(self):
+    if not self.seq_stream is None:
+      self.seq_stream.close()
+      self.seq_stream = None
+
+  # Get the score source to play, the streaming file or the score in memory
+  def sequencer_score_source(self):
+    if self.seq_stream is None:
+      self.sequencer_load_streamed()
+      return score_list_source_class(self.seq_score if not self.seq_score is None else [])
+
+    return self.seq_stream
+
   # Get key name of key number
   #   key_num: MIDI note number
   def seqencer_key_name(self, key_num):
@@ -1125,6 +3172,7 @@ class sequencer_class():
 
   # Update maximum duration
   def sequencer_duration_update(self, score):
+    self.sequencer_changed()
     max_dur = 0
     for note_data in score['notes']:
       max_dur = max(max_dur, note_data['duration'])
@@ -1133,6 +3181,7 @@ class sequencer_class():
 
   # Delete a note
   def sequencer_delete_note(self, score, note_data):
+    self.sequencer_changed()
     score['notes'].remove(note_data)
     if len(score['notes']) == 0:
       self.seq_score.remove(score)
@@ -1141,6 +3190,7 @@ class sequencer_class():
 
   # Add new note
   def sequencer_new_note(self, channel, note_on_time, note_key, velocity = -1, duration = 1):
+    self.sequencer_changed()
     sc = 0
     scores = len(self.seq_score)
     while sc < scores:
@@ -1201,6 +3251,7 @@ class sequencer_class():
 
   # Change a note velocity
   def sequencer_velocity(self, delta):
+    self.sequencer_changed()
     # No note is selected
     if self.seq_cursor_note is None:
       return False
@@ -1217,6 +3268,7 @@ class sequencer_class():
 
   # Insert time at the time cursor on a MIDI channel
   def sequencer_insert_time(self, channel, time_cursor, ins_times):
+    self.sequencer_changed()
     affected = False
     for sc_index in list(range(len(self.seq_score)-1,-1,-1)):
       score = self.seq_score[sc_index]
@@ -1253,6 +3305,7 @@ class sequencer_class():
 
   # Delete time at the time cursor on the all MIDI channels
   def sequencer_delete_time(self, channel, time_cursor, del_times):
+    self.sequencer_changed()
     # Can not delete
     if time_cursor <= 0:
       return False
@@ -1306,6 +3359,8 @@ class sequencer_class():
 
   # Up or Down time resolution
   def sequencer_resolution(self, res_up):
+    self.sequencer_changed()
+    self.seq_tempo_table = None
     # Reolution up
     if res_up:
       for score in self.seq_score:
@@ -1314,6 +3369,9 @@ class sequencer_class():
       for score in self.seq_score_sign:
         score['time'] = score['time'] * 2
 
+      for score in self.seq_score_tempo:
+        score['time'] = score['time'] * 2
+
     # Resolution down
     else:
       for score in self.seq_score:
@@ -1324,12 +3382,19 @@ class sequencer_class():
         if score['time'] % 2 != 0:
           return
 
+      for score in self.seq_score_tempo:
+        if score['time'] % 2 != 0:
+          return
+
       for score in self.seq_score:
         score['time'] = int(score['time'] / 2)
 
       for score in self.seq_score_sign:
         score['time'] = int(score['time'] / 2)
 
+      for score in self.seq_score_tempo:
+        score['time'] = int(score['time'] / 2)
+
   # Get signs on score at tc(time cursor)
   def sequencer_get_repeat_control(self, tc):
     if not self.seq_score_sign is None:
@@ -1341,6 +3406,7 @@ class sequencer_class():
 
   # Add or change score signs at a time
   def sequencer_edit_signs(self, sign_data):
+    self.sequencer_changed()
 #    print('REPEAT SIGNS:', sign_data)
     if not sign_data is None:
       tm = sign_data['time']
@@ -1383,6 +3449,51 @@ class sequencer_class():
         if flg == False:
           self.seq_score_sign.remove(sign_data)
 
+  # Make the tempo table to convert a time on the score to micro seconds
+  #   Returns [(time, us, tick_us), ..] for the start and each tempo change,
+  #     time   : Time on the score
+  #     us     : Micro seconds from the time 0 to the time
+  #     tick_us: Micro seconds per a time from the time
+  def sequencer_tempo_table(self):
+    tick_us = self.sequencer_tick_us()
+    table = [(0, 0, tick_us)]
+    if not self.seq_score_tempo is None:
+      for sc_tempo in sorted(self.seq_score_tempo, key = lambda sc_tempo: sc_tempo['time']):
+        if not 'tempo' in sc_tempo.keys() or sc_tempo['tempo'] is None:
+          continue
+
+        tm = sc_tempo['time']
+        prev_time, prev_us, prev_tick_us = table[-1]
+        if tm < prev_time:
+          continue
+
+        if tm == prev_time:
+          table.pop()
+
+        table.append((tm, prev_us + (tm - prev_time) * prev_tick_us, self.sequencer_tick_us(sc_tempo['tempo'])))
+
+    self.seq_tempo_table = table
+    return table
+
+  # Convert a time on the score to micro seconds from the time 0
+  def sequencer_time_to_us(self, tm):
+    table = self.seq_tempo_table
+    if table is None:
+      table = self.sequencer_tempo_table()
+
+    # The last tempo change at or before the time
+    lo = 0
+    hi = len(table)
+    while hi - lo > 1:
+      mid = (lo + hi) // 2
+      if table[mid][0] <= tm:
+        lo = mid
+      else:
+        hi = mid
+
+    base_time, base_us, tick_us = table[lo]
+    return base_us + (tm - base_time) * tick_us
+
   # Backup the cursor position
   def pre_play_sequencer(self):
     self.time_cursor_bk = self.seq_control['time_cursor']
@@ -1407,44 +3518,187 @@ class sequencer_class():
     # Set master volume (for pause/stop)
     self.midi_obj.set_master_volume(self.master_volume_bk)
 
-  # Play sequencer score
-  def play_sequencer(self, func_pause_or_stop = None, func_pause_to_stop = None, func_pre_move_cursor = None, func_post_move_cursor = None):
-    print('SEQUENCER STARTS.')
-    note_off_events = []
-
-    # Insert a note off event in the notes off list
-    def insert_note_off(time, channel, note_num):
-      len_evt = len(note_off_events)
-      if len_evt == 0:
-        note_off_events.append({'time': time, 'notes': [{'channel': channel, 'note': note_num}]})
-        return
-
-      for evt_index in range(len_evt):
-        evt = note_off_events[evt_index]
-        if   evt['time'] == time:
-          evt['notes'].append({'channel': channel, 'note': note_num})
-          return
+  # Tempo played, out of range tempos are clamped to 6..999 (None: 6)
+  def sequencer_tempo_played(self, tempo):
+    if tempo is None or tempo < 6:
+      return 6
+    elif tempo > 999:
+      return 999
+
+    return tempo
+
+  # Get microseconds per a time on the score
+  #   mini_note: 4,8,16,32,64--2,3,4,5,6 --> 1,2,4,8,16 times per a quoter note
+  #   tempo    : Tempo to calculate (None: the sequencer tempo)
+  def sequencer_tick_us(self, tempo = None):
+    if tempo is None:
+      tempo = self.seq_control['tempo']
+
+    tempo = self.sequencer_tempo_played(tempo)
+    mini_note = self.seq_control['mini_note']
+    if mini_note is None:
+      mini_note = 4
+
+    return int((60.0 / tempo / (2**mini_note/4)) * 1000000)
+
+  # Compile the score to a flat time-sorted event list to play
+  #   Loop/Skip/Repeat signs are unrolled, note-off events are placed at their own times,
+  #   and MIDI messages are encoded in advance.
+  #   Returns [(play_us, time_cursor, midi_bytes), ..]
+  #     play_us    : Micro seconds from the play start (the repeats are unrolled, the tempo map is applied)
+  #     time_cursor: Time on the score to show at the event
+  #     midi_bytes : MIDI messages to send at the event
+  def sequencer_compile(self):
+    return list(self.sequencer_compile_iter(self.sequencer_score_source()))
+
+  # Compile the score incrementally, a generator of the events of sequencer_compile()
+  #   The score slots are read from the source when the events are needed.
+  #   source : Score source (score_list_source_class or score_stream_class)
+  #   time_us: Function to convert a time on the score to the play time (None: micro seconds with the tempo map)
+  #   unroll : False: Loop/Skip/Repeat signs are ignored
+  def sequencer_compile_iter(self, source, time_us = None, unroll = True):
+    seq_signs = [] if self.seq_score_sign is None or not unroll else sorted(self.seq_score_sign, key = lambda sc_sign: sc_sign['time'])
+    signs_len = len(seq_signs)
+
+    # Find the first index in a time-sorted list having time equal or larger than tm
+    def find_index(data_list, data_len, tm):
+      lo = 0
+      hi = data_len
+      while lo < hi:
+        mid = (lo + hi) // 2
+        if data_list[mid]['time'] < tm:
+          lo = mid + 1
+        else:
+          hi = mid
 
-        elif evt['time'] > time:
-          note_off_events.insert(evt_index,{'time': time, 'notes': [{'channel': channel, 'note': note_num}]})
-          return
+      return lo
+
+    ##### CODE: sequencer_compile
+
+    # Events not sent yet (the last event can be merged with the following messages at the same time)
+    timeline = []
+    note_offs = note_off_scheduler_class()
+
+    # Add a note-on/off message on the timeline
+    def add_event(play_time, time_cursor, channel, note_num, velocity):
+      if len(timeline) > 0 and timeline[-1][0] == play_time:
+        timeline[-1][2].extend((0x90 + channel, note_num, velocity))
+      else:
+        timeline.append((play_time, time_cursor, bytearray((0x90 + channel, note_num, velocity))))
+
+    # Add note-off messages until the time on the timeline
+    def notes_off_until(tm):
+      while len(note_offs) > 0 and note_offs.next_time() <= tm:
+        off_time, notes = note_offs.pop()
+        for time_cursor, channel, note_num in notes:
+          add_event(off_time, time_cursor, channel, note_num, 0)
+
+    # Play parameter
+    time_cursor = self.seq_play_time[0]
+    end_time = self.seq_play_time[1] if self.seq_play_time[0] < self.seq_play_time[1] else -1
+    play_time = 0
+    if time_us is None:
+      self.sequencer_tempo_table()
+      time_us = self.sequencer_time_to_us
+
+    # Repeat controls
+    loop_play_time = -1
+    repeating_bars = False
+    repeat_time = -1
+
+    source.seek(time_cursor)
+    sign_index = find_index(seq_signs, signs_len, time_cursor)
+    score = source.next()
+    while not score is None:
+      next_notes_on = score['time']
+      if end_time != -1 and next_notes_on >= end_time:
+        break
+
+      # Loop/Skip/Repeat signs until the next notes on
+      jump_to = -1
+      while sign_index < signs_len and seq_signs[sign_index]['time'] <= next_notes_on:
+        repeat_ctrl = seq_signs[sign_index]
+        sign_index = sign_index + 1
+
+        # Skip bar point: during repeat play, skip to the repeat bar
+        if repeat_ctrl['skip'] and repeating_bars:
+          jump_to = repeat_time
+          repeating_bars = False
+          repeat_time = -1
+          loop_play_time = -1
+
+        # Repeat bar point
+        elif repeat_ctrl['repeat']:
+          # Go back to the loop bar
+          if repeating_bars == False and loop_play_time >= 0:
+            jump_to = loop_play_time
+            repeat_time = repeat_ctrl['time']
+            repeating_bars = True
+            loop_play_time = -1
+
+          # End of the repeat play
+          elif repeating_bars:
+            repeating_bars = False
+            repeat_time = -1
+            loop_play_time = -1
+
+        # Loop bar point
+        if jump_to == -1 and repeat_ctrl['loop']:
+          loop_play_time = repeat_ctrl['time']
+
+        if jump_to != -1:
+          play_time = play_time + time_us(repeat_ctrl['time']) - time_us(time_cursor)
+          time_cursor = jump_to
+          break
+
+      # Jump to the loop or repeat bar
+      if jump_to != -1:
+        source.seek(time_cursor)
+        sign_index = find_index(seq_signs, signs_len, time_cursor)
+        score = source.next()
+        continue
+
+      # Notes off before the notes on
+      play_time = play_time + time_us(next_notes_on) - time_us(time_cursor)
+      time_cursor = next_notes_on
+      note_on_us = time_us(time_cursor)
+      notes_off_until(play_time)
+
+      # Notes on
+      for note_data in score['notes']:
+        channel = note_data['channel']
+        note_num = note_data['note']
+        duration = note_data['duration']
+        add_event(play_time, time_cursor, channel, note_num, int(note_data['velocity'] * self.seq_channel[channel]['volume'] / 100))
+        note_offs.insert(play_time + time_us(time_cursor + duration) - note_on_us, (time_cursor + duration, channel, note_num))
 
-      note_off_events.append({'time': time, 'notes': [{'channel': channel, 'note': note_num}]})
+      # Events before this time slot are fixed, apply running status to the messages at each time
+      while len(timeline) > 1:
+        evt_time, evt_cursor, midi_bytes = timeline.pop(0)
+        yield (evt_time, evt_cursor, self.midi_obj.pack_messages(midi_bytes))
 
+      # Next time slot
+      score = source.next()
+
+    # Notes off (final process)
+    while len(note_offs) > 0:
+      notes_off_until(note_offs.next_time())
 
-    # Notes off the first event in the notes off event list
-    def sequencer_notes_off():
-      for note_data in note_off_events[0]['notes']:
-        self.midi_obj.notes_off(note_data['channel'], [note_data['note']])
+    for evt_time, evt_cursor, midi_bytes in timeline:
+      yield (evt_time, evt_cursor, self.midi_obj.pack_messages(midi_bytes))
 
-      note_off_events.pop(0)
+  # Get lateness counters of the last play
+  def get_play_stats(self):
+    return self.seq_play_stats
 
+  # Play sequencer score
+  def play_sequencer(self, func_pause_or_stop = None, func_pause_to_stop = None, func_pre_move_cursor = None, func_post_move_cursor = None):
+    print('SEQUENCER STARTS.')
 
-    # Move play cursor
+    # Move play cursor to the time on the score
     def move_play_cursor(tc):
       if not func_pre_move_cursor is None:
         func_pre_move_cursor()
-      tc = tc + 1
       self.seq_control['time_cursor'] = tc
 
       # Slide score
@@ -1452,8 +3706,9 @@ class sequencer_class():
         width = self.seq_control['disp_time'][1] - self.seq_control['disp_time'][0]
         self.seq_control['disp_time'][0] = self.seq_control['time_cursor']
         self.seq_control['disp_time'][1] = self.seq_control['disp_time'][0] + width
-        self.sequencer_draw_track(0)
-        self.sequencer_draw_track(1)
+        if not self.seq_dry_run:
+          self.sequencer_draw_track(0)
+          self.sequencer_draw_track(1)
 
       if not func_post_move_cursor is None:
         func_post_move_cursor()
@@ -1461,196 +3716,238 @@ class sequencer_class():
 
     ##### CODE: play_sequencer
 
-    # Play parameter
-    next_note_on = 0
-    next_note_off = 0
-    time_cursor = self.seq_play_time[0]
-    end_time = self.seq_play_time[1] if self.seq_play_time[0] < self.seq_play_time[1] else -1
+    # Play the score compiled incrementally
+    self.seq_control['time_cursor'] = self.seq_play_time[0]
+    self.play_events(self.sequencer_compile_iter(self.sequencer_score_source()), func_pause_or_stop, func_pause_to_stop, move_play_cursor)
+
+  # Play timed MIDI events, the timing engine shared by the players
+  #   events            : Iterator of (play_us, cursor, midi_bytes) sorted by play_us (see sequencer_compile())
+  #   func_pause_or_stop: Stop button scan, returns True to pause or stop
+  #   func_pause_to_stop: Called in pause, returns -1: keep pausing, 0: resume, 1: stop
+  #   func_event        : Called with the cursor after each event is sent
+  def play_events(self, events, func_pause_or_stop = None, func_pause_to_stop = None, func_event = None):
+    # Compile the next event into the lookahead window, returns False at the end of the events
+    def compile_next():
+      try:
+        window.append(next(events))
+        return True
+
+      except StopIteration:
+        return False
 
-    # Repeat controls
-    loop_play_time = 0
-    loop_play_slot = 0
-    repeating_bars = False
-    repeat_time = -1
-    repeat_slot = -1
-
-    # Sequencer play loop
-    self.seq_control['time_cursor'] = time_cursor
-    score_len = len(self.seq_score)
-    play_slot = 0
-    while play_slot < score_len:
-#      print('SEQ POINT:', time_cursor, play_slot)
-      score = self.seq_score[play_slot]
-#      print('SCORE:', play_slot, score)
-
-      # Scan stop button (PLAY-->PAUSE-->STOP)
-      if not (func_pause_or_stop is None or func_pause_to_stop is None):
-        if func_pause_or_stop():
-          self.midi_obj.set_master_volume(0)
-          count = func_pause_to_stop()
-          if count >= 0:    # Stop playing (push the button long)
-            self.midi_obj.set_master_volume(self.master_volume_bk)
-            if count > 0:
-              break
-
-      # Play4,8,16,32,64--1,2,3,4,5--1,2,4,8,16
-      skip_continue = False
-      repeat_continue = False
-      tempo = int((60.0 / self.seq_control['tempo'] / (2**self.seq_control['mini_note']/4)) * 1000000)
-      next_notes_on = score['time']
-      while next_notes_on > time_cursor:
-  #      print('SEQUENCER AT0:', time_cursor)
-        time0 = time.ticks_us()
-        if len(note_off_events) > 0:
-          if note_off_events[0]['time'] == time_cursor:
-            sequencer_notes_off()
-
-        # Get MIDI-IN and send data to Unit-MIDI
-        self.midi_obj.midi_in_out()
-        
-        time1 = time.ticks_us()
-        timedelta = time.ticks_diff(time1, time0)
-        time.sleep_us(tempo - timedelta)
-        time_cursor = move_play_cursor(time_cursor)
-
-        # Loop/Skip/Repeat
-        repeat_ctrl = self.sequencer_get_repeat_control(time_cursor)
-  #      print('REPEAT CTRL0:', time_cursor, repeat_ctrl)
-        if not repeat_ctrl is None:
-          # Skip bar point
-          if repeat_ctrl['skip']:
-            # During repeat play, skip to next play slot
-            if repeating_bars and repeat_time != -1 and repeat_slot != -1:
-              time_cursor = repeat_time
-              play_slot = repeat_slot
-              repeat_time = -1
-              repeat_slot = -1
-              repeating_bars = False
-              loop_play_time = -1
-              loop_play_slot = -1
-              skip_continue = True
-              break
-
-          # Repeat bar point
-          if repeat_ctrl['repeat'] and repeating_bars == False and loop_play_time >= 0:
-            repeat_time = repeat_ctrl['time']
-            repeat_slot = play_slot
-            time_cursor = loop_play_time
-            play_slot = loop_play_slot
-            loop_play_time = -1
-            loop_play_slot = -1
-            repeating_bars = True
-            repeat_continue = True
-            break
+    ##### CODE: play_events
+
+    # The events are compiled incrementally, the first events are compiled before the play starts
+    #   and the following events are compiled in the spare time to the next event.
+    window = []
+    compiling = True
+    while compiling and len(window) < self.SEQ_STREAM_LOOKAHEAD:
+      compiling = compile_next()
 
-          # Loop bar point
-          if repeat_ctrl['loop']:
-            loop_play_time = repeat_ctrl['time']
-            loop_play_slot = play_slot
+    # Play parameter
+    clock = self.seq_clock
+    master_volume = self.midi_obj.get_master_volume()
+    play_us = 0
+    stopped = False
+
+    # Lateness counters
+    #   'play_us': Micro seconds played, 'events': Events sent, 'late_events': Events later than the catch-up limit,
+    #   'max_late_us'/'total_late_us': Lateness to the deadlines, 'slips': Deadlines shifted
+    self.seq_play_stats = {'play_us': 0, 'events': 0, 'late_events': 0, 'max_late_us': 0, 'total_late_us': 0, 'slips': 0}
+    stats = self.seq_play_stats
+
+    # Messages from the other contexts are queued and sent between the events
+    self.midi_obj.enable_queue()
+    byte_us = self.midi_obj.byte_us()
+
+    # The queue is disabled even if the events or the idle task raise an exception (SD card errors)
+    try:
+      # Sequencer play loop
+      #   Each event has an absolute deadline from the start time,
+      #   so the processing time in the loop does not accumulate as drift.
+      #   The player sleeps straight to the next event, MIDI-IN is forwarded
+      #   every SEQ_MIDI_THRU_US while sleeping.
+      deadline = clock.ticks_us()
+      while True:
+        # Compile the next event now if the window is empty
+        if len(window) == 0:
+          if compiling:
+            compiling = compile_next()
+            continue
 
-        if end_time != -1 and time_cursor >= end_time:
           break
 
-      # Note off
-  #    print('SEQUENCER AT1:', time_cursor)
-      time0 = time.ticks_us()
-      if len(note_off_events) > 0:
-        if note_off_events[0]['time'] == time_cursor:
-          sequencer_notes_off()
-
-      # Skip to next play slot
-      if skip_continue:
-        skip_continue = False
-  #      print('SEQ SKIP TO 0:', time_cursor, play_slot)
-        continue
+        evt_us, evt_cursor, midi_bytes = window.pop(0)
+        deadline = clock.ticks_add(deadline, evt_us - play_us)
+        stats['play_us'] = evt_us
+        play_us = evt_us
 
-      # Repeat
-      if repeat_continue:
-        repeat_continue = False
-  #      print('SEQ REPEAT TO 0:', time_cursor, play_slot, repeat_time, repeat_slot)
-        continue
+        # Wait for the event deadline
+        while True:
+          # Scan stop button (PLAY-->PAUSE-->STOP)
+          if not (func_pause_or_stop is None or func_pause_to_stop is None):
+            if func_pause_or_stop():
+              self.midi_obj.set_master_volume(0)
+              self.midi_obj.drain_queue()
+              count = func_pause_to_stop()
+              if count >= 0:    # Stop playing (push the button long)
+                self.midi_obj.set_master_volume(master_volume)
+                if count > 0:
+                  stopped = True
+                  break
+
+          # Get MIDI-IN and send data to Unit-MIDI
+          self.midi_obj.midi_in_out()
+
+          wait = clock.ticks_diff(deadline, clock.ticks_us())
+          if wait <= 0:
+            break
 
-      # Loop/Skip/Repeat
-      repeat_ctrl = self.sequencer_get_repeat_control(time_cursor)
-  #    print('REPEAT CTRL1:', time_cursor, repeat_ctrl)
-      if not repeat_ctrl is None:
-        # Loop bar point
-        if repeat_ctrl['loop']:
-          loop_play_time = repeat_ctrl['time']
-          loop_play_slot = play_slot
-
-        # Skip bar point
-        if repeat_ctrl['skip']:
-          # During repeat play
-          if repeating_bars and repeat_time != -1 and repeat_slot != -1:
-            time_cursor = repeat_time
-            play_slot = repeat_slot
-            repeat_time = -1
-            repeat_slot = -1
-            repeating_bars = False
-  #          print('SEQ SKIP TO 1:', time_cursor, play_slot)
+          # Send the queued messages which can be sent before the deadline
+          if self.midi_obj.drain_queue(wait // byte_us) > 0:
             continue
 
-        # Repeat bar point
-        if repeat_ctrl['repeat'] and repeating_bars == False and loop_play_time >= 0:
-          repeat_time = repeat_ctrl['time']
-          repeat_slot = play_slot
-          time_cursor = loop_play_time
-          play_slot = loop_play_slot
-          loop_play_time = -1
-          loop_play_slot = -1
-          repeating_bars = True
-  #        print('SEQ REPEAT TO 1:', time_cursor, play_slot, repeat_time, repeat_slot)
-          continue
+          # Compile the following events in the spare time
+          if compiling and wait >= self.SEQ_STREAM_SPARE_US and len(window) < self.SEQ_STREAM_LOOKAHEAD:
+            compiling = compile_next()
+            continue
 
-      if end_time != -1 and time_cursor >= end_time:
-        break
+          # Run the idle task in the long spare time (not in the dry-run)
+          if not self.seq_idle_task is None and not self.seq_dry_run and wait >= self.SEQ_IDLE_SPARE_US and self.seq_idle_task(wait - self.SEQ_MIDI_THRU_US):
+            continue
 
-      # Notes on
-      for note_data in score['notes']:
-        channel = note_data['channel']
-  #      print('SEQ NOTE ON:', time_cursor, note_data['note'])
-        self.midi_obj.set_note_on(channel, note_data['note'], int(note_data['velocity'] * self.seq_channel[channel]['volume'] / 100))
-        note_off_at = time_cursor + note_data['duration']
-        insert_note_off(note_off_at, channel, note_data['note'])
+          clock.sleep_us(wait if wait < self.SEQ_MIDI_THRU_US else self.SEQ_MIDI_THRU_US)
 
-      self.midi_obj.midi_in_out()
+        if stopped:
+          break
 
-      time1 = time.ticks_us()
-      timedelta = time.ticks_diff(time1, time0)
-      time.sleep_us(tempo - timedelta)
+        # Send MIDI messages at the time
+        self.midi_obj.midi_out(midi_bytes)
+        stats['events'] = stats['events'] + 1
 
-      time_cursor = move_play_cursor(time_cursor)
+        # Lateness
+        late = clock.ticks_diff(clock.ticks_us(), deadline)
+        if late > 0:
+          stats['total_late_us'] = stats['total_late_us'] + late
+          if late > stats['max_late_us']:
+            stats['max_late_us'] = late
 
-      if end_time != -1 and time_cursor >= end_time:
-        break
+          if late > self.SEQ_CATCHUP_LIMIT:
+            stats['late_events'] = stats['late_events'] + 1
+            if self.seq_catchup == self.SEQ_CATCHUP_SLIP:
+              deadline = clock.ticks_add(deadline, late)
+              stats['slips'] = stats['slips'] + 1
 
-      # Next time slot
-      play_slot = play_slot + 1
+        if not func_event is None:
+          func_event(evt_cursor)
 
-    # Notes off (final process)
-    print('SEQUENCER: Notes off process =', len(note_off_events))
-    while len(note_off_events) > 0:
-      score = note_off_events[0]
-      timedelta = 0
-      while score['time'] > time_cursor:
-        time.sleep_us(tempo - timedelta)
-        time0 = time.ticks_us()
-        time_cursor = move_play_cursor(time_cursor)
+      # Notes off (stopped)
+      if stopped:
+        print('SEQUENCER: Notes off process')
+        self.midi_obj.set_all_notes_off()
+
+    finally:
+      self.midi_obj.disable_queue()
+
+    print('SEQUENCER: Output queue', self.midi_obj.get_queue_stats())
+
+    print('SEQUENCER: Finished.', self.seq_play_stats)
+
+  # Chain the events of songs to play them in a row without gaps
+  #   A song is started at the time of the last event of the previous song.
+  #   The next song is opened when all the events of the current song are compiled,
+  #   so it is loaded and compiled in the spare time while the last events of the current song are playing.
+  #   songs: Iterator of the events iterators of the songs (see play_events())
+  def sequencer_chain_events(self, songs):
+    offset = 0
+    for events in songs:
+      last_us = 0
+      for evt_us, evt_cursor, midi_bytes in events:
+        last_us = evt_us
+        yield (offset + evt_us, evt_cursor, midi_bytes)
+
+      offset = offset + last_us
+
+  # Events iterators of the sequencer files in the playlist, see sequencer_chain_events()
+  #   All the settings of the first song are sent at its start, the following songs
+  #   change the programs different from the previous song at their start.
+  #   path: Sequencer files path
+  #   nums: Sequencer file numbers to play
+  def sequencer_playlist_songs(self, path, nums):
+    # Song events with the settings messages at the start
+    def song_events(messages):
+      if not messages is None:
+        yield (0, self.seq_play_time[0], messages)
+
+      for evt in self.sequencer_compile_iter(self.sequencer_score_source()):
+        yield evt
+
+    ##### CODE: sequencer_playlist_songs
+
+    programs = None
+    for num in nums:
+      if not self.sequencer_stream_file(path, num, False):
+        print('SEQUENCER: Can not load the playlist file:', num)
+        continue
+
+      print('SEQUENCER: Playlist file:', num)
+      messages = self.sequencer_settings_messages(programs)
+      programs = [(self.seq_control['gmbank'][ch], self.seq_control['program'][ch]) for ch in range(16)]
+      yield song_events(messages)
 
-        time1 = time.ticks_us()
-        timedelta = time.ticks_diff(time1, time0)
+  # Play the sequencer files in a row without gaps
+  #   path: Sequencer files path
+  #   nums: Sequencer file numbers to play
+  def play_playlist(self, path, nums, func_pause_or_stop = None, func_pause_to_stop = None):
+    print('SEQUENCER PLAYLIST STARTS:', nums)
+    try:
+      self.play_events(self.sequencer_chain_events(self.sequencer_playlist_songs(path, nums)), func_pause_or_stop, func_pause_to_stop)
+
+    finally:
+      self.sequencer_stream_close()
+
+  # Play sequencer score with a virtual clock (dry-run)
+  #   The full play logic runs without real time passing and without the real UART.
+  #   cpu_scale: Ratio of the real processing time added to the virtual clock (0: not added)
+  #   midi_in  : [(us, midi_bytes), ..] MIDI-IN data to receive at the virtual time
+  #   func_play: Function to play with the virtual clock (None: play_sequencer())
+  #   Returns [(us, midi_bytes), ..] MIDI bytes sent with the virtual time from the play start
+  def play_sequencer_dry_run(self, cpu_scale = 0, midi_in = None, func_play = None):
+    clock = virtual_clock_class(cpu_scale)
+    uart = virtual_uart_class(clock)
+    if not midi_in is None:
+      for tm, midi_bytes in midi_in:
+        uart.inject(midi_bytes, tm)
+
+    # Replace the clock and the UART
+    synth = self.midi_obj.synth
+    clock_bk = self.seq_clock
+    midi_uart_bk = self.midi_obj.midi_uart
+    synth_uart_bk = synth._uart
+    time_cursor_bk = self.seq_control['time_cursor']
+    disp_time_bk = list(self.seq_control['disp_time'])
+    self.seq_clock = clock
+    self.midi_obj.midi_uart = uart
+    synth._uart = uart
+    self.seq_dry_run = True
+    self.master_volume_bk = self.midi_obj.get_master_volume()
 
-      time0 = time.ticks_us()
-      sequencer_notes_off()
-      self.midi_obj.midi_in_out()
+    try:
+      if func_play is None:
+        self.play_sequencer()
+      else:
+        func_play()
 
-      time1 = time.ticks_us()
-      timedelta = time.ticks_diff(time1, time0)
-      time.sleep_us(tempo - timedelta)
-      time_cursor = move_play_cursor(time_cursor)
+    finally:
+      self.seq_clock = clock_bk
+      self.midi_obj.midi_uart = midi_uart_bk
+      synth._uart = synth_uart_bk
+      self.seq_dry_run = False
+      self.seq_control['time_cursor'] = time_cursor_bk
+      self.seq_control['disp_time'][0] = disp_time_bk[0]
+      self.seq_control['disp_time'][1] = disp_time_bk[1]
 
-    print('SEQUENCER: Finished.')
+    return uart.sent
 
   # Draw a note on the sequencer
   def sequencer_draw_note(self, trknum, note_num, note_on_time, note_off_time, disp_mode):
@@ -1724,11 +4021,29 @@ class sequencer_class():
 
   # Send all sequencer MIDI settings
   def send_all_sequencer_settings(self):
+    batch = self.midi_obj.begin_batch()
+    for ch in range(16):
+      self.midi_obj.set_instrument(self.seq_control['gmbank'][ch], ch, self.seq_control['program'][ch], batch)
+      self.midi_obj.set_reverb(ch, 0, 0, 0, batch)
+      self.midi_obj.set_chorus(ch, 0, 0, 0, 0, batch)
+      self.midi_obj.set_vibrate(ch, 0, 0, 0, batch)
+    self.midi_obj.end_batch(batch)
+
+  # MIDI messages to change the channel settings to the sequencer data
+  #   programs: [(gmbank, program), ..] of the channels set already, only the program changes are made (None: all the settings)
+  #   Returns packed MIDI messages or None (no change)
+  def sequencer_settings_messages(self, programs = None):
+    batch = self.midi_obj.begin_batch()
     for ch in range(16):
-      self.midi_obj.set_instrument(self.seq_control['gmbank'][ch], ch, self.seq_control['program'][ch])
-      self.midi_obj.set_reverb(ch, 0, 0, 0)
-      self.midi_obj.set_chorus(ch, 0, 0, 0, 0)
-      self.midi_obj.set_vibrate(ch, 0, 0, 0)
+      if programs is None or programs[ch] != (self.seq_control['gmbank'][ch], self.seq_control['program'][ch]):
+        self.midi_obj.set_instrument(self.seq_control['gmbank'][ch], ch, self.seq_control['program'][ch], batch)
+
+      if programs is None:
+        self.midi_obj.set_reverb(ch, 0, 0, 0, batch)
+        self.midi_obj.set_chorus(ch, 0, 0, 0, 0, batch)
+        self.midi_obj.set_vibrate(ch, 0, 0, 0, batch)
+
+    return self.midi_obj.end_batch(batch, False)
 
 
   # Send the current MIDI channel settings to MIDI channel 1
@@ -1742,6 +4057,491 @@ class sequencer_class():
 ################# End of Sequencer Class Definition #################
 
 
+########################
+# SMF Player class
+########################
+class smf_player_class():
+  # Constructor
+  #   Standard MIDI Files (format 0 and 1) listed in LIST.TXT are played with the sequencer's timing engine.
+  #   The tracks are streamed from the file and merged on the fly.
+  #   MIDI files are also imported as sequencer data (see smf_import() and smf_import_file()).
+  def __init__(self, midi_obj, sdcard_obj, sequencer_obj):
+    self.midi_obj = midi_obj
+    self.sdcard_obj = sdcard_obj
+    self.sequencer_obj = sequencer_obj
+    self.MIDI_FILE_PATH = '/SD/SYNTH/MIDIFILE/'     # MIDI files path
+    self.SMF_LIST_FILE = 'LIST.TXT'                 # Play list file: 'title,file name,factor' in each line
+    self.SMF_TRACK_BUFFER = 64                      # Buffer bytes for each track
+    self.SMF_MAX_TRACKS = 32                        # Tracks to play at most
+    self.SMF_IMPORT_BUFFER = 256                    # Bytes to write at once in importing
+    self.smf_list = None
+    self.smf_playlist_file = None                   # File of the song playing in the playlist
+
+  # Set/Get MIDI file path
+  def set_midi_file_path(self, path = None):
+    if path is None:
+      return self.MIDI_FILE_PATH
+
+    self.MIDI_FILE_PATH = path
+    self.smf_list = None
+
+  # Load the play list
+  #   Returns [(title, file name, factor), ..]
+  #     factor: Note-on velocity factor of the song
+  def load_list(self):
+    smf_list = []
+    f = self.sdcard_obj.file_open(self.MIDI_FILE_PATH, self.SMF_LIST_FILE)
+    if not f is None:
+      for line in f:
+        items = line.strip().rsplit(',', 2)
+        if len(items) == 3:
+          try:
+            smf_list.append((items[0], items[1].strip(), float(items[2])))
+          except ValueError:
+            print('SMF PLAYER: Bad list line:', line)
+
+      self.sdcard_obj.file_close()
+
+    self.smf_list = smf_list
+    return smf_list
+
+  # Get a play list item (the list is loaded at the first call)
+  #   Returns (title, file name, factor) or None
+  def get_list_item(self, num):
+    if self.smf_list is None:
+      self.load_list()
+
+    if 0 <= num and num < len(self.smf_list):
+      return self.smf_list[num]
+
+    return None
+
+  # Number of the songs in the play list
+  def list_len(self):
+    if self.smf_list is None:
+      self.load_list()
+
+    return len(self.smf_list)
+
+  # Open a MIDI file and find the tracks
+  #   Returns (file, [smf_track_class, ..], division) or None, needs to close the file
+  def smf_open(self, fname):
+    f = self.sdcard_obj.binary_open(self.MIDI_FILE_PATH, fname)
+    if f is None:
+      return None
+
+    try:
+      size = f.seek(0, 2)
+      f.seek(0)
+      header = f.read(14)
+      if len(header) < 14 or header[0:4] != b'MThd':
+        print('SMF PLAYER: Not a MIDI file.', fname)
+        f.close()
+        return None
+
+      # Header chunk
+      fmt = (header[8] << 8) | header[9]
+      division = (header[12] << 8) | header[13]
+      if fmt > 1:
+        print('SMF PLAYER: Unsupported format.', fname, fmt)
+        f.close()
+        return None
+
+      # Track chunks
+      tracks = []
+      pos = 8 + ((header[4] << 24) | (header[5] << 16) | (header[6] << 8) | header[7])
+      while pos + 8 <= size and len(tracks) < self.SMF_MAX_TRACKS:
+        f.seek(pos)
+        chunk = f.read(8)
+        chunk_len = (chunk[4] << 24) | (chunk[5] << 16) | (chunk[6] << 8) | chunk[7]
+        if chunk[0:4] == b'MTrk':
+          tracks.append(smf_track_class(f, pos + 8, min(pos + 8 + chunk_len, size), self.SMF_TRACK_BUFFER))
+          if fmt == 0:
+            break
+
+        pos = pos + 8 + chunk_len
+
+      return (f, tracks, division)
+
+    except Exception as e:
+      print('SMF PLAYER: Can not read.', e, fname)
+      f.close()
+
+    return None
+
+  # Merge the tracks in the order of the ticks
+  #   The event at the earliest tick of the tracks is taken one by one,
+  #   the events at the same tick are in the order of the tracks.
+  #   Yields (tick, kind, data), see smf_track_class.read_event()
+  def smf_merge(self, tracks):
+    heap = []
+    for trk in range(len(tracks)):
+      if tracks[trk].read_event():
+        heapq.heappush(heap, (tracks[trk].tick, trk))
+
+    while len(heap) > 0:
+      tick, trk = heapq.heappop(heap)
+      track = tracks[trk]
+      kind, data = track.event
+      if track.read_event():
+        heapq.heappush(heap, (track.tick, trk))
+
+      yield (tick, kind, data)
+
+  # Merge the tracks to the events to play, a generator for sequencer_class.play_events()
+  #   The ticks are converted to micro seconds with the tempo events.
+  #   tracks  : [smf_track_class, ..]
+  #   division: Ticks per quarter note (or SMPTE frames and ticks per frame)
+  #   factor  : Note-on velocity factor
+  #   Yields (play_us, tick, midi_bytes)
+  def smf_events(self, tracks, division, factor = 1.0):
+    if len(tracks) == 0:
+      return
+
+    # Time base: us = base_us + (tick - base_tick) * tempo // division
+    tempo = 500000
+    smpte = (division & 0x8000) != 0
+    if smpte:
+      tempo = 1000000
+      division = (256 - (division >> 8)) * (division & 0xff)
+
+    base_us = 0
+    base_tick = 0
+
+    # Messages at the same time are sent together
+    pending = bytearray()
+    pending_us = 0
+    pending_tick = 0
+    for tick, kind, data in self.smf_merge(tracks):
+      evt_us = base_us + (tick - base_tick) * tempo // division
+      if kind == tracks[0].EVENT_TEMPO:
+        if not smpte and data > 0:
+          base_us = evt_us
+          base_tick = tick
+          tempo = data
+
+        continue
+
+      if kind == tracks[0].EVENT_METER:
+        continue
+
+      # Note on velocity
+      if kind == tracks[0].EVENT_MIDI and (data[0] & 0xf0) == 0x90 and data[2] > 0 and factor != 1.0:
+        data = bytes((data[0], data[1], min(max(int(data[2] * factor), 1), 127)))
+
+      if evt_us != pending_us and len(pending) > 0:
+        yield (pending_us, pending_tick, self.midi_obj.pack_messages(pending))
+        pending = bytearray()
+
+      pending_us = evt_us
+      pending_tick = tick
+      pending.extend(data)
+
+    if len(pending) > 0:
+      yield (pending_us, pending_tick, self.midi_obj.pack_messages(pending))
+
+  # Convert the events of a MIDI file to score slots, a generator
+  #   The times are quantized to the 'mini_note' grid of the sequencer.
+  #   A slot is yielded when its time passed, the notes still on have the duration 0 then,
+  #   their note data are kept apart and the durations are set when the notes are off.
+  #   So only the current slot and the notes on are in RAM.
+  #   tracks     : [smf_track_class, ..]
+  #   division   : Ticks per quarter note (SMPTE frames are taken as tempo 120)
+  #   mini_note  : Minimum note length of the score (see sequencer_class)
+  #   info       : Settings found in the file are put, see smf_import_info()
+  #   func_off   : Function called with the note data of a slot yielded when the duration is set (None: not called)
+  #   Yields the score slots in the order of the time
+  def smf_score_slots(self, tracks, division, mini_note, info, func_off = None):
+    if (division & 0x8000) != 0:
+      division = (256 - (division >> 8)) * (division & 0xff) // 2
+
+    # Quantize a tick to a time on the score
+    grid = division * 4                 # Ticks per a whole note
+    steps = 2**mini_note                # Times per a whole note
+    quantize = lambda tick: (tick * steps + grid // 2) // grid
+
+    # Tempo and meter changes at a time
+    def change_at(tm, key, value):
+      changes = info['tempo']
+      if len(changes) == 0 or changes[-1]['time'] != tm:
+        changes.append({'time': tm})
+
+      changes[-1][key] = value
+
+    # Set the duration of a note off
+    def note_off(slot, note_data, tm):
+      note_data['duration'] = max(tm - slot['time'], 1)
+      if note_data['duration'] > slot['max_duration']:
+        slot['max_duration'] = note_data['duration']
+
+      if not func_off is None and not slot is current:
+        func_off(note_data)
+
+    current = None    # Slot at the current time, not yielded yet
+    notes_on = {}     # {(channel, note): [(slot, note data), ..]}
+    tm = 0
+    for tick, kind, data in self.smf_merge(tracks):
+      tm = quantize(tick)
+      if not current is None and current['time'] < tm:
+        yield current
+        current = None
+
+      if kind == tracks[0].EVENT_TEMPO:
+        if data > 0:
+          change_at(tm, 'tempo', min(max((60000000 + data // 2) // data, 6), 999))
+
+      elif kind == tracks[0].EVENT_METER:
+        change_at(tm, 'time_per_bar', max(data[0] * steps >> data[1], 1))
+
+      elif kind == tracks[0].EVENT_MIDI:
+        status = data[0] & 0xf0
+        channel = data[0] & 0x0f
+
+        # Note on
+        if status == 0x90 and data[2] > 0:
+          if current is None:
+            current = {'time': tm, 'max_duration': 0, 'notes': []}
+
+          note_data = {'channel': channel, 'note': data[1], 'velocity': data[2], 'duration': 0}
+          current['notes'].append(note_data)
+          key = (channel, data[1])
+          if key in notes_on:
+            notes_on[key].append((current, note_data))
+          else:
+            notes_on[key] = [(current, note_data)]
+
+        # Note off
+        elif status == 0x80 or status == 0x90:
+          key = (channel, data[1])
+          if key in notes_on:
+            slot, note_data = notes_on[key].pop(0)
+            if len(notes_on[key]) == 0:
+              del notes_on[key]
+
+            note_off(slot, note_data, tm)
+
+        # The first program, bank and volume of each channel
+        elif status == 0xc0:
+          if info['program'][channel] is None:
+            info['program'][channel] = data[1]
+
+        elif status == 0xb0:
+          if data[1] == 0 and info['gmbank'][channel] is None:
+            info['gmbank'][channel] = data[2]
+          elif data[1] == 7 and info['volume'][channel] is None:
+            info['volume'][channel] = data[2] * 100 // 127
+
+    # Notes not off end at the last time
+    for key in notes_on.keys():
+      for slot, note_data in notes_on[key]:
+        note_off(slot, note_data, tm)
+
+    if not current is None:
+      yield current
+
+  # Settings to find in a MIDI file
+  #   'tempo': Tempo and meter changes (sequencer_class.seq_score_tempo)
+  #   'program', 'gmbank', 'volume': The first values of each channel (None: not found)
+  def smf_import_info(self):
+    return {'tempo': [], 'program': [None] * 16, 'gmbank': [None] * 16, 'volume': [None] * 16}
+
+  # Make sequencer data of an imported MIDI file
+  #   info : Settings found in the file
+  #   score: Score slots
+  def smf_import_data(self, info, mini_note, score):
+    control = {'tempo': 120, 'mini_note': mini_note, 'time_per_bar': 2**mini_note, 'disp_time': [0,12], 'disp_key': [[57,74],[57,74]], 'time_cursor': 0, 'key_cursor': [60,60], 'program':[0] * 16, 'gmbank':[0] * 16}
+    channels = []
+    for ch in range(16):
+      channels.append({'gmbank': 0 if info['gmbank'][ch] is None else info['gmbank'][ch], 'program': 0 if info['program'][ch] is None else info['program'][ch], 'volume': 100 if info['volume'][ch] is None else info['volume'][ch]})
+      control['program'][ch] = channels[ch]['program']
+      control['gmbank'][ch] = channels[ch]['gmbank']
+
+    # The tempo and the meter at the start
+    tempo = list(info['tempo'])
+    if len(tempo) > 0 and tempo[0]['time'] == 0:
+      for key in ['tempo', 'time_per_bar']:
+        if key in tempo[0]:
+          control[key] = tempo[0][key]
+
+      tempo.pop(0)
+
+    return {'channel': channels, 'control': control, 'score': score, 'sign': [], 'tempo': tempo}
+
+  # Import a MIDI file as sequencer data (the whole score is in RAM)
+  #   fname    : MIDI file in the MIDI file path
+  #   mini_note: Minimum note length of the score (see sequencer_class)
+  #   Returns {'channel': .., 'control': .., 'score': .., 'sign': .., 'tempo': ..} or None
+  def smf_import(self, fname, mini_note = 4):
+    smf = self.smf_open(fname)
+    if smf is None:
+      return None
+
+    f, tracks, division = smf
+    info = self.smf_import_info()
+    try:
+      score = list(self.smf_score_slots(tracks, division, mini_note, info)) if len(tracks) > 0 else []
+
+    finally:
+      f.close()
+
+    return self.smf_import_data(info, mini_note, score)
+
+  # Import a MIDI file to a sequencer file in the binary format in a stream
+  #   The MIDI file is read twice: the settings and the number of the slots first,
+  #   then the slots are encoded and written through a bounded buffer.
+  #   The duration of a note still on when its slot is written is written when the note is off,
+  #   in the buffer or in the file written already.
+  #   fname    : MIDI file in the MIDI file path
+  #   path, num: Sequencer file to write (SEQSC###.bin)
+  #   mini_note: Minimum note length of the score (see sequencer_class)
+  #   Returns True if the file is written
+  def smf_import_file(self, fname, path, num, mini_note = 4):
+    # Settings and the number of the slots
+    smf = self.smf_open(fname)
+    if smf is None:
+      return False
+
+    f, tracks, division = smf
+    info = self.smf_import_info()
+    slots = 0
+    try:
+      if len(tracks) > 0:
+        for score in self.smf_score_slots(tracks, division, mini_note, info):
+          slots = slots + 1
+
+    finally:
+      f.close()
+
+    # Write the header, then the slots to <file>.tmp, the file is replaced at the end
+    smf = self.smf_open(fname)
+    if smf is None:
+      return False
+
+    f, tracks, division = smf
+    seq_fname = self.sequencer_obj.sequencer_file_name(num, self.sequencer_obj.SEQ_FORMAT_BINARY)
+    seq_file = self.sdcard_obj.binary_create(path, seq_fname + '.tmp')
+    if seq_file is None:
+      f.close()
+      return False
+
+    # Output: [buffer, bytes written to the file], durations to write: {id(note data): file position}
+    out = [None, 0]
+    durations = {}
+
+    # Write the duration of a note off
+    def write_duration(note_data):
+      pos = durations.pop(id(note_data))
+      duration = self.sequencer_obj.sequencer_binary_value(note_data['duration'], 0xffff)
+      if pos >= out[1]:
+        out[0][pos - out[1]] = duration & 0xff
+        out[0][pos - out[1] + 1] = duration >> 8
+      else:
+        seq_file.seek(pos)
+        seq_file.write(bytes((duration & 0xff, duration >> 8)))
+        seq_file.seek(out[1])
+
+    try:
+      out[0] = self.sequencer_obj.sequencer_encode_binary_header(self.smf_import_data(info, mini_note, []))
+      self.sequencer_obj.sequencer_put_varint(out[0], slots)
+      tm = 0
+      if len(tracks) > 0:
+        for score in self.smf_score_slots(tracks, division, mini_note, self.smf_import_info(), write_duration):
+          buf = out[0]
+          self.sequencer_obj.sequencer_put_slot(buf, score['time'] - tm, score['notes'])
+          tm = score['time']
+
+          # The notes on, their durations are at the 4th byte of the notes
+          pos = out[1] + len(buf) - len(score['notes']) * 5 + 3
+          for note_data in score['notes']:
+            if note_data['duration'] == 0:
+              durations[id(note_data)] = pos
+            pos = pos + 5
+
+          if len(buf) >= self.SMF_IMPORT_BUFFER:
+            seq_file.write(buf)
+            out[0] = bytearray()
+            out[1] = out[1] + len(buf)
+
+      seq_file.write(out[0])
+      seq_file.close()
+      self.sdcard_obj.file_replace(path, seq_fname)
+      self.sequencer_obj.sequencer_file_updated(path, num)
+      print('SMF PLAYER: Imported.', fname, path + seq_fname, slots)
+      return True
+
+    except Exception as e:
+      print('SMF PLAYER: Can not import.', e, fname)
+      seq_file.close()
+      self.sdcard_obj.file_remove(path, seq_fname + '.tmp')
+
+    finally:
+      f.close()
+
+    return False
+
+  # Play a song in the play list
+  #   num               : Song number in the play list
+  #   func_pause_or_stop: Stop button scan (see sequencer_class.play_events())
+  #   func_pause_to_stop: Pause control (see sequencer_class.play_events())
+  #   Returns True if the song is played
+  def play_file(self, num, func_pause_or_stop = None, func_pause_to_stop = None):
+    item = self.get_list_item(num)
+    if item is None:
+      print('SMF PLAYER: No song.', num)
+      return False
+
+    title, fname, factor = item
+    print('SMF PLAYER:', title, fname, factor)
+    smf = self.smf_open(fname)
+    if smf is None:
+      return False
+
+    f, tracks, division = smf
+    try:
+      self.sequencer_obj.play_events(self.smf_events(tracks, division, factor), func_pause_or_stop, func_pause_to_stop)
+
+    finally:
+      f.close()
+
+    return True
+
+  # Close the file of the song playing in the playlist
+  def playlist_close(self):
+    if not self.smf_playlist_file is None:
+      self.smf_playlist_file.close()
+      self.smf_playlist_file = None
+
+  # Events iterators of the songs in the play list, see sequencer_class.sequencer_chain_events()
+  #   nums: Song numbers in the play list to play
+  def smf_playlist_songs(self, nums):
+    for num in nums:
+      self.playlist_close()
+      item = self.get_list_item(num)
+      if item is None:
+        continue
+
+      title, fname, factor = item
+      smf = self.smf_open(fname)
+      if smf is None:
+        print('SMF PLAYER: Can not open the playlist song:', num, fname)
+        continue
+
+      print('SMF PLAYER: Playlist song:', num, title, fname, factor)
+      self.smf_playlist_file, tracks, division = smf
+      yield self.smf_events(tracks, division, factor)
+
+  # Play the songs in the play list in a row without gaps
+  #   nums: Song numbers in the play list to play
+  def play_list(self, nums, func_pause_or_stop = None, func_pause_to_stop = None):
+    try:
+      self.sequencer_obj.play_events(self.sequencer_obj.sequencer_chain_events(self.smf_playlist_songs(nums)), func_pause_or_stop, func_pause_to_stop)
+
+    finally:
+      self.playlist_close()
+
+################# End of SMF Player Class Definition #################
+
+
 ######################
 ### Joy Stick Device
 ######################
@@ -1766,9 +4566,9 @@ class device_joystick_class:
     def controller(self):
         try:
             joystick = self.i2c.readfrom(82, 3)
-            joys_x = int.from_bytes(joystick[0:1], 'little', True)
-            joys_y = int.from_bytes(joystick[1:2], 'little', True)
-            joys_b = int.from_bytes(joystick[2:3], 'little', True)
+            joys_x = joystick[0]
+            joys_y = joystick[1]
+            joys_b = joystick[2]
             self.callback_delegate(joys_x, joys_y, joys_b)
         except:
             print('I2C ERROR.')
@@ -1782,6 +4582,12 @@ class midi_in_instrument_class:
     
         self.midi_recording = 'STOP'
         self.midi_tape = []
+
+        # Tape export (Standard MIDI File)
+        self.TAPE_FILE_PATH = '/SD/SYNTH/MIDIFILE/'
+        self.TAPE_FILE_NAME = 'TAPE.MID'
+        self.SMF_DIVISION = 480                          # Ticks per quarter note
+        self.SMF_TEMPO_US = 500000                       # Micro seconds per quarter note (tempo 120)
         
     def set_midi_recording(self, record=None):
         if not record is None:
@@ -1794,6 +4600,46 @@ class midi_in_instrument_class:
 
     def get_midi_tape(self):
         return self.midi_tape
+
+    # Export the tape to a Standard MIDI File (format 1: a tempo track and the tape track)
+    #   tape: Tape to export (None: the current tape)
+    def export_tape(self, path=None, fname=None, tape=None):
+        if path is None:
+            path = self.TAPE_FILE_PATH
+        if fname is None:
+            fname = self.TAPE_FILE_NAME
+
+        f = self.midi_obj.sdcard_obj.binary_create(path, fname)
+        if f is None:
+            return False
+
+        writer = smf_writer_class(f)
+        try:
+            writer.header(1, 2, self.SMF_DIVISION)
+            writer.begin_track()
+            writer.tempo(0, self.SMF_TEMPO_US)
+            writer.end_track()
+
+            writer.begin_track()
+            if tape is None:
+                tape = self.get_midi_tape()
+
+            if len(tape) > 0:
+                tick_start = tape[0][0]
+                for tick, midi_data in tape:
+                    writer.messages(time.ticks_diff(tick, tick_start) * self.SMF_DIVISION // self.SMF_TEMPO_US, midi_data)
+
+            writer.end_track()
+            print('TAPE EXPORTED:', path + fname)
+            return True
+
+        except Exception as e:
+            print('TAPE EXPORT ERROR:', e, path, fname)
+
+        finally:
+            f.close()
+
+        return False
     
     def play_tape(self):
         self.set_midi_recording('PLAY')
@@ -1848,6 +4694,9 @@ class unipico_application_class:
 
         self.midi_channel = -1
         self.sequencer_file = 0
+        self.smf_file = 0
+        self.playlist_mode = 'SEQ'  # Playlist of the sequencer files from the current file ('SEQ') or the SMF play list ('SMF')
+        self.lists_ready = False    # The file lists are loaded by the storage worker
 
         self.sequencer_playing = False
         self.sequencer_pause = False
@@ -1864,17 +4713,19 @@ class unipico_application_class:
         self.MENU_MIN_PLAY_MVOL     = 4
         self.MENU_MIN_PLAY_CTRL     = 5
         self.MENU_MIN_MIDI_SET      = 6
-        self.MENU_MIN_CH01_CHN_INST = 7
-        self.MENU_MIN_CH01_REV_PROG = 8
-        self.MENU_MIN_CH01_REV_LEVL = 9
-        self.MENU_MIN_CH01_REV_FDBK = 10
-        self.MENU_MIN_CH01_CHR_PROG = 11
-        self.MENU_MIN_CH01_CHR_LEVL = 12
-        self.MENU_MIN_CH01_CHR_FDBK = 13
-        self.MENU_MIN_CH01_CHR_DELY = 14
-        self.MENU_MIN_CH01_VIB_RATE = 15
-        self.MENU_MIN_CH01_VIB_DEPT = 16
-        self.MENU_MIN_CH01_VIB_DELY = 17
+        self.MENU_SMF_FILE          = 7
+        self.MENU_PLAYLIST          = 8
+        self.MENU_MIN_CH01_CHN_INST = 9
+        self.MENU_MIN_CH01_REV_PROG = 10
+        self.MENU_MIN_CH01_REV_LEVL = 11
+        self.MENU_MIN_CH01_REV_FDBK = 12
+        self.MENU_MIN_CH01_CHR_PROG = 13
+        self.MENU_MIN_CH01_CHR_LEVL = 14
+        self.MENU_MIN_CH01_CHR_FDBK = 15
+        self.MENU_MIN_CH01_CHR_DELY = 16
+        self.MENU_MIN_CH01_VIB_RATE = 17
+        self.MENU_MIN_CH01_VIB_DEPT = 18
+        self.MENU_MIN_CH01_VIB_DELY = 19
 
         self.menu_change_dir = 0
         self.value_change_dir = 0
@@ -1890,7 +4741,9 @@ class unipico_application_class:
                 [('MIN:SAVE',    '', None),              ('SET:',  '{:03d}', self.save_midi_set)],
                 [('PLAY:', '{:03d}', self.get_midi_set), ('MVOL:', '{:03d}', self.get_master_volume)],
                 [('PLAY:', '{:03d}', self.get_midi_set), ('CTRL:', '{:s}'  , self.get_min_play_ctrl)],
-                [('MIN:LOAD',    '', None),              ('SET:',  '{:03d}', self.get_midi_set)]
+                [('MIN:LOAD',    '', None),              ('SET:',  '{:03d}', self.get_midi_set)],
+                [('SMF:PLAY',    '', None),              ('FILE:', '{:03d}', self.get_smf_file)],
+                [('LIST:PLY',    '', None),              ('',      '{:s}',   self.get_playlist_mode)]
             ]
         for ch in list(range(1,17)):
             ch_str = 'CH{:02d}'.format(ch)
@@ -1910,20 +4763,47 @@ class unipico_application_class:
         midi_in_set = midi_in_player_obj.read_midi_in_settings(0)
         if not midi_in_set is None:
             print('LOAD MIDI-IN DEFAULT:', midi_in_set)
-            midi_in_player_obj.set_midi_in_setting(midi_in_set)
+            midi_in_player_obj.set_midi_in_setting(midi_in_set, 0)
             midi_in_player_obj.send_all_midi_in_settings()        
 
+        # List the files in the storage worker, the file menus work after listed
+        storage_worker_obj.request('list seq', sequencer_obj.sequencer_file_index().numbers)
+        storage_worker_obj.request('list smf', smf_player_obj.list_len, (), self.lists_loaded)
+
+    # The file lists are loaded (storage worker notification)
+    def lists_loaded(self, result):
+        print('FILE LISTS LOADED.')
+        self.lists_ready = True
+
     def get_seq_file(self, delta=0):
-        if delta != 0:
+        if delta != 0 and self.lists_ready:
+            # Existing files only
+            seq_index = sequencer_obj.sequencer_file_index()
+            self.sequencer_file = seq_index.next(self.sequencer_file, delta)
+
+            # The file header is read by the storage worker
+            seq_file = self.sequencer_file
+            storage_worker_obj.request('seq info', seq_index.info, (seq_file,), lambda info: print('SEQ FILE:', seq_file, info))
+
+        return self.sequencer_file
+
+    def get_smf_file(self, delta=0):
+        if delta != 0 and self.lists_ready:
             if delta < 0:
                 delta = -1
             elif delta > 0:
                 delta = 1
 
-            self.sequencer_file = (self.sequencer_file + delta) % 1000
+            self.smf_file = (self.smf_file + delta) % max(smf_player_obj.list_len(), 1)
 
-        return self.sequencer_file
+        return self.smf_file
     
+    def get_playlist_mode(self, delta=0):
+        if delta != 0:
+            self.playlist_mode = 'SMF' if self.playlist_mode == 'SEQ' else 'SEQ'
+
+        return self.playlist_mode + ' ' + '{:03d}'.format(self.sequencer_file if self.playlist_mode == 'SEQ' else self.smf_file)
+
     def get_tape_mode(self,delta=0):
         return midi_in_instrument.set_midi_recording()
         
@@ -1942,18 +4822,29 @@ class unipico_application_class:
                 
             set_num = midi_in_player_obj.set_midi_in_set_num()
             print('MIDI SET DELTA:', set_num, delta)
-            set_num = (set_num + delta) % 1000
+            set_num = midi_in_player_obj.midi_in_set_index().next(set_num, delta)
             midi_in_player_obj.set_midi_in_set_num(set_num)
             set_number = midi_in_player_obj.set_midi_in_set_num()
 
-            midi_in_set = midi_in_player_obj.read_midi_in_settings(set_number)
-            if not midi_in_set is None:
-                print('LOAD MIDI-IN SET:', set_number, midi_in_set)
-                midi_in_player_obj.set_midi_in_setting(midi_in_set)
-                midi_in_player_obj.send_all_midi_in_settings()
-                self.midi_in_save_file = set_num
+            # The file is read by the storage worker, only the last set selected is loaded
+            storage_worker_obj.request('load midi set', midi_in_player_obj.read_midi_in_settings, (set_number,), lambda midi_in_set: self.midi_set_loaded(set_number, midi_in_set))
 
         return midi_in_player_obj.set_midi_in_set_num()
+
+    # MIDI-IN set file is loaded (storage worker notification)
+    def midi_set_loaded(self, set_number, midi_in_set):
+        if not midi_in_set is None and set_number == midi_in_player_obj.set_midi_in_set_num():
+            print('LOAD MIDI-IN SET:', set_number, midi_in_set)
+            midi_in_player_obj.set_midi_in_setting(midi_in_set, set_number)
+            midi_in_player_obj.send_all_midi_in_settings()
+            self.midi_in_save_file = set_number
+
+    # MIDI-IN set file is saved (storage worker notification)
+    def midi_set_saved(self, saved):
+        print('SAVED' if saved else 'NOT SAVED')
+        if self.menu_selected == self.MENU_MIN_SAVE:
+            display.setText('SAV' if saved else 'ERR', 0, 1)
+            display.show()
     
     def get_master_volume(self, delta=0):
         vol = midi_obj.get_master_volume() + delta
@@ -1982,7 +4873,13 @@ class unipico_application_class:
         if self.disp_inst_as_number:
             return '#{:03d}'.format(prog)
 
-        pname = midi_obj.get_gm_program_name(midi_obj.gmbank(), prog)
+        # The names file is read by the storage worker, then the menu is shown again
+        gmbank = midi_obj.gmbank()
+        if not midi_obj.gm_name_loaded(gmbank):
+            storage_worker_obj.request('gm name', midi_obj.gm_name_table, (gmbank,), lambda table: self.show_menu())
+            return '#{:03d}'.format(prog)
+
+        pname = midi_obj.get_gm_program_name(gmbank, prog)
         return pname[:8]
 
 
@@ -2183,8 +5080,8 @@ class unipico_application_class:
                 self.midi_in_player_controller = not self.midi_in_player_controller
                 self.show_menu()
 
-            # Sequencer Player control
-            elif self.menu_selected == self.MENU_SEQ_FILE:
+            # Sequencer Player and SMF Player control
+            elif self.menu_selected == self.MENU_SEQ_FILE or self.menu_selected == self.MENU_SMF_FILE or self.menu_selected == self.MENU_PLAYLIST:
                 # Stop trigger
                 if self.sequencer_playing:
                     self.sequencer_stop = True
@@ -2194,22 +5091,25 @@ class unipico_application_class:
                 # Play
                 else:
                     self.sequencer_playing = True
-                    self.make_order('play sequencer', (self.sequencer_file,))
+                    if self.menu_selected == self.MENU_SEQ_FILE:
+                        self.make_order('play sequencer', (self.sequencer_file,))
+                    elif self.menu_selected == self.MENU_SMF_FILE:
+                        self.make_order('play smf', (self.smf_file,))
+                    else:
+                        self.make_order('play list', (self.playlist_mode, self.sequencer_file if self.playlist_mode == 'SEQ' else self.smf_file))
                     utime.sleep_ms(1000)
                     
             # MIDI-IN set file save action
             elif self.menu_selected == self.MENU_MIN_SAVE:
                 print('SAVE MIDI-IN SET:', self.midi_in_save_file)
-                midi_in_player_obj.write_midi_in_settings(self.midi_in_save_file)
-                print('SAVED')
-                display.setText('SAV', 0, 1)
-                display.show()
+                storage_worker_obj.request(('save midi set', self.midi_in_save_file), midi_in_player_obj.write_midi_in_settings, (self.midi_in_save_file,), self.midi_set_saved, False)
 
             # Tape recording
             elif self.menu_selected == self.MENU_TAPE_RECORD:
                 mode = midi_in_instrument.set_midi_recording()
                 if mode == 'RECORD':
                     midi_in_instrument.set_midi_recording('STOP')
+                    storage_worker_obj.request(None, midi_in_instrument.export_tape, (None, None, midi_in_instrument.get_midi_tape()), None, False)
                 elif mode == 'STOP':
                     midi_in_instrument.set_midi_recording('RECORD')
 
@@ -2332,10 +5232,11 @@ class unipico_application_class:
         self.sequencer_playing = True
         self.sequencer_pause = False
         self.sequencer_stop = False
-        sequencer_obj.sequencer_load_file(sequencer_obj.set_sequencer_file_path(), file_num[0])
+        sequencer_obj.sequencer_stream_file(sequencer_obj.set_sequencer_file_path(), file_num[0])
         sequencer_obj.send_all_sequencer_settings()
         sequencer_obj.pre_play_sequencer()
         sequencer_obj.play_sequencer(self.sequencer_pause_or_stop, self.sequencer_pause_to_stop, None, None)
+        sequencer_obj.sequencer_stream_close()
 
         # Retrieve the cursor position
         sequencer_obj.post_play_sequencer()
@@ -2343,6 +5244,43 @@ class unipico_application_class:
         self.sequencer_pause = False
         self.sequencer_stop = False
 
+    # ORDER: play SMF
+    def order_play_smf(self, file_num):
+        self.sequencer_playing = True
+        self.sequencer_pause = False
+        self.sequencer_stop = False
+        smf_player_obj.play_file(file_num[0], self.sequencer_pause_or_stop, self.sequencer_pause_to_stop)
+        self.sequencer_playing = False
+        self.sequencer_pause = False
+        self.sequencer_stop = False
+
+    # ORDER: play the playlist from the file to the last file
+    def order_play_list(self, args):
+        mode, file_num = args
+        self.sequencer_playing = True
+        self.sequencer_pause = False
+        self.sequencer_stop = False
+        if mode == 'SEQ':
+            path = sequencer_obj.set_sequencer_file_path()
+            nums = [num for num in sequencer_obj.sequencer_file_index().numbers() if num >= file_num]
+            if len(nums) > 0:
+                # The cursor of the first file is backuped and retrieved, the playlist leaves the last song loaded
+                sequencer_obj.sequencer_stream_file(path, nums[0], False)
+                sequencer_obj.sequencer_stream_close()
+                sequencer_obj.pre_play_sequencer()
+                sequencer_obj.play_playlist(path, nums, self.sequencer_pause_or_stop, self.sequencer_pause_to_stop)
+
+                # Reload the first file to retrieve its cursor position
+                sequencer_obj.sequencer_stream_file(path, nums[0], False)
+                sequencer_obj.sequencer_stream_close()
+                sequencer_obj.post_play_sequencer()
+        else:
+            smf_player_obj.play_list(list(range(file_num, smf_player_obj.list_len())), self.sequencer_pause_or_stop, self.sequencer_pause_to_stop)
+
+        self.sequencer_playing = False
+        self.sequencer_pause = False
+        self.sequencer_stop = False
+
     # Application main loop
     def app_loop(self):     
         # PICO settings
@@ -2359,7 +5297,19 @@ class unipico_application_class:
                     print('SEQ ORDER[1]:', order[1])
                     self.order_play_sequencer(order[1])
 
-            utime.sleep_ms(200)
+                elif order[0] == 'play smf':
+                    print('SMF ORDER[1]:', order[1])
+                    self.order_play_smf(order[1])
+
+                elif order[0] == 'play list':
+                    print('LIST ORDER[1]:', order[1])
+                    self.order_play_list(order[1])
+
+            # Storage requests (the players run them in the spare time while playing)
+            if storage_worker_obj.service():
+                continue
+
+            utime.sleep_ms(20)
             
 ################# End of Application class #################
 
@@ -2376,6 +5326,9 @@ if __name__ == '__main__':
 
         # Device Manager
         device_manager_obj = device_manager_class()
+
+        # Storage worker, the completions are notified in the device control thread
+        storage_worker_obj = storage_worker_class(device_manager_obj)
         
         # Joy Stick
         # __init__(self, device_manager, address=82, unit=0, scl_pin=9, sda_pin=8, frequency=400000):
@@ -2396,14 +5349,18 @@ if __name__ == '__main__':
         # Sequencer object
         sequencer_obj = sequencer_class(midi_obj, sdcard_obj)
 
-        # Device control in a thread
-        thread_manager_obj = thread_manager_class()
-        thread_manager_obj.start(device_manager_obj.device_control_thread, (thread_manager_obj, 5,))
+        # SMF Player object
+        smf_player_obj = smf_player_class(midi_obj, sdcard_obj, sequencer_obj)
+        sequencer_obj.set_idle_task(storage_worker_obj.service)
 
-        # LCD
+        # LCD (before the device controller showing the menu)
         display = aqm0802a_lcd_class(62, 1, 7, 6)
         display.setContrast(0)
         display.clear()
+
+        # Device control in a thread
+        thread_manager_obj = thread_manager_class()
+        thread_manager_obj.start(device_manager_obj.device_control_thread, (thread_manager_obj, 5,))
         
         # MIDI default setting
         application.set_default()